@@ -0,0 +1,14 @@
+from dotenv import load_dotenv
+
+from app.core import startup
+
+# CPU pool processes import this package again; they already have the settings and serve nothing
+if not startup.in_cpu_pool_process():
+    # Once for the whole app, before any module reads its settings from the environment
+    load_dotenv()
+    startup.install_import_profiler()
+
+    # Reads LOG_* settings on import, so only now
+    from app.core import log
+
+    log.setup()
@@ -0,0 +1,247 @@
+import asyncio
+import math
+import threading
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from fastapi import HTTPException
+from fastapi.responses import StreamingResponse
+from starlette.background import BackgroundTask
+
+from app.core.metrics import ADMISSION_ACTIVE, ADMISSION_DECISIONS, ADMISSION_QUEUE_DEPTH, STAGE_LATENCY, bind_context
+from app.core.resilience import check_cancelled, is_cancelled, stage_deadline
+
+# Worker threads per pipeline stage. The blocking SDK calls of a stage run on its
+# executor, so the pool size is also the cap on concurrent jobs in that stage.
+STAGE_WORKERS = {
+    "fetch": int(os.getenv("STAGE_WORKERS_FETCH", "8")),
+    "llm": int(os.getenv("STAGE_WORKERS_LLM", "4")),
+    "tts": int(os.getenv("STAGE_WORKERS_TTS", "4")),
+    "encode": int(os.getenv("STAGE_WORKERS_ENCODE", "2")),
+}
+
+_executors: dict[str, ThreadPoolExecutor] = {}
+
+
+def stage_executor(pool: str) -> ThreadPoolExecutor:
+    if pool not in _executors:
+        _executors[pool] = ThreadPoolExecutor(max_workers=STAGE_WORKERS[pool], thread_name_prefix=f"stage-{pool}")
+    return _executors[pool]
+
+
+async def run_in_stage(pool: str, fn, *args, **kwargs):
+    """
+    Runs a blocking callable on the stage's executor so it never blocks the event loop.
+    Time spent waiting for a free worker is recorded as the `queue.<pool>` stage.
+    Upstream calls made by the job get the stage's share of the request deadline.
+    Jobs of a request whose client disconnected while they queued are not started.
+    """
+    submitted = time.perf_counter()
+
+    def job():
+        STAGE_LATENCY.labels(f"queue.{pool}").observe(time.perf_counter() - submitted)
+        check_cancelled(f"stage.{pool}")
+        with stage_deadline(pool):
+            return fn(*args, **kwargs)
+
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(stage_executor(pool), bind_context(job))
+
+
+_STREAM_END = object()
+
+
+async def stream_in_stage(pool: str, fn, *args, **kwargs):
+    """
+    Async generator over a blocking generator run on the stage's executor. Items are
+    handed to the event loop as they are produced. If the consumer stops early the
+    blocking generator is closed from its own thread, so upstream streams get torn down;
+    the same happens when the request is cancelled.
+    """
+    loop = asyncio.get_running_loop()
+    queue: asyncio.Queue = asyncio.Queue()
+    stopped = threading.Event()
+
+    def produce():
+        generator = fn(*args, **kwargs)
+        try:
+            for item in generator:
+                if stopped.is_set() or is_cancelled():
+                    break
+                loop.call_soon_threadsafe(queue.put_nowait, item)
+        except Exception as e:
+            loop.call_soon_threadsafe(queue.put_nowait, e)
+        finally:
+            generator.close()
+            loop.call_soon_threadsafe(queue.put_nowait, _STREAM_END)
+
+    def job_done(task: asyncio.Future):
+        # The job can fail before produce runs (request cancelled or out of time while queued)
+        if not task.cancelled() and task.exception() is not None:
+            queue.put_nowait(task.exception())
+            queue.put_nowait(_STREAM_END)
+
+    # Holds a worker of the pool for as long as the stream runs, like any other job of the stage
+    task = asyncio.ensure_future(run_in_stage(pool, produce))
+    task.add_done_callback(job_done)
+    try:
+        while (item := await queue.get()) is not _STREAM_END:
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        # Takes effect when the next item arrives
+        stopped.set()
+        task.cancel()
+
+
+class AdmissionRejected(HTTPException):
+    """429 for a request shed because the admission queue is full."""
+
+
+class AdmissionSlot:
+    """An admission slot held by a request, released once."""
+
+    def __init__(self, controller: "AdmissionController"):
+        self.controller = controller
+        self.started = time.perf_counter()
+        self.handed_over = False
+        self.released = False
+
+    def release(self):
+        if not self.released:
+            self.released = True
+            self.controller.record_job(time.perf_counter() - self.started)
+            self.controller.release()
+
+    def hand_over(self):
+        """Keeps the slot past the end of the handler; returns the callable that releases it."""
+        self.handed_over = True
+        return self.release
+
+
+def hold_while_streaming(response: StreamingResponse, *releases) -> StreamingResponse:
+    """
+    Calls releases once the response's body is done: when it ends, fails or is
+    cancelled, or after the response if the body never started. Dependencies exit
+    before a streamed body is sent, so what they hold for the request (see
+    AdmissionSlot.hand_over, DisconnectWatch.hand_over) is handed to the stream with this.
+    """
+    done = False
+
+    def release():
+        nonlocal done
+        if not done:
+            done = True
+            for callback in releases:
+                callback()
+
+    body = response.body_iterator
+
+    async def stream():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            release()
+
+    previous = response.background
+
+    async def after_response():
+        release()
+        if previous is not None:
+            await previous()
+
+    response.body_iterator = stream()
+    response.background = BackgroundTask(after_response)
+    return response
+
+
+class AdmissionController:
+    """
+    Caps the number of heavy jobs running at once and queues the overflow up to
+    max_queue. Beyond that requests are shed with 429 and a Retry-After derived
+    from the queue length and the recent average job duration.
+    """
+
+    def __init__(self, name: str, max_active: int, max_queue: int, initial_job_seconds: float = 60.0):
+        self.name = name
+        self.max_active = max_active
+        self.max_queue = max_queue
+        self._active = 0
+        self._waiters: deque[asyncio.Future] = deque()
+        # Exponentially weighted average of job duration, seeds the Retry-After estimate
+        self._avg_job_seconds = initial_job_seconds
+
+    def retry_after(self) -> int:
+        jobs_ahead = len(self._waiters) + 1
+        return max(1, math.ceil(jobs_ahead * self._avg_job_seconds / self.max_active))
+
+    def _update_gauges(self):
+        ADMISSION_ACTIVE.labels(self.name).set(self._active)
+        ADMISSION_QUEUE_DEPTH.labels(self.name).set(len(self._waiters))
+
+    async def acquire(self):
+        if self._active < self.max_active and not self._waiters:
+            self._active += 1
+            ADMISSION_DECISIONS.labels(self.name, "admitted").inc()
+            self._update_gauges()
+            return
+
+        if len(self._waiters) >= self.max_queue:
+            ADMISSION_DECISIONS.labels(self.name, "rejected").inc()
+            raise AdmissionRejected(
+                status_code=429,
+                detail="Server is at capacity. Please retry later.",
+                headers={"Retry-After": str(self.retry_after())},
+            )
+
+        waiter = asyncio.get_running_loop().create_future()
+        self._waiters.append(waiter)
+        ADMISSION_DECISIONS.labels(self.name, "queued").inc()
+        self._update_gauges()
+        try:
+            # release() hands its slot over directly by resolving the future
+            await waiter
+        except asyncio.CancelledError:
+            if waiter.done() and not waiter.cancelled():
+                self.release()
+            elif waiter in self._waiters:
+                self._waiters.remove(waiter)
+                self._update_gauges()
+            raise
+
+    def release(self):
+        while self._waiters:
+            waiter = self._waiters.popleft()
+            if not waiter.done():
+                waiter.set_result(None)
+                self._update_gauges()
+                return
+        self._active -= 1
+        self._update_gauges()
+
+    def record_job(self, seconds: float):
+        self._avg_job_seconds = 0.8 * self._avg_job_seconds + 0.2 * seconds
+
+    async def slot(self):
+        """
+        FastAPI dependency holding an admission slot for the duration of the request,
+        or of its streamed response when the handler hands the slot over to it.
+        """
+        await self.acquire()
+        held = AdmissionSlot(self)
+        try:
+            yield held
+        finally:
+            if not held.handed_over:
+                held.release()
+
+
+generate_admission = AdmissionController(
+    "generate",
+    max_active=int(os.getenv("GENERATE_MAX_ACTIVE", "4")),
+    max_queue=int(os.getenv("GENERATE_MAX_QUEUE", "16")),
+)
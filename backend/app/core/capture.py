@@ -0,0 +1,103 @@
+import contextvars
+import hashlib
+import json
+import os
+import queue
+import random
+import threading
+import time
+
+from app.core.resilience import UPSTREAM_TIMEOUTS
+
+# Traffic capture for capacity planning: one JSON line per captured request with its
+# shape (when, which repo, what was asked for) and where its time went (stages and
+# upstream calls), anonymized. benchmarks/replay.py re-issues it against the app.
+
+# Off unless set: file the records are appended to, shared by all workers
+TRAFFIC_CAPTURE_PATH = os.getenv("TRAFFIC_CAPTURE_PATH", "")
+# Share of requests captured
+TRAFFIC_CAPTURE_SAMPLE_RATE = float(os.getenv("TRAFFIC_CAPTURE_SAMPLE_RATE", "1"))
+# Mixed into the repo hashes so they can't be matched against a list of public repos
+TRAFFIC_CAPTURE_SALT = os.getenv("TRAFFIC_CAPTURE_SALT", "")
+CAPTURED_PATHS = ("/generate", "/generate/cost")
+
+_record: contextvars.ContextVar[dict | None] = contextvars.ContextVar("capture_record", default=None)
+_lines: queue.SimpleQueue = queue.SimpleQueue()
+_writer: threading.Thread | None = None
+_writer_lock = threading.Lock()
+# Queued by close() after the last line
+_STOP = object()
+
+
+def start(method: str, path: str) -> dict | None:
+    """Starts the record of the current request, if it is one that is captured."""
+    if not TRAFFIC_CAPTURE_PATH or method != "POST" or path not in CAPTURED_PATHS:
+        return None
+    if random.random() >= TRAFFIC_CAPTURE_SAMPLE_RATE:
+        return None
+    record = {"ts": round(time.time(), 3), "path": path, "_start": time.perf_counter()}
+    _record.set(record)
+    return record
+
+
+def annotate(**fields):
+    """Adds fields to the current request's record; a no-op for requests not captured."""
+    record = _record.get()
+    if record is not None:
+        record.update(fields)
+
+
+def anonymize(username: str, repo: str) -> str:
+    """Stable id for a repo: repeated requests for it stay recognizable, its name does not."""
+    key = f"{TRAFFIC_CAPTURE_SALT}\0{username.lower()}/{repo.lower()}"
+    return hashlib.sha256(key.encode()).hexdigest()[:16]
+
+
+def finish(record: dict, status: int, trace):
+    """
+    Completes the record with the response status and the trace's spans and queues
+    it for writing. Called when the response starts, so for a streamed response the
+    time spent streaming the body is not included (as in Server-Timing).
+    """
+    record["status"] = status
+    record["duration_ms"] = round((time.perf_counter() - record.pop("_start")) * 1000, 1)
+    stages: dict[str, float] = {}
+    upstreams: dict[str, list[float]] = {}
+    for name, _, duration, _ in trace.spans:
+        if name.split(".", 1)[0] in UPSTREAM_TIMEOUTS:
+            upstreams.setdefault(name, []).append(round(duration * 1000, 1))
+        else:
+            stages[name] = round(stages.get(name, 0) + duration * 1000, 1)
+    record["stages"] = stages
+    record["upstreams"] = upstreams
+    _lines.put(json.dumps(record, separators=(",", ":")) + "\n")
+    _start_writer()
+
+
+def _start_writer():
+    global _writer
+    if _writer is not None:
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = threading.Thread(target=_write_lines, name="traffic-capture", daemon=True)
+            _writer.start()
+
+
+def _write_lines():
+    # O_APPEND and one write per line, so the lines of several workers never interleave
+    fd = os.open(TRAFFIC_CAPTURE_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o600)
+    try:
+        while (line := _lines.get()) is not _STOP:
+            os.write(fd, line.encode())
+    finally:
+        os.close(fd)
+
+
+def close(timeout: float = 5):
+    """Writes the lines still queued and closes the file. Called at shutdown; later records are dropped."""
+    with _writer_lock:
+        writer = _writer
+    if writer is not None and writer.is_alive():
+        _lines.put(_STOP)
+        writer.join(timeout)
@@ -0,0 +1,125 @@
+import multiprocessing
+import os
+import resource
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from multiprocessing import shared_memory
+
+from app.core.metrics import STAGE_IN_FLIGHT, record_stage, stage
+from app.core.startup import CPU_POOL_PARENT_ENV
+
+# Processes per uvicorn worker for CPU-bound post-processing; 0 runs the jobs in the calling thread
+CPU_POOL_WORKERS = int(os.getenv("CPU_POOL_WORKERS", str(min(2, os.cpu_count() or 1))))
+# bytes arguments from this size on are handed over through shared memory instead of being pickled
+SHARED_MEMORY_MIN_BYTES = int(os.getenv("SHARED_MEMORY_MIN_BYTES", str(256 * 1024)))
+
+_pool: ProcessPoolExecutor | None = None
+_pool_lock = threading.Lock()
+
+
+class SharedBuffer:
+    """Stands in for a bytes argument of a pool job; only the shared memory segment's name is pickled."""
+
+    def __init__(self, name: str, size: int):
+        self.name = name
+        self.size = size
+
+    def read(self) -> bytes:
+        # Attaching registers the segment with the resource tracker, which pool processes share with
+        # their parent; the parent's unlink after the job unregisters it again
+        segment = shared_memory.SharedMemory(name=self.name)
+        try:
+            return bytes(segment.buf[:self.size])
+        finally:
+            segment.close()
+
+
+def _warm_up():
+    # Imported once per process instead of on its first job
+    import app.services.postprocess  # noqa: F401
+
+
+def _run_job(fn, args, kwargs) -> tuple[object, float]:
+    """Runs in the pool process. Returns fn's result and the CPU seconds it took, subprocesses included."""
+    cpu_start = time.process_time()
+    children_start = resource.getrusage(resource.RUSAGE_CHILDREN)
+    args = [arg.read() if isinstance(arg, SharedBuffer) else arg for arg in args]
+    result = fn(*args, **kwargs)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    # e.g. the ffmpeg pydub runs to decode
+    children_cpu = (children.ru_utime - children_start.ru_utime) + (children.ru_stime - children_start.ru_stime)
+    return result, time.process_time() - cpu_start + children_cpu
+
+
+def _get_pool() -> ProcessPoolExecutor | None:
+    global _pool
+    if CPU_POOL_WORKERS <= 0:
+        return None
+    with _pool_lock:
+        if _pool is None:
+            # Tells the pool processes apart from uvicorn workers, which are spawned too
+            os.environ[CPU_POOL_PARENT_ENV] = str(os.getpid())
+            # spawn, since forking a process that runs threads (the stage executors) is not safe
+            _pool = ProcessPoolExecutor(max_workers=CPU_POOL_WORKERS, mp_context=multiprocessing.get_context("spawn"),
+                                        initializer=_warm_up)
+        return _pool
+
+
+def start():
+    """Starts the pool's processes ahead of the first job."""
+    pool = _get_pool()
+    if pool is not None:
+        for future in [pool.submit(time.sleep, 0) for _ in range(CPU_POOL_WORKERS)]:
+            future.result()
+
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(cancel_futures=True)
+            _pool = None
+
+
+def run_cpu(name: str, fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) in the process pool and blocks the calling thread (a stage
+    executor thread, never the event loop) until it is done, so CPU-bound work of
+    concurrent requests runs on several cores instead of taking turns on the GIL.
+    fn must be a module-level function. Large bytes arguments travel through shared
+    memory. The job is recorded as stage `name`, with the CPU time of the job itself.
+    """
+    pool = _get_pool()
+    if pool is None:
+        with stage(name):
+            return fn(*args, **kwargs)
+
+    gauge = STAGE_IN_FLIGHT.labels(name)
+    gauge.inc()
+    segments = []
+    start = time.perf_counter()
+    try:
+        job_args = []
+        for arg in args:
+            if isinstance(arg, (bytes, bytearray)) and len(arg) >= SHARED_MEMORY_MIN_BYTES:
+                segment = shared_memory.SharedMemory(create=True, size=len(arg))
+                segment.buf[:len(arg)] = arg
+                segments.append(segment)
+                job_args.append(SharedBuffer(segment.name, len(arg)))
+            else:
+                job_args.append(arg)
+        try:
+            result, cpu = pool.submit(_run_job, fn, job_args, kwargs).result()
+        except BrokenProcessPool:
+            # A pool process died (e.g. killed for memory); the next job gets a new pool
+            shutdown()
+            raise
+    finally:
+        gauge.dec()
+        for segment in segments:
+            segment.close()
+            segment.unlink()
+    record_stage(name, start, time.perf_counter(), cpu)
+    return result
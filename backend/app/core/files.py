@@ -0,0 +1,23 @@
+import os
+import tempfile
+
+
+def atomic_write(path: str, data: bytes):
+    """
+    Writes data to path so a concurrent reader sees either the old file or the new
+    one, never a partial one. The temporary file is uniquely named, so threads and
+    workers writing the same path at once don't trample each other; the last
+    rename wins.
+    """
+    directory, name = os.path.split(path)
+    fd, tmp_path = tempfile.mkstemp(dir=directory or ".", prefix=f"{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except FileNotFoundError:
+            pass
+        raise
@@ -1,4 +1,179 @@
+import asyncio
+import ipaddress
+import logging
+import math
+import os
+import sqlite3
+import time
+
+from fastapi import HTTPException, Request
 from slowapi import Limiter
 from slowapi.util import get_remote_address
 
-limiter = Limiter(key_func=get_remote_address)
+from app.core.metrics import RATE_LIMIT_DECISIONS
+
+logger = logging.getLogger(__name__)
+
+# Peers whose X-Real-IP / X-Forwarded-For headers are believed. nginx on the host reaches the
+# container through docker's port mapping, so it shows up from the bridge network, not as localhost.
+TRUSTED_PROXIES = [ipaddress.ip_network(network.strip()) for network in
+                   os.getenv("TRUSTED_PROXIES", "127.0.0.0/8,::1/128,172.16.0.0/12").split(",") if network.strip()]
+
+
+def client_address(request: Request) -> str:
+    """
+    The IP of the client a request is from. Behind the proxy every request comes from
+    the proxy's address, so for trusted peers the address nginx reports is used; a client
+    that connects directly cannot pass itself off as someone else with those headers.
+    """
+    peer = get_remote_address(request)
+    try:
+        trusted = any(ipaddress.ip_address(peer) in network for network in TRUSTED_PROXIES)
+    except ValueError:
+        trusted = False
+    if trusted:
+        if real_ip := request.headers.get("x-real-ip", "").strip():
+            return real_ip
+        if forwarded := request.headers.get("x-forwarded-for", "").strip():
+            # The last hop is the one the proxy added itself
+            return forwarded.split(",")[-1].strip()
+    return peer
+
+
+# Request-count limits (slowapi). Set RATE_LIMIT_STORAGE_URI (e.g. redis://host:6379)
+# to share counters across workers and containers; the default is per process.
+limiter = Limiter(key_func=client_address, storage_uri=os.getenv("RATE_LIMIT_STORAGE_URI", "memory://"))
+
+# Retry-After for a bucket that does not refill
+NO_REFILL_RETRY_AFTER = 3600
+
+
+class Bucket:
+    def __init__(self, name: str, capacity: float, refill_per_hour: float):
+        self.name = name
+        self.capacity = capacity
+        self.refill_per_second = refill_per_hour / 3600
+
+
+class SQLiteTokenBuckets:
+    """
+    Token buckets kept in a SQLite file so every uvicorn worker (and any container
+    mounting the same volume) draws from the same balance. Each take() is one
+    BEGIN IMMEDIATE transaction, so concurrent workers cannot double spend.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with self._connect() as conn:
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL, updated REAL NOT NULL)")
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=2, isolation_level=None)
+
+    def take(self, charges: list[tuple[str, Bucket, float]], allow_debt: bool = False) -> float:
+        """
+        Atomically withdraws cost from each (key, bucket, cost). All or nothing.
+
+        Returns:
+            float: 0 if the charge went through, otherwise seconds until it would fit.
+                   With allow_debt the charge always goes through and balances may go negative.
+        """
+        now = time.time()
+        conn = self._connect()
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            balances = []
+            retry_after = 0.0
+            for key, bucket, cost in charges:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = bucket.capacity if row is None else min(
+                    bucket.capacity, row[0] + (now - row[1]) * bucket.refill_per_second)
+                if tokens < cost and not allow_debt:
+                    retry_after = max(retry_after, (cost - tokens) / bucket.refill_per_second
+                                      if bucket.refill_per_second > 0 else NO_REFILL_RETRY_AFTER)
+                # A refund (negative cost) cannot lift the balance past capacity either
+                balances.append((key, min(bucket.capacity, tokens - cost)))
+
+            if retry_after:
+                conn.execute("ROLLBACK")
+                return retry_after
+            conn.executemany("INSERT OR REPLACE INTO buckets (key, tokens, updated) VALUES (?, ?, ?)",
+                             [(key, tokens, now) for key, tokens in balances])
+            conn.execute("COMMIT")
+            return 0.0
+        finally:
+            conn.close()
+
+
+class CostLimiter:
+    """
+    Limits by estimated work instead of request count. Each client has its own
+    bucket and all clients share a global one sized to our LLM/TTS capacity.
+    Units: one unit is roughly a no-audio generation of a small repo.
+
+    The SQLite transactions block, so they run in a thread. If the database stays
+    locked the limiter fails open: it lets the request through and logs a warning.
+    """
+
+    def __init__(self, store: SQLiteTokenBuckets, client_bucket: Bucket, global_bucket: Bucket):
+        self.store = store
+        self.client_bucket = client_bucket
+        self.global_bucket = global_bucket
+
+    def _charges(self, client: str, cost: float):
+        return [(f"client:{client}", self.client_bucket, cost), ("global", self.global_bucket, cost)]
+
+    async def _take(self, client: str, cost: float, allow_debt: bool = False) -> float:
+        try:
+            return await asyncio.to_thread(self.store.take, self._charges(client, cost), allow_debt)
+        except sqlite3.OperationalError as e:
+            logger.warning("Rate limit store unavailable, not limiting: %s", e)
+            RATE_LIMIT_DECISIONS.labels("store_error").inc()
+            return 0.0
+
+    async def charge(self, client: str, cost: float):
+        """Charges up front, raising 429 with Retry-After if either bucket is short."""
+        retry_after = await self._take(client, cost)
+        if retry_after:
+            RATE_LIMIT_DECISIONS.labels("rejected").inc()
+            raise HTTPException(
+                status_code=429,
+                detail="Rate limit exceeded. Please try again later.",
+                headers={"Retry-After": str(math.ceil(retry_after))},
+            )
+        RATE_LIMIT_DECISIONS.labels("allowed").inc()
+
+    async def settle(self, client: str, cost: float):
+        """Charges work discovered after admission (e.g. input size); may leave the bucket in debt."""
+        if cost > 0:
+            await self._take(client, cost, allow_debt=True)
+
+    async def refund(self, client: str, cost: float):
+        """Gives back a charge for work that was not done (balances stay capped at capacity)."""
+        if cost > 0:
+            await self._take(client, -cost, allow_debt=True)
+
+
+def estimate_generate_cost(audio: bool, audio_length: str) -> float:
+    """Up-front cost of a /generate call, known from the request alone."""
+    if not audio:
+        return 1.0
+    # TTS time dominates: a long podcast is ~10 min of audio, a short one ~3 min
+    return 12.0 if audio_length == "long" else 4.0
+
+
+def estimate_content_cost(content_chars: int) -> float:
+    """Additional cost for the prompt size, one unit per ~25k input tokens."""
+    return (content_chars / 4) / 25_000
+
+
+cost_limiter = CostLimiter(
+    SQLiteTokenBuckets(os.getenv("RATE_LIMIT_SQLITE_PATH", "/tmp/gitpodcast_ratelimit.sqlite")),
+    client_bucket=Bucket("client",
+                         capacity=float(os.getenv("RATE_LIMIT_CLIENT_CAPACITY", "40")),
+                         refill_per_hour=float(os.getenv("RATE_LIMIT_CLIENT_REFILL_PER_HOUR", "40"))),
+    global_bucket=Bucket("global",
+                         capacity=float(os.getenv("RATE_LIMIT_GLOBAL_CAPACITY", "600")),
+                         refill_per_hour=float(os.getenv("RATE_LIMIT_GLOBAL_REFILL_PER_HOUR", "1200"))),
+)
@@ -0,0 +1,107 @@
+import atexit
+import contextvars
+import hashlib
+import json
+import logging
+import os
+import queue
+import random
+import sys
+import uuid
+from logging.handlers import QueueHandler, QueueListener
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+# json for log shippers, text for reading in a terminal
+LOG_FORMAT = os.getenv("LOG_FORMAT", "json" if os.getenv("ENVIRONMENT") == "production" else "text")
+# Characters of a payload shown at DEBUG level
+LOG_PAYLOAD_CHARS = int(os.getenv("LOG_PAYLOAD_CHARS", "300"))
+# Share of DEBUG payload logs that include the whole payload
+LOG_PAYLOAD_SAMPLE_RATE = float(os.getenv("LOG_PAYLOAD_SAMPLE_RATE", "0.01"))
+
+# Correlation id of the request being served, "-" outside of requests
+_request_id: contextvars.ContextVar[str] = contextvars.ContextVar("request_id", default="-")
+_listener: QueueListener | None = None
+
+
+def start_request(request_id: str | None = None) -> str:
+    """Sets the correlation id for the current request (the client's X-Request-Id if it sent a sane one)."""
+    if not request_id or len(request_id) > 64 or not request_id.replace("-", "").isalnum():
+        request_id = uuid.uuid4().hex[:16]
+    _request_id.set(request_id)
+    return request_id
+
+
+def current_request_id() -> str:
+    return _request_id.get()
+
+
+class CorrelationFilter(logging.Filter):
+    """Stamps records with the request id. Sits on the queue handler, so it runs in the thread that logs."""
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        record.request_id = _request_id.get()
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        entry = {
+            "ts": round(record.created, 3),
+            "level": record.levelname,
+            "logger": record.name,
+            "request_id": getattr(record, "request_id", "-"),
+            "msg": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def setup():
+    """
+    Routes the app's loggers through a queue to a single thread that writes stdout,
+    so a request thread never waits on a slow stdout. Called once per process.
+    """
+    global _listener
+    if _listener is not None:
+        return
+    output = logging.StreamHandler(sys.stdout)
+    if LOG_FORMAT == "json":
+        output.setFormatter(JsonFormatter())
+    else:
+        output.setFormatter(logging.Formatter("%(asctime)s %(levelname)s %(name)s [%(request_id)s] %(message)s"))
+
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = QueueHandler(records)
+    handler.addFilter(CorrelationFilter())
+    logger = logging.getLogger("app")
+    logger.setLevel(LOG_LEVEL)
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    _listener = QueueListener(records, output)
+    _listener.start()
+    # Flushes what is still queued on shutdown
+    atexit.register(_listener.stop)
+
+
+def summarize(payload: str) -> str:
+    """Length and a short hash of a payload: enough to correlate, nothing of its content."""
+    digest = hashlib.sha256(payload.encode("utf-8", errors="replace")).hexdigest()[:12]
+    return f"<{len(payload)} chars, sha256 {digest}>"
+
+
+def log_payload(logger: logging.Logger, label: str, payload: str):
+    """
+    Logs a payload (prompt, model response, SSML) without dumping it: its summary at
+    INFO, plus its first LOG_PAYLOAD_CHARS characters at DEBUG. A sample of DEBUG
+    logs (LOG_PAYLOAD_SAMPLE_RATE) carries the whole payload.
+    """
+    if not logger.isEnabledFor(logging.INFO):
+        return
+    if not logger.isEnabledFor(logging.DEBUG):
+        logger.info("%s %s", label, summarize(payload))
+    elif random.random() < LOG_PAYLOAD_SAMPLE_RATE:
+        logger.debug("%s %s (sampled in full): %s", label, summarize(payload), payload)
+    else:
+        logger.debug("%s %s: %s", label, summarize(payload), payload[:LOG_PAYLOAD_CHARS])
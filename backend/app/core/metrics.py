@@ -0,0 +1,269 @@
+import contextvars
+import os
+import time
+import uuid
+from contextlib import contextmanager
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+# Buckets cover everything from a cache lookup to a 20 minute podcast render
+STAGE_BUCKETS = (0.005, 0.025, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 40, 60, 120, 300)
+
+STAGE_LATENCY = Histogram(
+    "gitpodcast_stage_duration_seconds",
+    "Wall time spent in each pipeline stage",
+    ["stage"],
+    buckets=STAGE_BUCKETS,
+)
+STAGE_CPU = Counter(
+    "gitpodcast_stage_cpu_seconds_total",
+    "CPU time consumed by the thread running each pipeline stage",
+    ["stage"],
+)
+STAGE_IN_FLIGHT = Gauge(
+    "gitpodcast_stage_in_flight",
+    "Number of pipeline stages currently executing",
+    ["stage"],
+    multiprocess_mode="livesum",
+)
+UPSTREAM_CALLS = Counter(
+    "gitpodcast_upstream_calls_total",
+    "Calls made to upstream services by outcome",
+    ["service", "operation", "status"],
+)
+UPSTREAM_LATENCY = Histogram(
+    "gitpodcast_upstream_duration_seconds",
+    "Latency of upstream service calls",
+    ["service", "operation"],
+    buckets=STAGE_BUCKETS,
+)
+MODEL_ROUTES = Counter(
+    "gitpodcast_model_routes_total",
+    "Model calls by call site and the tier they were routed to",
+    ["call_site", "tier"],
+)
+MODEL_CALL_LATENCY = Histogram(
+    "gitpodcast_model_call_duration_seconds",
+    "Latency of model calls by call site and tier",
+    ["call_site", "tier"],
+    buckets=STAGE_BUCKETS,
+)
+MODEL_SLO_MISSES = Counter(
+    "gitpodcast_model_slo_misses_total",
+    "Model calls slower than their tier's latency SLO",
+    ["call_site", "tier"],
+)
+CACHE_LOOKUPS = Counter(
+    "gitpodcast_cache_lookups_total",
+    "Cache lookups by cache name and result",
+    ["cache", "result"],
+)
+PAYLOAD_BYTES = Counter(
+    "gitpodcast_payload_bytes_total",
+    "Bytes read from upstreams (in) and produced for clients (out)",
+    ["stage", "direction"],
+)
+REQUESTS_IN_FLIGHT = Gauge(
+    "gitpodcast_requests_in_flight",
+    "HTTP requests currently being served, by route path template (unmatched for paths with no route)",
+    ["path"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_ACTIVE = Gauge(
+    "gitpodcast_admission_active_jobs",
+    "Jobs currently holding an admission slot",
+    ["controller"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_QUEUE_DEPTH = Gauge(
+    "gitpodcast_admission_queue_depth",
+    "Jobs waiting for an admission slot",
+    ["controller"],
+    multiprocess_mode="livesum",
+)
+ADMISSION_DECISIONS = Counter(
+    "gitpodcast_admission_decisions_total",
+    "Admission outcomes (admitted, queued, rejected)",
+    ["controller", "result"],
+)
+RATE_LIMIT_DECISIONS = Counter(
+    "gitpodcast_rate_limit_decisions_total",
+    "Cost-weighted rate limiter outcomes (allowed, rejected, store_error)",
+    ["result"],
+)
+PICKED_PATHS = Counter(
+    "gitpodcast_picked_paths_total",
+    "File paths picked by the model, by how they matched the repository tree (exact, corrected, rejected)",
+    ["result"],
+)
+SPEECH_CONNECTIONS = Counter(
+    "gitpodcast_speech_connections_total",
+    "Pooled speech synthesizer connection events (opened, reused, reconnected, replaced)",
+    ["event"],
+)
+CONTENT_CHARS = Counter(
+    "gitpodcast_content_chars_total",
+    "Characters of repository content before and after minimization, by part (tree, readme, files)",
+    ["part", "stage"],
+)
+BREAKER_STATE = Gauge(
+    "gitpodcast_circuit_breaker_state",
+    "Circuit breaker state per upstream service (0 closed, 1 half open, 2 open)",
+    ["service"],
+    multiprocess_mode="livemax",
+)
+BREAKER_TRANSITIONS = Counter(
+    "gitpodcast_circuit_breaker_transitions_total",
+    "Circuit breaker state changes by the state entered",
+    ["service", "state"],
+)
+UPSTREAM_REJECTIONS = Counter(
+    "gitpodcast_upstream_rejections_total",
+    "Upstream calls not made because the breaker was open or the request deadline had passed",
+    ["service", "reason"],
+)
+ABANDONED_WORK = Counter(
+    "gitpodcast_abandoned_work_total",
+    "Work stopped or skipped because the client disconnected, by where it was stopped",
+    ["point"],
+)
+WARMUP_ITEMS = Counter(
+    "gitpodcast_warmup_items_total",
+    "Featured repo narrations checked by the warm-up task (rendered, unchanged, error)",
+    ["result"],
+)
+
+# Per-request trace, only populated when tracing is switched on for the request
+_current_trace: contextvars.ContextVar["RequestTrace | None"] = contextvars.ContextVar("current_trace", default=None)
+
+TRACE_ALL_REQUESTS = os.getenv("TRACE_ALL_REQUESTS", "false").lower() == "true"
+
+
+class RequestTrace:
+    def __init__(self):
+        self.trace_id = uuid.uuid4().hex[:16]
+        self.started_at = time.perf_counter()
+        self.spans: list[tuple[str, float, float, float]] = []
+
+    def add_span(self, name: str, start: float, end: float, cpu: float = 0.0):
+        self.spans.append((name, start - self.started_at, end - start, cpu))
+
+    def server_timing(self) -> str:
+        """Formats the spans as a Server-Timing header value (durations in ms, plus a cpu param)."""
+        return ", ".join(
+            f'{name.replace(".", "_")};dur={duration * 1000:.1f};cpu={cpu * 1000:.1f};desc="{name}"'
+            for name, _, duration, cpu in self.spans
+        )
+
+    def as_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "spans": [
+                {"name": name, "offset_ms": round(offset * 1000, 1), "duration_ms": round(duration * 1000, 1),
+                 "cpu_ms": round(cpu * 1000, 1)}
+                for name, offset, duration, cpu in self.spans
+            ],
+        }
+
+
+def start_trace() -> RequestTrace:
+    trace = RequestTrace()
+    _current_trace.set(trace)
+    return trace
+
+
+def current_trace() -> RequestTrace | None:
+    return _current_trace.get()
+
+
+def bind_context(fn):
+    """Wraps fn so it runs in a copy of the caller's context (keeps the trace inside executor threads)."""
+    ctx = contextvars.copy_context()
+
+    def run(*args, **kwargs):
+        return ctx.run(fn, *args, **kwargs)
+    return run
+
+
+@contextmanager
+def stage(name: str):
+    """Times a pipeline stage, tracks it as in flight and records a trace span."""
+    gauge = STAGE_IN_FLIGHT.labels(name)
+    gauge.inc()
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield
+    finally:
+        gauge.dec()
+        record_stage(name, start, time.perf_counter(), time.thread_time() - cpu_start)
+
+
+def record_stage(name: str, start: float, end: float, cpu: float):
+    """Records a finished stage whose CPU time was measured elsewhere, e.g. in a pool process."""
+    STAGE_LATENCY.labels(name).observe(end - start)
+    STAGE_CPU.labels(name).inc(cpu)
+    trace = _current_trace.get()
+    if trace is not None:
+        trace.add_span(name, start, end, cpu)
+
+
+class UpstreamCall:
+    def __init__(self):
+        self.status = "ok"
+        self.bytes_in = 0
+
+
+@contextmanager
+def upstream(service: str, operation: str):
+    """
+    Records latency and outcome of a call to an upstream service.
+    HTTP callers can set `call.status` to the response code; exceptions are
+    counted by class name and re-raised.
+    """
+    call = UpstreamCall()
+    start = time.perf_counter()
+    cpu_start = time.thread_time()
+    try:
+        yield call
+    except Exception as e:
+        call.status = type(e).__name__
+        raise
+    finally:
+        end = time.perf_counter()
+        cpu = time.thread_time() - cpu_start
+        UPSTREAM_LATENCY.labels(service, operation).observe(end - start)
+        UPSTREAM_CALLS.labels(service, operation, str(call.status)).inc()
+        if call.bytes_in:
+            PAYLOAD_BYTES.labels(service, "in").inc(call.bytes_in)
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add_span(f"{service}.{operation}", start, end, cpu)
+
+
+def record_cache(cache: str, hit: bool):
+    CACHE_LOOKUPS.labels(cache, "hit" if hit else "miss").inc()
+
+
+def record_bytes(stage_name: str, direction: str, nbytes: int):
+    PAYLOAD_BYTES.labels(stage_name, direction).inc(nbytes)
+
+
+def render_metrics() -> tuple[bytes, str]:
+    """
+    Renders the metrics exposition. With several uvicorn workers set
+    PROMETHEUS_MULTIPROC_DIR so the numbers are aggregated across processes.
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return generate_latest(registry), CONTENT_TYPE_LATEST
+    return generate_latest(), CONTENT_TYPE_LATEST
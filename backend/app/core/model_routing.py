@@ -0,0 +1,99 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+
+from app.core.metrics import MODEL_CALL_LATENCY, MODEL_ROUTES, MODEL_SLO_MISSES
+
+logger = logging.getLogger(__name__)
+
+# Off sends every call to the standard tier of its provider, as before routing existed
+MODEL_ROUTING = os.getenv("MODEL_ROUTING", "true").lower() == "true"
+# Rough characters per token, only used to pick a tier
+CHARS_PER_TOKEN = 4
+
+
+class ModelTier:
+    """
+    A model with the latency it is expected to answer within, the output tokens it
+    may use and its list price in USD per million input and output tokens.
+    """
+
+    def __init__(self, name: str, model: str, slo_seconds: float, max_tokens: int, input_price: float,
+                 output_price: float):
+        self.name = name
+        self.model = model
+        self.slo_seconds = slo_seconds
+        self.max_tokens = max_tokens
+        self.input_price = input_price
+        self.output_price = output_price
+
+    def cost(self, input_tokens: int, output_tokens: int) -> float:
+        return (input_tokens * self.input_price + output_tokens * self.output_price) / 1_000_000
+
+
+def _tier(name: str, model: str, slo_seconds: float, max_tokens: int, input_price: float,
+          output_price: float) -> ModelTier:
+    prefix = name.upper().replace("-", "_")
+    return ModelTier(name, os.getenv(f"{prefix}_MODEL", model),
+                     float(os.getenv(f"{prefix}_SLO_SECONDS", str(slo_seconds))),
+                     int(os.getenv(f"{prefix}_MAX_TOKENS", str(max_tokens))),
+                     float(os.getenv(f"{prefix}_INPUT_PRICE", str(input_price))),
+                     float(os.getenv(f"{prefix}_OUTPUT_PRICE", str(output_price))))
+
+
+# On Azure the model is the deployment name. The fast tier is opt-in: existing installs only
+# have the standard deployment, and calls to one that doesn't exist fail with 404.
+OPENAI_STANDARD_MODEL = os.getenv("AZURE_OPENAI_MODEL_NAME", "gpt-4o")
+OPENAI_FAST_MODEL = os.getenv("AZURE_OPENAI_FAST_MODEL_NAME")
+
+TIERS = {tier.name: tier for tier in [
+    _tier("openai-fast", OPENAI_FAST_MODEL or OPENAI_STANDARD_MODEL, 8, 1024, 0.15, 0.6),
+    _tier("openai-standard", OPENAI_STANDARD_MODEL, 90, 8192, 2.5, 10),
+    _tier("claude-fast", "claude-3-5-haiku-latest", 20, 4096, 0.8, 4),
+    _tier("claude-standard", "claude-3-5-sonnet-latest", 60, 4096, 3, 15),
+]}
+
+# Per call site, (up to this many input tokens, tier) in order; None matches any size and comes last.
+# The narration keeps the standard model whatever its size, it is what the listener hears.
+ROUTES = {
+    "file_selection": ([(int(os.getenv("FILE_SELECTION_FAST_MAX_TOKENS", "30000")), "openai-fast")]
+                       if OPENAI_FAST_MODEL else []) + [(None, "openai-standard")],
+    "short_podcast": [(None, "openai-standard")],
+    "long_segment": [(None, "openai-standard")],
+    "modify": [(int(os.getenv("MODIFY_FAST_MAX_TOKENS", "3000")), "claude-fast"), (None, "claude-standard")],
+}
+
+
+def tier_for(call_site: str, input_tokens: int) -> ModelTier:
+    """The tier a call from call_site with input_tokens goes to."""
+    if not MODEL_ROUTING:
+        return TIERS[ROUTES[call_site][-1][1]]
+    return TIERS[next(tier for max_tokens, tier in ROUTES[call_site] if max_tokens is None or input_tokens <= max_tokens)]
+
+
+def route(call_site: str, prompt: str) -> ModelTier:
+    """Picks the tier for a call from call_site with prompt (everything sent, system prompt included)."""
+    tokens = len(prompt) // CHARS_PER_TOKEN
+    tier = tier_for(call_site, tokens)
+    MODEL_ROUTES.labels(call_site, tier.name).inc()
+    logger.debug("Routed %s (about %d input tokens) to %s", call_site, tokens, tier.name)
+    return tier
+
+
+@contextmanager
+def model_call(call_site: str, prompt: str):
+    """
+    Routes a model call and times it: yields the tier to call, then records the
+    latency against the tier's SLO. Failed calls are timed as well.
+    """
+    tier = route(call_site, prompt)
+    start = time.perf_counter()
+    try:
+        yield tier
+    finally:
+        seconds = time.perf_counter() - start
+        MODEL_CALL_LATENCY.labels(call_site, tier.name).observe(seconds)
+        if seconds > tier.slo_seconds:
+            MODEL_SLO_MISSES.labels(call_site, tier.name).inc()
+            logger.warning("%s call on %s took %.1fs, over its %.0fs SLO", call_site, tier.name, seconds, tier.slo_seconds)
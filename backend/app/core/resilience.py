@@ -0,0 +1,358 @@
+import asyncio
+import contextvars
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+from fastapi import HTTPException, Request
+
+from app.core.metrics import (
+    ABANDONED_WORK, BREAKER_STATE, BREAKER_TRANSITIONS, UPSTREAM_REJECTIONS, upstream as record_upstream,
+)
+
+logger = logging.getLogger(__name__)
+
+# Per-call timeout of each dependency when the request has no deadline, or more of it left
+UPSTREAM_TIMEOUTS = {
+    "github": float(os.getenv("GITHUB_TIMEOUT_SECONDS", "30")),
+    "openai": float(os.getenv("OPENAI_TIMEOUT_SECONDS", "300")),
+    "claude": float(os.getenv("CLAUDE_TIMEOUT_SECONDS", "300")),
+    "gemini": float(os.getenv("GEMINI_TIMEOUT_SECONDS", "300")),
+    "speech": float(os.getenv("SPEECH_TIMEOUT_SECONDS", "300")),
+}
+# A call slower than this counts against the breaker like a failure would (latency trigger)
+SLOW_CALL_SECONDS = {
+    "github": float(os.getenv("GITHUB_SLOW_CALL_SECONDS", "10")),
+    "openai": float(os.getenv("OPENAI_SLOW_CALL_SECONDS", "120")),
+    "claude": float(os.getenv("CLAUDE_SLOW_CALL_SECONDS", "120")),
+    "gemini": float(os.getenv("GEMINI_SLOW_CALL_SECONDS", "120")),
+    "speech": float(os.getenv("SPEECH_SLOW_CALL_SECONDS", "60")),
+}
+BREAKER_WINDOW_SECONDS = float(os.getenv("BREAKER_WINDOW_SECONDS", "60"))
+BREAKER_MIN_CALLS = int(os.getenv("BREAKER_MIN_CALLS", "5"))
+BREAKER_FAILURE_RATE = float(os.getenv("BREAKER_FAILURE_RATE", "0.5"))
+BREAKER_SLOW_RATE = float(os.getenv("BREAKER_SLOW_RATE", "0.8"))
+BREAKER_OPEN_SECONDS = float(os.getenv("BREAKER_OPEN_SECONDS", "30"))
+
+# Share of a request's total deadline each stage may use at most; what a stage leaves over goes to the next
+STAGE_DEADLINE_SHARES = {"fetch": 0.25, "llm": 0.6, "tts": 0.6, "encode": 0.2}
+
+CLOSED, HALF_OPEN, OPEN = "closed", "half_open", "open"
+_STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    def __init__(self, service: str, retry_after: float):
+        super().__init__(f"{service} is currently unavailable, retry in {retry_after:.0f}s")
+        self.service = service
+        self.retry_after = retry_after
+
+
+class DeadlineExceeded(Exception):
+    pass
+
+
+class RequestCancelled(Exception):
+    pass
+
+
+# End the request: code that degrades gracefully on other errors re-raises these
+ABORTING_ERRORS = (RequestCancelled, CircuitOpenError, DeadlineExceeded)
+
+
+class CancellationToken:
+    """
+    Set once the client of a request has gone away. Work of the request checks it
+    between steps (check_cancelled); work that cannot be interrupted that way, like
+    a running synthesis, registers a callback that stops it (on_cancel).
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._callbacks: list = []
+        self._lock = threading.Lock()
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                logger.warning("Error in cancellation callback: %s", e)
+
+    def add_callback(self, callback) -> bool:
+        """Registers callback to run on cancellation; False (and not registered) if already cancelled."""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self._callbacks.append(callback)
+            return True
+
+    def remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class DisconnectWatch:
+    """The disconnect watcher of a request, stopped when the handler returns unless handed over."""
+
+    def __init__(self, token: CancellationToken, watcher: asyncio.Future):
+        self.token = token
+        self.watcher = watcher
+        self.handed_over = False
+
+    def hand_over(self):
+        """Keeps watching past the end of the handler; returns the callable that stops the watcher."""
+        self.handed_over = True
+        return self.watcher.cancel
+
+
+class CircuitBreaker:
+    """
+    Per-dependency circuit breaker over a sliding window of recent calls.
+
+    Opens when, over at least BREAKER_MIN_CALLS calls in the window, the share of
+    failures reaches BREAKER_FAILURE_RATE or the share of calls slower than
+    slow_call_seconds reaches BREAKER_SLOW_RATE. While open, calls are rejected
+    right away. After BREAKER_OPEN_SECONDS a single probe call is let through
+    (half open): its success closes the breaker, its failure opens it again.
+    """
+
+    def __init__(self, service: str, slow_call_seconds: float):
+        self.service = service
+        self.slow_call_seconds = slow_call_seconds
+        self.state = CLOSED
+        self._opened_at = 0.0
+        self._probing = False
+        # (finished at, failed, slow)
+        self._calls: deque[tuple[float, bool, bool]] = deque()
+        self._lock = threading.Lock()
+        BREAKER_STATE.labels(service).set(_STATE_VALUES[CLOSED])
+
+    def _transition(self, state: str):
+        if state == self.state:
+            return
+        logger.warning("Circuit breaker %s: %s -> %s", self.service, self.state, state)
+        self.state = state
+        BREAKER_STATE.labels(self.service).set(_STATE_VALUES[state])
+        BREAKER_TRANSITIONS.labels(self.service, state).inc()
+        if state == OPEN:
+            self._opened_at = time.monotonic()
+        # A closed breaker starts over with a fresh window
+        self._calls.clear()
+
+    def before_call(self) -> bool:
+        """
+        Raises CircuitOpenError if the call may not go out. Returns whether the call is
+        the half-open probe, which must be reported back through after_call.
+        """
+        with self._lock:
+            if self.state == OPEN:
+                retry_after = self._opened_at + BREAKER_OPEN_SECONDS - time.monotonic()
+                if retry_after > 0:
+                    raise CircuitOpenError(self.service, retry_after)
+                self._transition(HALF_OPEN)
+            if self.state == HALF_OPEN:
+                if self._probing:
+                    raise CircuitOpenError(self.service, BREAKER_OPEN_SECONDS)
+                self._probing = True
+                return True
+            return False
+
+    def after_call(self, probe: bool, seconds: float, failed: bool | None):
+        """failed=None means the outcome says nothing about the dependency (e.g. our deadline ran out)."""
+        slow = seconds > self.slow_call_seconds
+        with self._lock:
+            if probe:
+                self._probing = False
+                if failed is not None:
+                    self._transition(OPEN if failed or slow else CLOSED)
+                return
+            if failed is None or self.state != CLOSED:
+                return
+            now = time.monotonic()
+            self._calls.append((now, failed, slow))
+            while self._calls and self._calls[0][0] < now - BREAKER_WINDOW_SECONDS:
+                self._calls.popleft()
+            if len(self._calls) < BREAKER_MIN_CALLS:
+                return
+            failures = sum(1 for _, call_failed, _ in self._calls if call_failed)
+            slow_calls = sum(1 for _, _, call_slow in self._calls if call_slow)
+            if (failures / len(self._calls) >= BREAKER_FAILURE_RATE
+                    or slow_calls / len(self._calls) >= BREAKER_SLOW_RATE):
+                self._transition(OPEN)
+
+
+breakers = {service: CircuitBreaker(service, SLOW_CALL_SECONDS[service]) for service in UPSTREAM_TIMEOUTS}
+
+# Absolute time.monotonic() by which the current request must be done, and its total budget
+_deadline: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline", default=None)
+_budget: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline_budget", default=None)
+_cancellation: contextvars.ContextVar[CancellationToken | None] = contextvars.ContextVar("cancellation", default=None)
+
+
+async def cancel_on_disconnect(request: Request):
+    """
+    FastAPI dependency: gives the request a CancellationToken, set as soon as the
+    client disconnects. Executor jobs inherit it through bind_context. A streamed
+    response keeps the watcher running through hold_while_streaming(response,
+    watch.hand_over()).
+    """
+    token = CancellationToken()
+    _cancellation.set(token)
+
+    async def watch():
+        # The body has been read before dependencies run, so the next message can only be the disconnect.
+        # (request.is_disconnected() does not see it through the HTTP middleware's wrapped receive.)
+        while (await request.receive())["type"] != "http.disconnect":
+            pass
+        logger.info("Client disconnected from %s, cancelling its work", request.url.path)
+        ABANDONED_WORK.labels("request").inc()
+        token.cancel()
+
+    watch = DisconnectWatch(token, asyncio.ensure_future(watch()))
+    try:
+        yield watch
+    finally:
+        if not watch.handed_over:
+            watch.watcher.cancel()
+
+
+def is_cancelled() -> bool:
+    token = _cancellation.get()
+    return token is not None and token.cancelled
+
+
+def check_cancelled(point: str):
+    """Raises RequestCancelled, counting point as abandoned work, if the client has gone away."""
+    if is_cancelled():
+        ABANDONED_WORK.labels(point).inc()
+        raise RequestCancelled(f"Client disconnected, {point} skipped")
+
+
+@contextmanager
+def on_cancel(callback):
+    """Runs callback if the request is cancelled while the block runs, right away if it already is."""
+    token = _cancellation.get()
+    if token is None:
+        yield
+        return
+    if not token.add_callback(callback):
+        callback()
+    try:
+        yield
+    finally:
+        token.remove_callback(callback)
+
+
+def start_deadline(seconds: float):
+    """Gives the current request seconds to finish; executor jobs inherit it through bind_context."""
+    _deadline.set(time.monotonic() + seconds)
+    _budget.set(seconds)
+
+
+@contextmanager
+def stage_deadline(pool: str):
+    """Narrows the request deadline to the stage's share of the total budget while the stage runs."""
+    deadline, budget = _deadline.get(), _budget.get()
+    if deadline is None:
+        yield
+        return
+    token = _deadline.set(min(deadline, time.monotonic() + budget * STAGE_DEADLINE_SHARES.get(pool, 1.0)))
+    try:
+        yield
+    finally:
+        _deadline.reset(token)
+
+
+def time_left() -> float | None:
+    deadline = _deadline.get()
+    return None if deadline is None else deadline - time.monotonic()
+
+
+def call_timeout(service: str) -> float:
+    """Timeout for the next call to service: its default, shortened to what is left of the deadline."""
+    left = time_left()
+    if left is None:
+        return UPSTREAM_TIMEOUTS[service]
+    if left <= 0:
+        raise DeadlineExceeded("Request deadline exceeded")
+    return min(UPSTREAM_TIMEOUTS[service], left)
+
+
+def _interrupted_by_us() -> bool:
+    # Past our own deadline the timeout was ours to blame, and a call we stopped tells nothing either
+    left = time_left()
+    return is_cancelled() or (left is not None and left <= 0)
+
+
+def _is_failure(status) -> bool:
+    # HTTP callers report status codes; 4xx other than 429 are the request's fault, not the dependency's
+    if isinstance(status, int):
+        return status >= 500 or status == 429
+    # Speech reports the result reason
+    return status == "Canceled"
+
+
+def _is_failure_error(e: Exception) -> bool:
+    status_code = getattr(e, "status_code", None)
+    return not (isinstance(status_code, int) and 400 <= status_code < 500 and status_code != 429)
+
+
+@contextmanager
+def upstream(service: str, operation: str):
+    """
+    Guards a call to an upstream service: fails fast with DeadlineExceeded when the
+    request's deadline has passed and with CircuitOpenError while the service's
+    breaker is open. Otherwise the call is recorded like metrics.upstream and its
+    outcome and latency are fed to the breaker.
+    """
+    check_cancelled(f"upstream.{service}")
+    left = time_left()
+    if left is not None and left <= 0:
+        UPSTREAM_REJECTIONS.labels(service, "deadline").inc()
+        raise DeadlineExceeded(f"Request deadline exceeded before calling {service}")
+    breaker = breakers[service]
+    try:
+        probe = breaker.before_call()
+    except CircuitOpenError:
+        UPSTREAM_REJECTIONS.labels(service, "circuit_open").inc()
+        raise
+
+    started = time.monotonic()
+    failed = None
+    try:
+        with record_upstream(service, operation) as call:
+            try:
+                yield call
+            except Exception as e:
+                failed = None if _interrupted_by_us() else _is_failure_error(e)
+                raise
+            failed = None if _interrupted_by_us() else _is_failure(call.status)
+    finally:
+        # A stream closed by us (GeneratorExit) leaves failed at None
+        breaker.after_call(probe, time.monotonic() - started, failed)
+
+
+def as_http_error(e: Exception) -> HTTPException | None:
+    """The HTTP error to answer with when e means a dependency is down or the request ran out of time."""
+    if isinstance(e, CircuitOpenError):
+        return HTTPException(status_code=503, detail=str(e), headers={"Retry-After": str(max(1, round(e.retry_after)))})
+    if isinstance(e, DeadlineExceeded):
+        return HTTPException(status_code=504, detail="The request took too long. Please try again later.")
+    if isinstance(e, RequestCancelled):
+        # Nobody is listening any more; 499 (client closed request) keeps it apart from errors in the logs
+        return HTTPException(status_code=499, detail="Client closed request")
+    return None
@@ -0,0 +1,71 @@
+import importlib
+import sys
+import threading
+import time
+
+from app.core import startup
+
+
+class ServiceRegistry:
+    """
+    Builds each service on first use and keeps one instance per worker.
+
+    Services are registered by import path, so their module and the SDK it pulls
+    in (Azure Speech, OpenAI, Anthropic, Gemini) are only imported once a request
+    actually needs them, instead of by every worker at boot.
+    """
+
+    def __init__(self):
+        self._paths: dict[str, str] = {}
+        self._instances: dict[str, object] = {}
+        self._lock = threading.RLock()
+
+    def register(self, name: str, path: str):
+        """path is "module:ClassName"; the class is constructed without arguments."""
+        self._paths[name] = path
+
+    def get(self, name: str):
+        instance = self._instances.get(name)
+        if instance is None:
+            with self._lock:
+                if name not in self._instances:
+                    self._instances[name] = self._build(name)
+                instance = self._instances[name]
+        return instance
+
+    def _build(self, name: str):
+        module_path, class_name = self._paths[name].split(":")
+        modules_before = set(sys.modules)
+        started, rss_before = time.perf_counter(), startup.rss_mb()
+        instance = getattr(importlib.import_module(module_path), class_name)()
+        imported = sorted({module.split(".")[0] for module in set(sys.modules) - modules_before} - {"app"})
+        startup.record_service(name, time.perf_counter() - started, startup.rss_mb() - rss_before, imported)
+        return instance
+
+    def lazy(self, name: str) -> "LazyService":
+        return LazyService(self, name)
+
+
+class LazyService:
+    """Module-level stand-in for a service; the service is built on first attribute access."""
+
+    def __init__(self, registry: ServiceRegistry, name: str):
+        self._registry = registry
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._registry.get(self._name), attr)
+
+
+services = ServiceRegistry()
+services.register("github", "app.services.github_service:GitHubService")
+services.register("claude", "app.services.claude_service:ClaudeService")
+services.register("openai", "app.services.openai_service:OpenAIService")
+services.register("speech", "app.services.speech_service:SpeechService")
+services.register("gemini", "app.services.gemini_service:GeminiService")
+
+
+def is_rate_limit_error(e: Exception) -> bool:
+    """Whether e is Anthropic's rate limit error, without importing the SDK to find out."""
+    anthropic = sys.modules.get("anthropic")
+    return anthropic is not None and isinstance(e, anthropic.RateLimitError)
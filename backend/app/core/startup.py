@@ -0,0 +1,119 @@
+import importlib.abc
+import logging
+import os
+import sys
+import time
+
+logger = logging.getLogger(__name__)
+
+# SDKs that should only be imported by workers that actually use them
+HEAVY_MODULES = ["azure.cognitiveservices.speech", "google.generativeai", "openai", "anthropic", "pydub"]
+
+# Set by a worker that starts a CPU pool (app/core/cpu_pool.py) to its own pid
+CPU_POOL_PARENT_ENV = "APP_CPU_POOL_PARENT_PID"
+
+_boot_started = time.perf_counter()
+_boot_seconds: float | None = None
+_imports: list[dict] = []
+_services: list[dict] = []
+
+
+def rss_mb() -> float:
+    """Current resident set size of this process in MiB."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") / 2 ** 20
+    except (OSError, ValueError):
+        import resource
+        # Peak rather than current outside Linux, still good enough to spot a heavy import
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+class _TimedLoader:
+    """Wraps a module loader to record how long executing the module took and how much memory it added."""
+
+    def __init__(self, loader, name: str):
+        self._loader = loader
+        self._name = name
+
+    def __getattr__(self, attr):
+        return getattr(self._loader, attr)
+
+    def create_module(self, spec):
+        return self._loader.create_module(spec)
+
+    def exec_module(self, module):
+        started, rss_before = time.perf_counter(), rss_mb()
+        try:
+            self._loader.exec_module(module)
+        finally:
+            _imports.append({
+                "module": self._name,
+                "seconds": round(time.perf_counter() - started, 4),
+                "rss_mb": round(rss_mb() - rss_before, 1),
+            })
+
+
+class _ImportProfiler(importlib.abc.MetaPathFinder):
+    """
+    Times top-level packages only. Figures are cumulative like `python -X importtime`:
+    a package's time includes the packages it imports, which are also listed on their own.
+    """
+
+    def find_spec(self, name, path, target=None):
+        if "." in name:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(name, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        if spec.loader is not None and hasattr(spec.loader, "exec_module"):
+            spec.loader = _TimedLoader(spec.loader, name)
+        return spec
+
+
+_profiler = _ImportProfiler()
+
+
+def in_cpu_pool_process() -> bool:
+    """
+    True in a process of the CPU pool. Those are spawned, so they import the app
+    package again, but they inherit the environment from the worker that started them.
+    """
+    return os.environ.get(CPU_POOL_PARENT_ENV) == str(os.getppid())
+
+
+def install_import_profiler():
+    # Wrapping loaders is not free and not invisible to introspection, so it is opt-in
+    if os.getenv("PROFILE_STARTUP", "false").lower() == "true":
+        sys.meta_path.insert(0, _profiler)
+
+
+def boot_finished():
+    """Called once the app is ready to serve; stops import profiling and prints the report."""
+    global _boot_seconds
+    _boot_seconds = time.perf_counter() - _boot_started
+    if _profiler in sys.meta_path:
+        sys.meta_path.remove(_profiler)
+    logger.info("Startup report: %s", report())
+
+
+def record_service(name: str, seconds: float, rss_delta_mb: float, modules: list[str]):
+    _services.append({"service": name, "seconds": round(seconds, 4), "rss_mb": round(rss_delta_mb, 1),
+                      "imported": modules})
+
+
+def report(top: int = 25) -> dict:
+    return {
+        "pid": os.getpid(),
+        "boot_seconds": round(_boot_seconds, 3) if _boot_seconds is not None else None,
+        "rss_mb": round(rss_mb(), 1),
+        "heavy_modules_loaded": {module: module in sys.modules for module in HEAVY_MODULES},
+        "imports": sorted(_imports, key=lambda entry: entry["seconds"], reverse=True)[:top],
+        # Services built so far, with the time and memory their first use cost
+        "services": _services,
+    }
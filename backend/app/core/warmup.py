@@ -0,0 +1,108 @@
+import fcntl
+import json
+import os
+import time
+
+from app.core.files import atomic_write
+
+# The examples linked from the landing page (src/lib/exampleRepos.ts)
+DEFAULT_WARMUP_REPOS = ("BandarLabs/clickclickclick,fastapi/fastapi,streamlit/streamlit,pallets/flask,"
+                        "tom-draper/api-analytics,monkeytypegame/monkeytype")
+
+WARMUP_ENABLED = os.getenv("WARMUP_ENABLED", str(os.getenv("ENVIRONMENT") == "production")).lower() == "true"
+WARMUP_REPOS = [
+    tuple(entry.strip().split("/", 1))
+    for entry in os.getenv("WARMUP_REPOS", DEFAULT_WARMUP_REPOS).split(",")
+    if "/" in entry
+]
+WARMUP_AUDIO_LENGTHS = [length.strip() for length in os.getenv("WARMUP_AUDIO_LENGTHS", "short,long").split(",")]
+# Only MP3 formats, the warmed audio is stored per segment and stitched (see synthesize_segments)
+WARMUP_AUDIO_FORMATS = [name.strip() for name in os.getenv("WARMUP_AUDIO_FORMATS", "mp3-32k").split(",")]
+# How often the head commit of every featured repo is checked; 0 only warms up at startup
+WARMUP_INTERVAL_SECONDS = int(os.getenv("WARMUP_INTERVAL_MINUTES", "30")) * 60
+
+# Cycles that left some repo cold are retried sooner than the regular interval
+WARMUP_RETRY_SECONDS = 300
+
+# Requests for featured repos trust the warmed snapshot for this long without calling GitHub.
+# Twice the interval, so one slow or failed refresh does not drop them back to the cold path.
+FEATURED_MAX_STALENESS = 2 * WARMUP_INTERVAL_SECONDS
+
+_featured = {(username.lower(), repo.lower()) for username, repo in WARMUP_REPOS}
+
+
+def is_featured(username: str, repo: str) -> bool:
+    return WARMUP_ENABLED and (username.lower(), repo.lower()) in _featured
+
+
+class WarmupStatus:
+    """
+    Progress of the warm-up cycles, kept in a JSON file next to the narration
+    cache so every worker reports the same state. An flock on a sibling file
+    makes sure only one worker runs a cycle at a time.
+    """
+
+    def __init__(self, directory: str):
+        self.path = os.path.join(directory, "warmup.json")
+        self.lock_path = os.path.join(directory, "warmup.lock")
+        self._lock_fd = None
+        self.data = {"cycle_started_at": None, "cycle_finished_at": None, "items": {}}
+
+    def load(self) -> dict:
+        try:
+            with open(self.path) as f:
+                self.data = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            pass
+        return self.data
+
+    def save(self):
+        atomic_write(self.path, json.dumps(self.data).encode())
+
+    def update_item(self, username: str, repo: str, audio_length: str, **fields):
+        key = f"{username}/{repo}:{audio_length}"
+        self.data["items"].setdefault(key, {"state": "pending", "tree_sha": None, "refreshed_at": None,
+                                            "error": None}).update(fields)
+        self.save()
+
+    def is_due(self) -> bool:
+        finished_at = self.load().get("cycle_finished_at")
+        if finished_at is None:
+            return True
+        elapsed = time.time() - finished_at
+        if any(item["state"] != "hot" for item in self.data["items"].values()):
+            return elapsed >= WARMUP_RETRY_SECONDS
+        return WARMUP_INTERVAL_SECONDS > 0 and elapsed >= WARMUP_INTERVAL_SECONDS
+
+    def try_lock(self) -> bool:
+        os.makedirs(os.path.dirname(self.lock_path), exist_ok=True)
+        self._lock_fd = open(self.lock_path, "w")
+        try:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            return True
+        except BlockingIOError:
+            self._lock_fd.close()
+            self._lock_fd = None
+            return False
+
+    def unlock(self):
+        if self._lock_fd is not None:
+            fcntl.flock(self._lock_fd, fcntl.LOCK_UN)
+            self._lock_fd.close()
+            self._lock_fd = None
+
+    def report(self) -> dict:
+        data = self.load()
+        items = data["items"]
+        hot = sum(item["state"] == "hot" for item in items.values())
+        return {
+            "enabled": WARMUP_ENABLED,
+            "interval_seconds": WARMUP_INTERVAL_SECONDS,
+            "cycle_started_at": data["cycle_started_at"],
+            "cycle_finished_at": data["cycle_finished_at"],
+            "running": data["cycle_started_at"] is not None and (
+                data["cycle_finished_at"] is None or data["cycle_finished_at"] < data["cycle_started_at"]),
+            "hot": hot,
+            "total": len(WARMUP_REPOS) * len(WARMUP_AUDIO_LENGTHS),
+            "items": items,
+        }
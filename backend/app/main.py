@@ -1,16 +1,43 @@
-from fastapi import FastAPI, Request
+from fastapi import FastAPI, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
 from slowapi import _rate_limit_exceeded_handler
 from slowapi.errors import RateLimitExceeded
-from app.routers import generate, modify
+from app.routers import generate, modify, batch, warmup
 from app.core.limiter import limiter
+from app.core.metrics import REQUESTS_IN_FLIGHT, TRACE_ALL_REQUESTS, start_trace, render_metrics
+from app.core.warmup import WARMUP_ENABLED
+from app.core import startup, cpu_pool, log, capture
+from app.core.services import services
+from contextlib import asynccontextmanager
 from typing import cast
 from starlette.exceptions import ExceptionMiddleware
+from starlette.routing import Match
 from api_analytics.fastapi import Analytics
+import asyncio
+import logging
 import os
 
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    startup.boot_finished()
+    if os.getenv("SPEECH_KEY") and os.getenv("SPEECH_POOL_PREOPEN", "true").lower() == "true":
+        # In the background, so boot stays fast while the first syntheses still find open connections
+        asyncio.get_running_loop().run_in_executor(None, lambda: services.get("speech").open_connections())
+    # Spawning the post-processing processes takes a moment, so not on the boot path either
+    asyncio.get_running_loop().run_in_executor(None, cpu_pool.start)
+    # Pre-renders the featured repos into the caches, see app/routers/warmup.py
+    warmup_task = warmup.start() if WARMUP_ENABLED else None
+    yield
+    if warmup_task:
+        warmup_task.cancel()
+    cpu_pool.shutdown()
+    capture.close()
+
+
+app = FastAPI(lifespan=lifespan)
 
 
 origins = [
@@ -25,8 +52,49 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["GET", "POST"],
     allow_headers=["*"],
+    expose_headers=["Server-Timing", "X-Trace-Id", "X-Request-Id"],
 )
 
+
+def route_label(request: Request) -> str:
+    """
+    The path template of the route a request goes to, e.g. /batch/{batch_id}. Raw paths
+    carry ids (and whatever scanners try), so as a metric label they would grow without bound.
+    """
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match != Match.NONE:
+            return route.path
+    return "unmatched"
+
+
+@app.middleware("http")
+async def track_requests(request: Request, call_next):
+    # Correlates the request's log lines; the handler and its executor jobs inherit it
+    request_id = log.start_request(request.headers.get("x-request-id"))
+    # Tracing is opt-in per request (X-Trace: 1) or global via TRACE_ALL_REQUESTS
+    send_trace = TRACE_ALL_REQUESTS or request.headers.get("x-trace") == "1"
+    # Captured requests are traced too, for their stage timings (see core/capture.py)
+    record = capture.start(request.method, request.url.path)
+    trace = start_trace() if send_trace or record is not None else None
+
+    # The router only matches the route inside call_next, so match it here
+    in_flight = REQUESTS_IN_FLIGHT.labels(route_label(request))
+    in_flight.inc()
+    try:
+        response = await call_next(request)
+    finally:
+        in_flight.dec()
+
+    if record is not None:
+        capture.finish(record, response.status_code, trace)
+    if send_trace:
+        response.headers["Server-Timing"] = trace.server_timing()
+        response.headers["X-Trace-Id"] = trace.trace_id
+        logger.info("Trace %s %s", request.url.path, trace.as_dict())
+    response.headers["X-Request-Id"] = request_id
+    return response
+
 API_ANALYTICS_KEY = os.getenv("API_ANALYTICS_KEY")
 if API_ANALYTICS_KEY:
     app.add_middleware(Analytics, api_key=API_ANALYTICS_KEY)
@@ -37,9 +105,24 @@ app.add_exception_handler(RateLimitExceeded, cast(
 
 app.include_router(generate.router)
 app.include_router(modify.router)
+app.include_router(batch.router)
+app.include_router(warmup.router)
 
 
 @app.get("/")
 @limiter.limit("100/day")
 async def root(request: Request):
     return {"message": "Hello from GitPodcast API!"}
+
+
+# Not routed by nginx (see nginx/api.conf), scrape it on the host at 127.0.0.1:8000
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    content, content_type = render_metrics()
+    return Response(content=content, media_type=content_type)
+
+
+# Per-worker boot time, memory and what was imported; also not routed by nginx
+@app.get("/startup-profile", include_in_schema=False)
+async def startup_profile():
+    return startup.report()
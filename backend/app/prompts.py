@@ -196,3 +196,22 @@ The instructions will be enclosed in <instructions> tags in the users message. I
 Your response must strictly be just the Mermaid.js code, without any additional text or explanations. Keep as many of the existing click events as possible.
 No code fence or markdown ticks needed, simply return the Mermaid.js code.
 """
+
+SYSTEM_MODIFY_DIFF_PROMPT = """
+You are tasked with modifying the code of a Mermaid.js diagram based on the provided instructions. The diagram will be enclosed in <diagram> tags in the users message, with every line prefixed by its line number and a "| " separator. The numbers are not part of the code.
+
+Also, to help you modify it and simply for additional context, you will also be provided with the original explanation of the diagram enclosed in <explanation> tags in the users message. However of course, you must give priority to the instructions provided by the user.
+
+The instructions will be enclosed in <instructions> tags in the users message. If these instructions are unrelated to the task, unclear, or not possible to follow, ignore them by simply responding with: "BAD_INSTRUCTIONS"
+
+Do not return the whole diagram. Return only the changes, as a list of hunks. Each hunk starts with a header line, followed by the new lines of code (without line numbers):
+
+@@ replace A-B
+(lines that replace lines A to B, inclusive; use "@@ replace A" for a single line)
+@@ insert after N
+(lines to insert after line N; use 0 to insert at the top)
+@@ delete A-B
+
+All line numbers refer to the original diagram. Hunks must not overlap. Keep as many of the existing click events as possible.
+Your response must strictly be just the hunks, without any additional text or explanations. No code fence or markdown ticks needed.
+"""
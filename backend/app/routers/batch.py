@@ -0,0 +1,294 @@
+from fastapi import APIRouter, Request, HTTPException
+from fastapi.responses import FileResponse
+from pydantic import BaseModel
+from app.core.admission import run_in_stage
+from app.core.files import atomic_write
+from app.routers.generate import (
+    fetch_github_data, generate_ssml_concurrently, generate_ssml_incrementally, combine_ssml,
+    synthesize_audio, synthesize_segments, build_webvtt,
+)
+from app.services.audio_service import negotiate_format, transcode_stream, ffmpeg_available
+import asyncio
+import hmac
+import json
+import logging
+import os
+import re
+import shutil
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+router = APIRouter(prefix="/batch", tags=["Batch"])
+
+BATCH_DIR = os.getenv("BATCH_DIR", "/tmp/gitpodcast_batches")
+BATCH_API_KEY = os.getenv("BATCH_API_KEY")
+MAX_BATCH_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "500"))
+# Finished batches (status, SSML and audio) are deleted this long after their last update
+BATCH_TTL_SECONDS = int(os.getenv("BATCH_TTL_HOURS", "24")) * 3600
+
+# Status file writes are coalesced to one per interval however fast items move, and repeated
+# every heartbeat while the batch runs. A running batch whose file is older than the stale
+# limit lost its worker (restart, crash) and is reported as interrupted.
+STATUS_SAVE_INTERVAL_SECONDS = float(os.getenv("BATCH_STATUS_SAVE_INTERVAL_SECONDS", "1"))
+STATUS_HEARTBEAT_SECONDS = float(os.getenv("BATCH_STATUS_HEARTBEAT_SECONDS", "15"))
+STATUS_STALE_SECONDS = float(os.getenv("BATCH_STATUS_STALE_SECONDS", "90"))
+
+# Items of all batches in flight at once. Each one sits in a different stage most of the
+# time, so this only needs to be about the sum of the stage pools to keep every upstream busy
+# without front-loading every fetch (and its memory) before the first narration is done.
+_in_flight = asyncio.Semaphore(int(os.getenv("BATCH_MAX_IN_FLIGHT", "8")))
+_tasks: set[asyncio.Task] = set()
+
+BATCH_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class BatchItem(BaseModel):
+    username: str
+    repo: str
+    audio_length: str = 'long'
+
+
+class BatchRequest(BaseModel):
+    items: list[BatchItem]
+    audio: bool = True
+    audio_format: str | None = None
+    incremental: bool = False
+
+
+class BatchJob:
+    """
+    State of one batch, mirrored to a JSON file by persist() so that any worker can
+    answer status requests, not only the one running the batch.
+    """
+
+    def __init__(self, batch_id: str, body: BatchRequest):
+        self.batch_id = batch_id
+        self.body = body
+        self.directory = os.path.join(BATCH_DIR, batch_id)
+        self.created_at = time.time()
+        self.items = [
+            {"username": item.username, "repo": item.repo, "audio_length": item.audio_length,
+             "status": "queued", "error": None, "stage_seconds": {}, "ssml_url": None, "audio_url": None,
+             "vtt_url": None}
+            for item in body.items
+        ]
+        self._changed = asyncio.Event()
+        self._save_lock = asyncio.Lock()
+
+    def summary(self) -> dict:
+        finished = [item for item in self.items if item["status"] in ("done", "error")]
+        elapsed = time.time() - self.created_at
+        return {
+            "batch_id": self.batch_id,
+            "status": "done" if len(finished) == len(self.items) else "running",
+            "total": len(self.items),
+            "done": sum(item["status"] == "done" for item in self.items),
+            "failed": sum(item["status"] == "error" for item in self.items),
+            "elapsed_seconds": round(elapsed, 1),
+            "items_per_minute": round(len(finished) / elapsed * 60, 2) if elapsed else 0.0,
+            "items": self.items,
+        }
+
+    def mark_changed(self):
+        self._changed.set()
+
+    async def save(self) -> dict:
+        # Serialize on the loop, where the items are mutated; write in a thread. The lock keeps
+        # an older snapshot from landing after a newer one.
+        async with self._save_lock:
+            summary = self.summary()
+            data = json.dumps(summary).encode()
+            await asyncio.to_thread(self._write, data)
+            return summary
+
+    def _write(self, data: bytes):
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write(os.path.join(self.directory, "status.json"), data)
+
+    async def persist(self):
+        """
+        Saves the status until the batch is done: at most once per interval after a
+        change, and at least once per heartbeat so readers can tell a live batch from
+        one whose worker went away.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self._changed.wait(), STATUS_HEARTBEAT_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+            self._changed.clear()
+            await asyncio.sleep(STATUS_SAVE_INTERVAL_SECONDS)
+            try:
+                if (await self.save())["status"] != "running":
+                    return
+            except OSError as e:
+                logger.warning("Could not save status of batch %s: %s", self.batch_id, e)
+
+
+def mark_interrupted(status: dict) -> dict:
+    """
+    Reports a running batch whose worker stopped saving it: its unfinished items will
+    never complete, so they count as failed.
+    """
+    for item in status["items"]:
+        if item["status"] not in ("done", "error"):
+            item["status"] = "error"
+            item["error"] = "Interrupted by a server restart"
+    status["status"] = "interrupted"
+    status["failed"] = sum(item["status"] == "error" for item in status["items"])
+    return status
+
+
+def write_audio(path: str, audio_bytes: bytes, audio_format) -> None:
+    if audio_format.needs_transcode(False):
+        with open(path, "wb") as f:
+            for chunk in transcode_stream(audio_bytes, audio_format.source_container, audio_format):
+                f.write(chunk)
+    else:
+        with open(path, "wb") as f:
+            f.write(audio_bytes)
+
+
+async def run_item(job: BatchJob, index: int, audio_format):
+    """
+    Walks one repository through the pipeline. Every step runs on the shared stage
+    executors, so while this item waits on the LLM another one can be fetching from
+    GitHub and a third one synthesizing: the batch pipelines across repositories.
+    """
+    item = job.items[index]
+    username, repo, audio_length = item["username"], item["repo"], item["audio_length"]
+
+    async def step(status, pool, fn, *args):
+        item["status"] = status
+        job.mark_changed()
+        started = time.perf_counter()
+        result = await run_in_stage(pool, fn, *args)
+        item["stage_seconds"][status] = round(time.perf_counter() - started, 2)
+        return result
+
+    async with _in_flight:
+        try:
+            incremental = None
+            if job.body.incremental:
+                incremental = await step("generating", "llm", generate_ssml_incrementally, username, repo, audio_length)
+                result = incremental if "error" in incremental else await run_in_stage(
+                    "encode", combine_ssml, [s for _, _, s in incremental["segments"]])
+            else:
+                github_data = await step("fetching", "fetch", fetch_github_data, username, repo)
+                result = await step("generating", "llm", generate_ssml_concurrently, github_data["file_tree"],
+                                    github_data["readme"], github_data["file_content"], audio_length)
+            if isinstance(result, dict):
+                raise ValueError("Some error in genererating audio: E001")
+            await run_in_stage("encode", atomic_write, os.path.join(job.directory, f"{index}.ssml"), result.encode())
+            item["ssml_url"] = f"{router.prefix}/{job.batch_id}/items/{index}/ssml"
+
+            if job.body.audio:
+                if incremental and audio_format.source_container == "mp3":
+                    audio_bytes = await step("synthesizing", "tts", synthesize_segments, username, repo, audio_length,
+                                             incremental["segments"], audio_format.source_format)
+                else:
+                    audio_bytes = await step("synthesizing", "tts", synthesize_audio, result, audio_format.source_format)
+                if not audio_bytes:
+                    raise ValueError("Text to speech is not available E002")
+
+                subtitle_id = await step("encoding", "encode", build_webvtt, result, audio_bytes,
+                                         audio_format.source_container)
+                await step("writing", "encode", write_audio,
+                           os.path.join(job.directory, f"{index}.{audio_format.extension}"), audio_bytes, audio_format)
+                item["audio_url"] = f"{router.prefix}/{job.batch_id}/items/{index}/audio"
+                item["vtt_url"] = f"/generate/subtitles/{subtitle_id}"
+            item["status"] = "done"
+        except Exception as e:
+            item["status"] = "error"
+            item["error"] = str(e)
+        finally:
+            job.mark_changed()
+
+
+def check_api_key(request: Request):
+    # Batches bypass per-client limits, so the endpoint is off unless a key is configured
+    if not BATCH_API_KEY:
+        raise HTTPException(status_code=403, detail="Batch API is disabled")
+    if not hmac.compare_digest(request.headers.get("x-api-key", "").encode(), BATCH_API_KEY.encode()):
+        raise HTTPException(status_code=401, detail="Invalid API key")
+
+
+@router.post("")
+async def create_batch(request: Request, body: BatchRequest):
+    check_api_key(request)
+    if not body.items:
+        raise HTTPException(status_code=400, detail="No items given")
+    if len(body.items) > MAX_BATCH_ITEMS:
+        raise HTTPException(status_code=400, detail=f"At most {MAX_BATCH_ITEMS} items per batch")
+    try:
+        audio_format = negotiate_format(body.audio_format, None)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    if body.audio and audio_format.needs_transcode(False) and not ffmpeg_available():
+        raise HTTPException(status_code=400, detail=f"Audio format {audio_format.name} is not available on this server")
+
+    await asyncio.to_thread(prune_batches)
+    job = BatchJob(uuid.uuid4().hex, body)
+    await job.save()
+    coroutines = [job.persist()] + [run_item(job, index, audio_format) for index in range(len(job.items))]
+    for coroutine in coroutines:
+        task = asyncio.create_task(coroutine)
+        # Keep a reference so the task is not garbage collected mid-run
+        _tasks.add(task)
+        task.add_done_callback(_tasks.discard)
+    return job.summary()
+
+
+def prune_batches():
+    """
+    Removes the batches not updated for the TTL. Running batches save their status
+    every heartbeat, so only finished or interrupted ones ever get that old.
+    """
+    cutoff = time.time() - BATCH_TTL_SECONDS
+    for entry in os.scandir(BATCH_DIR) if os.path.isdir(BATCH_DIR) else []:
+        try:
+            if entry.is_dir() and os.stat(os.path.join(entry.path, "status.json")).st_mtime < cutoff:
+                shutil.rmtree(entry.path, ignore_errors=True)
+        except FileNotFoundError:
+            pass
+
+
+def _batch_dir(batch_id: str) -> str:
+    if not BATCH_ID_PATTERN.match(batch_id):
+        raise HTTPException(status_code=404, detail="Batch not found")
+    return os.path.join(BATCH_DIR, batch_id)
+
+
+@router.get("/{batch_id}")
+async def get_batch(request: Request, batch_id: str):
+    check_api_key(request)
+    try:
+        with open(os.path.join(_batch_dir(batch_id), "status.json")) as f:
+            status = json.load(f)
+            saved_at = os.fstat(f.fileno()).st_mtime
+    except FileNotFoundError:
+        raise HTTPException(status_code=404, detail="Batch not found")
+    if status["status"] == "running" and time.time() - saved_at > STATUS_STALE_SECONDS:
+        return mark_interrupted(status)
+    return status
+
+
+@router.get("/{batch_id}/items/{index}/audio")
+async def get_batch_audio(request: Request, batch_id: str, index: int):
+    check_api_key(request)
+    directory = _batch_dir(batch_id)
+    for name in os.listdir(directory) if os.path.isdir(directory) else []:
+        if name.split(".")[0] == str(index) and not name.endswith((".tmp", ".ssml")):
+            return FileResponse(os.path.join(directory, name), filename=name)
+    raise HTTPException(status_code=404, detail="Audio not found")
+
+
+@router.get("/{batch_id}/items/{index}/ssml")
+async def get_batch_ssml(request: Request, batch_id: str, index: int):
+    check_api_key(request)
+    path = os.path.join(_batch_dir(batch_id), f"{index}.ssml")
+    if not os.path.isfile(path):
+        raise HTTPException(status_code=404, detail="SSML not found")
+    return FileResponse(path, media_type="application/ssml+xml", filename=f"{index}.ssml")
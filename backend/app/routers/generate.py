@@ -1,79 +1,175 @@
-from fastapi import APIRouter, Request, HTTPException, Response
-from dotenv import load_dotenv
-from app.services.github_service import GitHubService
-from app.services.claude_service import ClaudeService
-from app.services.speech_service import SpeechService
-from app.services.openai_service import OpenAIService
-from app.core.limiter import limiter
+from fastapi import APIRouter, Request, HTTPException, Response, Depends
+from fastapi.responses import StreamingResponse
+from app.services.audio_service import negotiate_format, transcode_stream, ffmpeg_available
+from app.services.subtitle_store import subtitle_store
+from app.services.narration_cache import narration_cache, NarrationSnapshot, fingerprint
+from app.services.tree_cache import tree_snapshots
+from app.services.cost_estimate import estimate_generation
+from app.services.path_index import PathIndex, index_tree
+from app.services.file_selection import pack_files, content_token_budget
+from app.services.content_minimizer import ContentMinimizer
+from app.services import mp3_frames
+from app.core.limiter import limiter, cost_limiter, client_address, estimate_generate_cost, estimate_content_cost
+from app.core.metrics import stage, record_cache, record_bytes, bind_context
+from app.core.admission import generate_admission, run_in_stage, hold_while_streaming, AdmissionSlot, AdmissionRejected
+from app.core.cpu_pool import run_cpu
+from app.services import postprocess
+from app.core.services import services, is_rate_limit_error
+from app.core.resilience import start_deadline, as_http_error, cancel_on_disconnect, ABORTING_ERRORS
+from app.core.warmup import is_featured, FEATURED_MAX_STALENESS
+from app.core.log import log_payload
+from app.core import capture
 import os
 from app.prompts import PODCAST_SSML_PROMPT_AFTER_BREAK, PODCAST_SSML_PROMPT, PODCAST_SSML_PROMPT_BEFORE_BREAK
-from anthropic._exceptions import RateLimitError
 from pydantic import BaseModel
 from functools import lru_cache
 import re
 from tempfile import NamedTemporaryFile
-import base64
-from pydub import AudioSegment
-import io
+import gzip
+import time
 import concurrent.futures
-
-load_dotenv()
+import logging
 
 router = APIRouter(prefix="/generate", tags=["Claude"])
 
-# Initialize services
-github_service = GitHubService()
-claude_service = ClaudeService()
-speech_service = SpeechService()
-openai_service = OpenAIService()
+logger = logging.getLogger(__name__)
 
-# cache github data for 5 minutes to avoid double API calls from cost and generate
-@lru_cache(maxsize=100)
-def get_cached_github_data(username: str, repo: str):
-    default_branch = github_service.get_default_branch(username, repo)
-    if not default_branch:
-        default_branch = "main"  # fallback value
+# Characters of repository content sent to the model per prompt; file selection budgets against it
+MAX_CONTENT_CHARS = 250000
+# Time a /generate request may take end to end, split across its stages (see core/resilience.py).
+# Keep it under nginx's proxy_read_timeout (300 s in nginx/api.conf), or nginx answers 504 while
+# the work goes on; raise both together.
+GENERATE_DEADLINE_SECONDS = float(os.getenv("GENERATE_DEADLINE_SECONDS", "280"))
+# Generations of a repository within one window of this length share their GitHub data (per worker)
+GITHUB_DATA_TTL_SECONDS = float(os.getenv("GITHUB_DATA_TTL_SECONDS", "300"))
 
-    file_tree = github_service.get_github_file_paths_as_list(username, repo)
+# Built on first use, see app/core/services.py
+github_service = services.lazy("github")
+claude_service = services.lazy("claude")
+speech_service = services.lazy("speech")
+openai_service = services.lazy("openai")
+
+# lru_cache never expires entries by itself, so the caller passes the current time window as part of the key
+@lru_cache(maxsize=100)
+def get_cached_github_data(username: str, repo: str, window: int = 0):
+    tree = fetch_tree(username, repo, named_branch=True)
+    # Only a snapshot of HEAD lacks the branch name
+    default_branch = tree["branch"] or github_service.get_default_branch(username, repo) or "main"
+    file_tree = github_service.get_github_file_paths_as_list(username, repo, tree=tree)
     readme = github_service.get_github_readme(username, repo)
+    # What goes into the prompts; the model still picks files from the full listing
+    minimizer = ContentMinimizer()
+    prompt_tree, prompt_readme = minimizer.tree(file_tree), minimizer.readme(readme)
+    file_list = []
     file_content = ""
     try:
-        file_list = openai_service.get_important_files(file_tree)
-        for fpath in file_list:
-            content = github_service.get_github_file_content(username, repo, fpath)
-            discuss_or_not = "- discuss this file." if '.md' not in fpath else ""
-            file_content += f"FPATH: {fpath} {discuss_or_not} \n CONTENT:{content}"
+        # Shared by short and long podcasts, so budget for the short one where files share the prompt with tree and README
+        file_list = pick_important_files(file_tree, tree,
+                                         content_token_budget(MAX_CONTENT_CHARS, len(prompt_tree) + len(prompt_readme)))
+        file_content = fetch_file_contents(username, repo, file_list, minimizer)
+    except ABORTING_ERRORS:
+        # Would otherwise be cached without the files
+        raise
     except Exception as e:
-        print(f"Some error in getting github file content {e}. Proceeding.")
+        logger.warning("Error getting GitHub file content of %s/%s, proceeding without: %s", username, repo, e)
+    minimizer.report()
 
     return {
         "default_branch": default_branch,
-        "file_tree": file_tree,
-        "readme": readme,
-        "file_content": file_content
+        "file_tree": prompt_tree,
+        "readme": prompt_readme,
+        "file_content": file_content,
+        "file_list": file_list,
+        "tree_sha": tree["sha"],
     }
 
-def process_github_content(content, speech_prompt, max_length, max_tokens=None):
+
+def fetch_tree(username: str, repo: str, named_branch: bool = False) -> dict:
+    """
+    The tree of the default branch, from the shared snapshot cache while fresh.
+    Fetched trees are stored there. A fetch takes one request for HEAD, or, with
+    named_branch, an extra one to learn the branch name as well.
+    """
+    tree = tree_snapshots.load(username, repo)
+    record_cache("tree_snapshot", tree is not None)
+    if tree is None:
+        with stage("get_repository_tree"):
+            if named_branch:
+                tree = github_service.get_repository_tree(username, repo)
+            else:
+                tree = github_service.get_head_tree(username, repo)
+        tree_snapshots.save(username, repo, tree)
+    return tree
+
+
+def pick_important_files(file_tree: str, tree: dict, budget_tokens: int) -> list[str]:
+    """
+    Asks the model for the key files, checked against the tree so only real files
+    get downloaded, and keeps the best ranked ones whose contents fit budget_tokens.
+    """
+    with stage("get_important_files"):
+        picked = openai_service.get_important_files(file_tree)
+    index = index_tree(tree)
+    return pack_files(index.resolve_files(picked), index, budget_tokens)
+
+
+def fetch_file_contents(username: str, repo: str, file_list: list[str], minimizer: ContentMinimizer | None = None,
+                        missing: list[str] | None = None) -> str:
+    """The picked files framed for the prompt. Files that could not be fetched are skipped and added to missing."""
+    file_content = ""
+    for fpath in file_list:
+        try:
+            with stage("get_file_content"):
+                content = github_service.get_github_file_content(username, repo, fpath)
+        except ABORTING_ERRORS:
+            raise
+        except Exception as e:
+            # One unreadable file (e.g. not UTF-8) should not cost the others
+            logger.info("Skipping file %s: %s", fpath, e)
+            if missing is not None:
+                missing.append(fpath)
+            continue
+        if minimizer is not None:
+            content = minimizer.file(fpath, content)
+            if not content.strip():
+                continue
+        discuss_or_not = "- discuss this file." if '.md' not in fpath else ""
+        file_content += f"FPATH: {fpath} {discuss_or_not} \n CONTENT:{content}"
+    return file_content
+
+
+def fetch_github_data(username: str, repo: str):
+    """get_cached_github_data with cache hit accounting and stage timing."""
+    hits_before = get_cached_github_data.cache_info().hits
+    with stage("get_cached_github_data"):
+        github_data = get_cached_github_data(username, repo, int(time.time() // GITHUB_DATA_TTL_SECONDS))
+    record_cache("github_data", get_cached_github_data.cache_info().hits > hits_before)
+    return github_data
+
+
+def process_github_content(content, speech_prompt, max_length, max_tokens=None, call_site="short_podcast"):
     content = content[:max_length]
-    print(content)
+    log_payload(logger, "Prompt content", content)
 
     try:
-        token_count = claude_service.count_tokens(content)
-        print(f"TOKEN COUNT: {token_count}")
+        with stage("count_tokens"):
+            token_count = claude_service.count_tokens(content)
+        logger.info("Token count: %d", token_count)
         if max_tokens and token_count > max_tokens:
             return {
                 "error": "Content is too large for analysis."
             }
     except Exception as e:
-        print(f"{e} Error in token count")
+        logger.warning("Error in token count: %s", e)
 
     with NamedTemporaryFile(delete=False, mode='w+', suffix='.txt') as temp_file:
         temp_file.write(content)
         temp_file_path = temp_file.name
 
     try:
-        ssml_response = speech_service.generate_ssml_with_retry([temp_file_path], speech_prompt)
-        print(ssml_response)
+        with stage("generate_ssml"):
+            ssml_response = speech_service.generate_ssml_with_retry([temp_file_path], speech_prompt, call_site=call_site)
+        log_payload(logger, "SSML response", ssml_response)
     finally:
         os.remove(temp_file_path)
 
@@ -84,7 +180,7 @@ def generate_ssml_concurrently(file_tree, readme, file_content, audio_length) ->
     # Prepare the content
     if audio_length == 'short':
         combined_content = f"FILE TREE: {file_tree}\nREADME: {readme} IMPORTANT FILES: {file_content}"
-        ssml_response = process_github_content(combined_content, PODCAST_SSML_PROMPT, 250000, 100000)
+        ssml_response = process_github_content(combined_content, PODCAST_SSML_PROMPT, MAX_CONTENT_CHARS, 100000)
         return ssml_response
     else:
         combined_content_tree_readme = f"FILE TREE: {file_tree}\nREADME: {readme}"
@@ -99,18 +195,20 @@ def generate_ssml_concurrently(file_tree, readme, file_content, audio_length) ->
         # Use ThreadPoolExecutor to execute tasks concurrently
         with concurrent.futures.ThreadPoolExecutor() as executor:
             future_tree_readme = executor.submit(
-                process_github_content,
+                bind_context(process_github_content),
                 combined_content_tree_readme,
                 PODCAST_SSML_PROMPT_BEFORE_BREAK,
-                250000,
-                100000
+                MAX_CONTENT_CHARS,
+                100000,
+                "long_segment"
             )
             future_file_content = executor.submit(
-                process_github_content,
+                bind_context(process_github_content),
                 combined_content_file_content,
                 PODCAST_SSML_PROMPT_AFTER_BREAK,
-                250000,
-                100000
+                MAX_CONTENT_CHARS,
+                100000,
+                "long_segment"
             )
 
             ssml_response_tree_readme = future_tree_readme.result()
@@ -120,17 +218,174 @@ def generate_ssml_concurrently(file_tree, readme, file_content, audio_length) ->
             error_response = check_response(ssml_response_tree_readme) or check_response(ssml_response_file_content)
             if error_response:
                 return error_response
-        # Apply the function to remove the first occurrence of the <speak> tags from responses
-        ssml_response_tree_readme_content = speech_service.remove_first_speak_tag(ssml_response_tree_readme)
-        ssml_response_file_content_content = speech_service.remove_first_speak_tag(ssml_response_file_content)
-        # Combine the contents
-        combined_ssml_content = f"{ssml_response_tree_readme_content}\n{ssml_response_file_content_content}"
+        # Proceed with ssml_response_tree_readme and ssml_response_file_content as needed
+        return combine_ssml([ssml_response_tree_readme, ssml_response_file_content])
 
-        # Wrap the combined content in a single <speak> tag
-        full_ssml_response = f'<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="en-US">{combined_ssml_content}</speak>'
 
-        # Proceed with ssml_response_tree_readme and ssml_response_file_content as needed
-        return full_ssml_response
+def combine_ssml(ssml_documents: list[str]) -> str:
+    """Merges several <speak> documents into one, in order."""
+    if len(ssml_documents) == 1:
+        return ssml_documents[0]
+    return run_cpu("combine_ssml", postprocess.combine_ssml, ssml_documents)
+
+
+def generate_ssml_incrementally(username: str, repo: str, audio_length: str, max_staleness: float = 0) -> dict:
+    """
+    Regenerates only the podcast segments whose inputs changed since the last
+    narrated snapshot of this repo, reusing the stored SSML of the others.
+
+    The overview segment depends on the file listing and README, the deep-dive
+    segment on the picked files' blob SHAs (short podcasts are one segment that
+    depends on both). Files are only downloaded when a segment needs them.
+
+    A snapshot whose tree was confirmed less than max_staleness seconds ago is
+    used as is, without asking GitHub whether the branch moved.
+
+    Segments regenerated without all of the picked files are returned but not
+    stored, and come with a None fingerprint so their audio isn't stored either.
+
+    Returns:
+        dict: {"segments": [(name, fingerprint, ssml)], "reused": [names], "input_chars": int, "tree_sha": str}
+              or {"error": ...}
+    """
+    previous = narration_cache.load(username, repo, audio_length)
+    names = ["full"] if audio_length == 'short' else ["overview", "files"]
+
+    def reuse_previous():
+        return {
+            "segments": [(name, previous.segments[name]["fingerprint"], previous.segments[name]["ssml"]) for name in names],
+            "reused": names,
+            "input_chars": 0,
+            "tree_sha": previous.tree_sha,
+        }
+
+    complete = previous is not None and all(name in previous.segments for name in names)
+    if complete and time.time() - previous.checked_at < max_staleness:
+        return reuse_previous()
+
+    tree = fetch_tree(username, repo)
+
+    if complete and previous.tree_sha == tree["sha"]:
+        # Same commit tree as last time: nothing to regenerate
+        previous.checked_at = time.time()
+        narration_cache.save(username, repo, audio_length, previous)
+        return reuse_previous()
+
+    blob_shas = {item["path"]: item["sha"] for item in tree["tree"] if item["type"] == "blob"}
+    file_tree = github_service.get_github_file_paths_as_list(username, repo, tree=tree)
+    readme = github_service.get_github_readme(username, repo)
+    minimizer = ContentMinimizer()
+    prompt_tree, prompt_readme = minimizer.tree(file_tree), minimizer.readme(readme)
+
+    # Keep the previous pick while all of it still exists: saves the selection call and keeps the segment stable
+    if previous and previous.file_list and all(path in blob_shas for path in previous.file_list):
+        file_list = previous.file_list
+    else:
+        # The deep-dive segment of a long podcast has the prompt to itself
+        used_chars = len(prompt_tree) + len(prompt_readme) if audio_length == 'short' else 0
+        file_list = pick_important_files(file_tree, tree, content_token_budget(MAX_CONTENT_CHARS, used_chars))
+
+    fingerprints = {
+        "overview": fingerprint(file_tree, readme),
+        "files": fingerprint(*(f"{path}:{blob_shas.get(path, '')}" for path in file_list)),
+    }
+    fingerprints["full"] = fingerprint(fingerprints["overview"], fingerprints["files"])
+    stale = [name for name in names
+             if not previous or previous.segments.get(name, {}).get("fingerprint") != fingerprints[name]]
+
+    file_content = ""
+    missing: list[str] = []
+    if "files" in stale or "full" in stale:
+        try:
+            file_content = fetch_file_contents(username, repo, file_list, minimizer, missing)
+        except ABORTING_ERRORS:
+            raise
+        except Exception as e:
+            logger.warning("Error getting GitHub file content of %s/%s, proceeding without: %s", username, repo, e)
+            missing = file_list
+    minimizer.report()
+    # Narrated from partial content: served this once, but not kept until the repo changes
+    degraded = {name for name in ("files", "full") if name in stale and missing}
+    if degraded:
+        logger.warning("Not caching %s of %s/%s, %d of %d files missing", ", ".join(sorted(degraded)), username, repo,
+                       len(missing), len(file_list))
+
+    # Fingerprints are of the raw inputs, the prompts get the minimized ones
+    inputs = {
+        "overview": (f"FILE TREE: {prompt_tree}\nREADME: {prompt_readme}", PODCAST_SSML_PROMPT_BEFORE_BREAK),
+        "files": (f"IMPORTANT FILES: {file_content}", PODCAST_SSML_PROMPT_AFTER_BREAK),
+        "full": (f"FILE TREE: {prompt_tree}\nREADME: {prompt_readme} IMPORTANT FILES: {file_content}", PODCAST_SSML_PROMPT),
+    }
+    with concurrent.futures.ThreadPoolExecutor() as executor:
+        futures = {
+            name: executor.submit(bind_context(process_github_content), inputs[name][0], inputs[name][1], MAX_CONTENT_CHARS, 100000,
+                                  "short_podcast" if name == "full" else "long_segment")
+            for name in stale
+        }
+        regenerated = {name: future.result() for name, future in futures.items()}
+    for response in regenerated.values():
+        if isinstance(response, dict):
+            return response
+
+    segments = {
+        name: {"fingerprint": fingerprints[name],
+               "ssml": regenerated[name] if name in regenerated else previous.segments[name]["ssml"]}
+        for name in names
+    }
+    stored = {name: segment for name, segment in segments.items() if name not in degraded}
+    narration_cache.save(username, repo, audio_length,
+                         NarrationSnapshot(tree["sha"], file_list, {p: blob_shas.get(p, "") for p in file_list}, stored))
+    for name in names:
+        record_cache("narration_segment", name not in stale)
+
+    return {
+        "segments": [(name, None if name in degraded else segments[name]["fingerprint"], segments[name]["ssml"])
+                     for name in names],
+        "reused": [name for name in names if name not in stale],
+        "input_chars": sum(len(inputs[name][0]) for name in stale),
+        "tree_sha": tree["sha"],
+    }
+
+
+def synthesize_segments(username: str, repo: str, audio_length: str, segments: list, output_format: str) -> bytes | None:
+    """
+    Synthesizes each segment separately, reusing stored audio of unchanged ones,
+    and stitches them frame by frame with a pause in between. Only valid for MP3 output.
+    """
+    parts = []
+    for name, segment_fingerprint, ssml in segments:
+        # No fingerprint: a segment from partial content, see generate_ssml_incrementally
+        audio = None
+        if segment_fingerprint is not None:
+            audio = narration_cache.load_audio(username, repo, audio_length, name, segment_fingerprint, output_format)
+            record_cache("narration_audio", audio is not None)
+        if audio is None:
+            audio = synthesize_audio(ssml, output_format)
+            if not audio:
+                return audio
+            if segment_fingerprint is not None:
+                narration_cache.save_audio(username, repo, audio_length, name, segment_fingerprint, output_format, audio)
+        parts.append(audio)
+    with stage("mp3_stitch"):
+        return mp3_frames.stitch(parts)
+
+
+def synthesize_audio(ssml_response: str, output_format: str) -> bytes | None:
+    with stage("text_to_mp3"):
+        return speech_service.text_to_mp3(ssml_response, output_format)
+
+
+def build_webvtt(ssml_response: str, audio_bytes: bytes, container: str = "mp3") -> str:
+    """Measures the audio's duration, stores the WebVTT subtitles and returns their id."""
+    if container == "mp3":
+        # Counted from the frame headers, no decoding needed
+        duration_in_seconds = mp3_frames.duration(audio_bytes)
+    else:
+        # Decoded in the CPU pool; the audio travels through shared memory
+        duration_in_seconds = run_cpu("audio_decode", postprocess.audio_duration, audio_bytes, container)
+    logger.debug("Audio duration: %.1fs", duration_in_seconds)
+    vtt_content = run_cpu("ssml_to_webvtt", postprocess.ssml_to_webvtt, ssml_response, duration_in_seconds)
+    return subtitle_store.put(vtt_content)
 
 
 class ApiRequest(BaseModel):
@@ -140,33 +395,77 @@ class ApiRequest(BaseModel):
     api_key: str | None = None
     audio: bool = False  # new param
     audio_length: str = 'long'
+    audio_format: str | None = None  # see audio_service.AUDIO_FORMATS, falls back to the Accept header
+    incremental: bool = False  # only regenerate segments whose source changed since the last run
+    normalize_loudness: bool = False
+
+
+def capture_shape(body: ApiRequest):
+    """What a traffic capture records of the request, see core/capture.py."""
+    capture.annotate(repo=capture.anonymize(body.username, body.repo), audio=body.audio,
+                     audio_length=body.audio_length, audio_format=body.audio_format, incremental=body.incremental)
+
+
+async def charge_generate(request: Request, body: ApiRequest):
+    """Cost-weighted rate limit, checked before the request queues for admission."""
+    # The first dependency, so requests turned away by the limiter or admission are captured with their shape
+    capture_shape(body)
+    client, cost = client_address(request), estimate_generate_cost(body.audio, body.audio_length)
+    await cost_limiter.charge(client, cost)
+    try:
+        yield
+    except AdmissionRejected:
+        # Shed before any work was done
+        await cost_limiter.refund(client, cost)
+        raise
 
 
 # @limiter.limit("1/minute;5/day") # TEMP: disable rate limit for growth??
-@router.post("")
-async def generate(request: Request, body: ApiRequest):
+# Heavy jobs are admitted through generate_admission; overflow beyond its queue gets 429 + Retry-After
+# The client's disconnect cancels the rest of the job, see core/resilience.py
+@router.post("", dependencies=[Depends(charge_generate), Depends(cancel_on_disconnect)])
+async def generate(request: Request, body: ApiRequest, admission: AdmissionSlot = Depends(generate_admission.slot)):
+    start_deadline(GENERATE_DEADLINE_SECONDS)
     try:
         if len(body.instructions) > 1000:
             return {"error": "Instructions exceed maximum length of 1000 characters"}
 
-        github_data = get_cached_github_data(body.username, body.repo)
-        default_branch = github_data["default_branch"]
-        file_tree = github_data["file_tree"]
-        readme = github_data["readme"]
-        file_content = github_data["file_content"]
+        audio_format = negotiate_format(body.audio_format, request.headers.get("accept"))
+        if body.audio and audio_format.needs_transcode(body.normalize_loudness) and not ffmpeg_available():
+            return {"error": f"Audio format {audio_format.name} is not available on this server"}
+
         audio_length = body.audio_length
-        result = generate_ssml_concurrently(file_tree, readme, file_content, audio_length)
+        incremental = None
+        featured = is_featured(body.username, body.repo)
+        # Featured repos are kept pre-rendered in the narration cache by the warm-up task
+        if body.incremental or featured:
+            incremental = await run_in_stage("llm", generate_ssml_incrementally, body.username, body.repo, audio_length,
+                                             FEATURED_MAX_STALENESS if featured else 0)
+            if "error" in incremental:
+                result = incremental
+            else:
+                await cost_limiter.settle(client_address(request), estimate_content_cost(incremental["input_chars"]))
+                result = await run_in_stage("encode", combine_ssml, [ssml for _, _, ssml in incremental["segments"]])
+        else:
+            github_data = await run_in_stage("fetch", fetch_github_data, body.username, body.repo)
+            default_branch = github_data["default_branch"]
+            file_tree = github_data["file_tree"]
+            readme = github_data["readme"]
+            file_content = github_data["file_content"]
+            capture.annotate(tree_chars=len(file_tree), readme_chars=len(readme), file_chars=len(file_content),
+                             files=len(github_data["file_list"]))
+            await cost_limiter.settle(client_address(request),
+                                      estimate_content_cost(len(file_tree) + len(readme) + len(file_content)))
+            result = await run_in_stage("llm", generate_ssml_concurrently, file_tree, readme, file_content, audio_length)
         # Check if there was an error response
         if isinstance(result, dict):  # There was an error
-            print("Error in processing:")
-            for error in result.get("errors", []):
-                print(error)
+            logger.error("Error in processing: %s", "; ".join(map(str, result.get("errors", []))))
             return {"error": "Some error in genererating audio: E001"}
         else:
             # Successful processing
             full_ssml_response = result
 
-        print(full_ssml_response)
+        log_payload(logger, "Full SSML", full_ssml_response)
         ssml_response = full_ssml_response
 
         if not body.audio:
@@ -174,71 +473,110 @@ async def generate(request: Request, body: ApiRequest):
                     "explanation": 'EXPLANATION'}
         else:
 
-            audio_bytes = speech_service.text_to_mp3(ssml_response)
+            if incremental and audio_format.source_container == "mp3":
+                audio_bytes = await run_in_stage("tts", synthesize_segments, body.username, body.repo, audio_length,
+                                                 incremental["segments"], audio_format.source_format)
+            else:
+                audio_bytes = await run_in_stage("tts", synthesize_audio, ssml_response, audio_format.source_format)
 
             if audio_bytes:
-                response = Response(content=audio_bytes, media_type="audio/mpeg", headers={"Content-Disposition": "attachment; filename=explanation.mp3"})
-
-                audio = AudioSegment.from_file(io.BytesIO(audio_bytes), format="mp3")
-                duration_in_seconds = len(audio) / 1000.0
-                print("duration in sec", duration_in_seconds)
-                vtt_content = speech_service.ssml_to_webvtt(ssml_response, duration_in_seconds)
-                encoded_vtt_content = base64.b64encode(vtt_content.encode('utf-8')).decode('utf-8')
-                response.headers["X-VTT-Content"] = encoded_vtt_content
-
-                response.headers["Access-Control-Expose-Headers"] = "X-VTT-Content"
+                headers = {"Content-Disposition": f"attachment; filename=explanation.{audio_format.extension}"}
+                if audio_format.needs_transcode(body.normalize_loudness):
+                    # Streams ffmpeg's output as it is encoded
+                    response = StreamingResponse(
+                        transcode_stream(audio_bytes, audio_format.source_container, audio_format, body.normalize_loudness),
+                        media_type=audio_format.media_type, headers=headers)
+                else:
+                    response = Response(content=audio_bytes, media_type=audio_format.media_type, headers=headers)
+                    record_bytes("audio", "out", len(audio_bytes))
+
+                subtitle_id = await run_in_stage(
+                    "encode", build_webvtt, ssml_response, audio_bytes, audio_format.source_container)
+                # Subtitles are fetched separately from /generate/subtitles so headers stay small
+                response.headers["X-VTT-Url"] = f"{router.prefix}/subtitles/{subtitle_id}"
+
+                if incremental:
+                    response.headers["X-Reused-Segments"] = ",".join(incremental["reused"])
+                response.headers["Access-Control-Expose-Headers"] = "X-VTT-Url, X-Reused-Segments"
                 response.headers["Access-Control-Allow-Origin"] = "*"
+                if isinstance(response, StreamingResponse):
+                    # The transcode runs while the body streams, so the slot is held until it is sent
+                    hold_while_streaming(response, admission.hand_over())
                 return response
             else:
                 return {"error": "Text to speech is not available. Please set Azure speech credentials in .env E002"}
-    except RateLimitError as e:
-        raise HTTPException(
-            status_code=429,
-            detail="Service is currently experiencing high demand. Please try again in a few minutes."
-        )
     except Exception as e:
+        if is_rate_limit_error(e):
+            raise HTTPException(
+                status_code=429,
+                detail="Service is currently experiencing high demand. Please try again in a few minutes."
+            )
+        http_error = as_http_error(e)
+        if http_error:
+            raise http_error
         return {"error": str(e)}
 
 
+@router.get("/subtitles/{subtitle_id}")
+async def get_subtitles(request: Request, subtitle_id: str):
+    compressed = subtitle_store.get_compressed(subtitle_id)
+    if compressed is None:
+        raise HTTPException(status_code=404, detail="Subtitles not found")
+
+    # The id is a content hash, so it is a strong ETag and the resource never changes
+    etag = f'"{subtitle_id}"'
+    headers = {
+        "ETag": etag,
+        "Cache-Control": "public, max-age=31536000, immutable",
+        "Vary": "Accept-Encoding",
+        "Access-Control-Allow-Origin": "*",
+    }
+    if etag in request.headers.get("if-none-match", ""):
+        return Response(status_code=304, headers=headers)
+
+    if "gzip" in request.headers.get("accept-encoding", ""):
+        headers["Content-Encoding"] = "gzip"
+        content = compressed
+    else:
+        content = gzip.decompress(compressed)
+    record_bytes("subtitles", "out", len(content))
+    return Response(content=content, media_type="text/vtt; charset=utf-8", headers=headers)
+
+
 @router.post("/cost")
 # @limiter.limit("5/minute") # TEMP: disable rate limit for growth??
 async def get_generation_cost(request: Request, body: ApiRequest):
+    capture_shape(body)
     try:
-        # Get file tree and README content
-        github_data = get_cached_github_data(body.username, body.repo)
-        file_tree = github_data["file_tree"]
-        readme = github_data["readme"]
-
-        # Calculate combined token count
-        file_tree_tokens = claude_service.count_tokens(file_tree)
-        readme_tokens = claude_service.count_tokens(readme)
-
-        # Calculate approximate cost
-        # Input cost: $3 per 1M tokens ($0.000003 per token)
-        # Output cost: $15 per 1M tokens ($0.000015 per token)
-        # Estimate output tokens as roughly equal to input tokens
-        input_cost = ((file_tree_tokens * 2 + readme_tokens) + 3000) * 0.000003
-        output_cost = 3500 * 0.000015
-        estimated_cost = input_cost + output_cost
+        # Only the tree (one GitHub request, or none while the snapshot is fresh); the generation reuses it
+        tree = await run_in_stage("fetch", fetch_tree, body.username, body.repo)
+        # Estimated locally from file and README sizes, priced per model tier
+        estimate = estimate_generation(tree, body.audio_length, MAX_CONTENT_CHARS)
 
         # Format as currency string
-        cost_string = f"${estimated_cost:.2f} USD"
-        return {"cost": cost_string}
+        cost_string = f"${estimate['cost_usd']:.2f} USD"
+        return {"cost": cost_string, "input_tokens": estimate["input_tokens"], "output_tokens": estimate["output_tokens"]}
     except Exception as e:
         return {"error": str(e)}
 
 
-def process_click_events(diagram: str, username: str, repo: str, branch: str) -> str:
+def process_click_events(diagram: str, username: str, repo: str, branch: str, path_index: PathIndex | None = None) -> str:
     """
     Process click events in Mermaid diagram to include full GitHub URLs.
-    Detects if path is file or directory and uses appropriate URL format.
+    With a path_index, paths are corrected to real ones and blob/tree is known
+    exactly; without one, a path is taken to be a file if its name has an extension.
     """
     def replace_path(match):
         # Extract the path from the click event
         path = match.group(2).strip('"\'')
 
-        # Determine if path is likely a file (has extension) or directory
-        is_file = '.' in path.split('/')[-1]
+        resolved = path_index.resolve(path) if path_index else None
+        if resolved:
+            path = resolved
+            is_file = path_index.is_file(path)
+        else:
+            # Determine if path is likely a file (has extension) or directory
+            is_file = '.' in path.split('/')[-1]
 
         # Construct GitHub URL
         base_url = f"https://github.com/{username}/{repo}"
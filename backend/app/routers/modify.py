@@ -1,17 +1,24 @@
-from fastapi import APIRouter, Request, HTTPException
-from dotenv import load_dotenv
-from app.services.claude_service import ClaudeService
+from fastapi import APIRouter, Request, HTTPException, Depends
+from fastapi.responses import StreamingResponse
 from app.core.limiter import limiter
-from anthropic._exceptions import RateLimitError
-from app.prompts import SYSTEM_MODIFY_PROMPT
+from app.core.admission import run_in_stage, stream_in_stage, hold_while_streaming
+from app.core.services import services, is_rate_limit_error
+from app.core.resilience import start_deadline, as_http_error, cancel_on_disconnect, DisconnectWatch
+from app.services.diagram_patch import number_lines, apply_patch
+from app.prompts import SYSTEM_MODIFY_PROMPT, SYSTEM_MODIFY_DIFF_PROMPT
 from pydantic import BaseModel
-
-load_dotenv()
+import json
+import logging
+import os
 
 router = APIRouter(prefix="/modify", tags=["Claude"])
 
-# Initialize services
-claude_service = ClaudeService()
+logger = logging.getLogger(__name__)
+
+MODIFY_DEADLINE_SECONDS = float(os.getenv("MODIFY_DEADLINE_SECONDS", "120"))
+
+# Built on first use, see app/core/services.py
+claude_service = services.lazy("claude")
 
 # Define the request body model
 
@@ -22,39 +29,117 @@ class ModifyRequest(BaseModel):
     repo: str
     username: str
     explanation: str
+    stream: bool = False  # send model output as Server-Sent Events while it is generated, full mode only
+    mode: str = "full"  # "full": the model rewrites the diagram, "diff": it only returns changed lines
+
+
+def modify_prompt(body: ModifyRequest, mode: str) -> tuple[str, dict]:
+    if mode == "diff":
+        # Numbered, so the model can address lines instead of repeating them
+        return SYSTEM_MODIFY_DIFF_PROMPT, {
+            "instructions": body.instructions,
+            "explanation": body.explanation,
+            "diagram": number_lines(body.current_diagram),
+        }
+    return SYSTEM_MODIFY_PROMPT, {
+        "instructions": body.instructions,
+        "explanation": body.explanation,
+        "diagram": body.current_diagram,
+    }
+
+
+def sse(event: str, payload: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+
+
+def validate(body: ModifyRequest) -> str | None:
+    # Check instructions length
+    if not body.instructions or not body.current_diagram:
+        return "Instructions and/or current diagram are required"
+    elif len(body.instructions) > 1000 or len(body.current_diagram) > 100000:  # just being safe
+        return "Instructions exceed maximum length of 1000 characters"
+
+    if body.repo in ["fastapi", "streamlit", "flask", "api-analytics", "monkeytype"]:
+        return "Example repos cannot be modified"
+
+    if body.mode not in ("full", "diff"):
+        return "mode must be 'full' or 'diff'"
+    # An edit script is no use to show while it is generated, and may have to be redone in full
+    if body.stream and body.mode != "full":
+        return "stream is only available with mode 'full'"
+    return None
+
+
+async def stream_modification(body: ModifyRequest):
+    """
+    Yields the diagram as `delta` events while the model writes it, then the whole
+    of it as a `done` event.
+    """
+    try:
+        system_prompt, data = modify_prompt(body, "full")
+        chunks = []
+        async for text in stream_in_stage("llm", claude_service.stream_claude_api,
+                                          system_prompt=system_prompt, data=data):
+            chunks.append(text)
+            yield sse("delta", {"text": text})
+        response = "".join(chunks)
+
+        # Check for BAD_INSTRUCTIONS response
+        if "BAD_INSTRUCTIONS" in response:
+            yield sse("error", {"error": "Invalid or unclear instructions provided"})
+            return
+        yield sse("done", {"diagram": response})
+    except Exception as e:
+        if is_rate_limit_error(e):
+            yield sse("error", {"error": "Service is currently experiencing high demand. Please try again in a few minutes."})
+        else:
+            yield sse("error", {"error": str(e)})
 
 
 @router.post("")
 @limiter.limit("2/minute;10/day")
-async def modify(request: Request, body: ModifyRequest):
+async def modify(request: Request, body: ModifyRequest, watch: DisconnectWatch = Depends(cancel_on_disconnect)):
+    start_deadline(MODIFY_DEADLINE_SECONDS)
     try:
-        # Check instructions length
-        if not body.instructions or not body.current_diagram:
-            return {"error": "Instructions and/or current diagram are required"}
-        elif len(body.instructions) > 1000 or len(body.current_diagram) > 100000:  # just being safe
-            return {"error": "Instructions exceed maximum length of 1000 characters"}
-
-        if body.repo in ["fastapi", "streamlit", "flask", "api-analytics", "monkeytype"]:
-            return {"error": "Example repos cannot be modified"}
-
-        modified_mermaid_code = claude_service.call_claude_api(
-            system_prompt=SYSTEM_MODIFY_PROMPT,
-            data={
-                "instructions": body.instructions,
-                "explanation": body.explanation,
-                "diagram": body.current_diagram
-            }
-        )
+        error = validate(body)
+        if error:
+            return {"error": error}
+
+        if body.stream:
+            response = StreamingResponse(stream_modification(body), media_type="text/event-stream", headers={
+                "Cache-Control": "no-cache",
+                # Tells nginx not to buffer the events
+                "X-Accel-Buffering": "no",
+            })
+            # The model keeps generating after the handler returns; stop it if the client goes away
+            return hold_while_streaming(response, watch.hand_over())
+
+        system_prompt, data = modify_prompt(body, body.mode)
+        response = await run_in_stage("llm", claude_service.call_claude_api, system_prompt=system_prompt, data=data)
 
         # Check for BAD_INSTRUCTIONS response
-        if "BAD_INSTRUCTIONS" in modified_mermaid_code:
+        if "BAD_INSTRUCTIONS" in response:
             return {"error": "Invalid or unclear instructions provided"}
 
-        return {"diagram": modified_mermaid_code}
-    except RateLimitError as e:
-        raise HTTPException(
-            status_code=429,
-            detail="Service is currently experiencing high demand. Please try again in a few minutes."
-        )
+        if body.mode == "full":
+            return {"diagram": response}
+        try:
+            return {"diagram": apply_patch(body.current_diagram, response)}
+        except ValueError as e:
+            logger.info("Diagram patch did not apply (%s), regenerating the full diagram", e)
+            system_prompt, data = modify_prompt(body, "full")
+            modified_mermaid_code = await run_in_stage(
+                "llm", claude_service.call_claude_api, system_prompt=system_prompt, data=data)
+            if "BAD_INSTRUCTIONS" in modified_mermaid_code:
+                return {"error": "Invalid or unclear instructions provided"}
+            return {"diagram": modified_mermaid_code}
     except Exception as e:
+        if is_rate_limit_error(e):
+            raise HTTPException(
+                status_code=429,
+                detail="Service is currently experiencing high demand. Please try again in a few minutes."
+            )
+        http_error = as_http_error(e)
+        if http_error:
+            raise http_error
         return {"error": str(e)}
@@ -0,0 +1,99 @@
+from fastapi import APIRouter
+from app.core.admission import run_in_stage
+from app.core.metrics import WARMUP_ITEMS
+from app.core.warmup import (
+    WarmupStatus, WARMUP_REPOS, WARMUP_AUDIO_LENGTHS, WARMUP_AUDIO_FORMATS, WARMUP_INTERVAL_SECONDS,
+)
+from app.routers.generate import generate_ssml_incrementally, synthesize_segments
+from app.services.audio_service import AUDIO_FORMATS
+from app.services.narration_cache import narration_cache
+import asyncio
+import logging
+import time
+
+router = APIRouter(prefix="/warmup", tags=["Warmup"])
+
+logger = logging.getLogger(__name__)
+
+# How often a worker checks whether a cycle is due (or whether the worker running it died)
+POLL_SECONDS = 60
+
+status = WarmupStatus(narration_cache.directory)
+
+
+async def warm_repo(username: str, repo: str, audio_length: str, output_formats: list[str]):
+    """
+    Brings one featured narration up to date. generate_ssml_incrementally only calls
+    GitHub for the tree when the head has not moved, so steady-state cycles are cheap.
+    """
+    status.update_item(username, repo, audio_length, state="checking", error=None)
+    try:
+        result = await run_in_stage("llm", generate_ssml_incrementally, username, repo, audio_length)
+        if "error" in result:
+            raise ValueError(result["error"])
+        changed = [name for name, _, _ in result["segments"] if name not in result["reused"]]
+        if changed:
+            status.update_item(username, repo, audio_length, state="rendering")
+        for output_format in output_formats:
+            if not await run_in_stage("tts", synthesize_segments, username, repo, audio_length,
+                                      result["segments"], output_format):
+                raise ValueError("Text to speech is not available")
+        status.update_item(username, repo, audio_length, state="hot", tree_sha=result["tree_sha"],
+                           refreshed_at=time.time(), rendered=changed)
+        WARMUP_ITEMS.labels("rendered" if changed else "unchanged").inc()
+    except Exception as e:
+        logger.warning("Warm-up of %s/%s (%s) failed: %s", username, repo, audio_length, e)
+        status.update_item(username, repo, audio_length, state="error", error=str(e))
+        WARMUP_ITEMS.labels("error").inc()
+
+
+async def warm_all():
+    output_formats = []
+    for name in WARMUP_AUDIO_FORMATS:
+        if AUDIO_FORMATS.get(name) and AUDIO_FORMATS[name].source_container == "mp3":
+            output_formats.append(AUDIO_FORMATS[name].source_format)
+        else:
+            logger.info("Warm-up skips audio format %s: only MP3 formats are pre-rendered", name)
+
+    status.load()
+    status.data["cycle_started_at"] = time.time()
+    keys = {f"{username}/{repo}:{length}" for username, repo in WARMUP_REPOS for length in WARMUP_AUDIO_LENGTHS}
+    status.data["items"] = {key: item for key, item in status.data["items"].items() if key in keys}
+    for username, repo in WARMUP_REPOS:
+        for audio_length in WARMUP_AUDIO_LENGTHS:
+            status.update_item(username, repo, audio_length)
+
+    # One narration at a time keeps warm-up to a single slot of each stage pool, leaving the rest to users
+    for username, repo in WARMUP_REPOS:
+        for audio_length in WARMUP_AUDIO_LENGTHS:
+            await warm_repo(username, repo, audio_length, output_formats)
+
+    status.load()
+    status.data["cycle_finished_at"] = time.time()
+    status.save()
+
+
+async def warmup_loop():
+    while True:
+        # Every worker runs this loop; the lock lets exactly one of them do each cycle
+        if status.try_lock():
+            try:
+                if status.is_due():
+                    await warm_all()
+            except Exception as e:
+                logger.exception("Warm-up cycle failed: %s", e)
+            finally:
+                status.unlock()
+        if WARMUP_INTERVAL_SECONDS == 0 and not status.is_due():
+            return
+        await asyncio.sleep(POLL_SECONDS)
+
+
+def start() -> asyncio.Task:
+    return asyncio.create_task(warmup_loop())
+
+
+# Not routed by nginx (see nginx/api.conf), like /metrics
+@router.get("")
+async def get_warmup_status():
+    return status.report()
@@ -0,0 +1,168 @@
+import logging
+import shutil
+import subprocess
+import threading
+from typing import Iterator
+
+from app.core.metrics import record_bytes, stage
+
+logger = logging.getLogger(__name__)
+
+# Single pass EBU R128 normalisation (dynamic mode), works on a stream
+LOUDNORM_FILTER = "loudnorm=I=-16:TP=-1.5:LRA=11"
+
+
+class AudioFormat:
+    """
+    An output format the API can serve.
+
+    native_format is the Azure SpeechSynthesisOutputFormat that produces it directly.
+    Formats Azure cannot produce are synthesized as source_format and transcoded with
+    ffmpeg using encode_args; those args are also used when loudness normalisation
+    forces a native format through ffmpeg.
+    """
+
+    def __init__(self, name: str, media_type: str, extension: str, encode_args: list[str],
+                 native_format: str | None = None, source_format: str | None = None):
+        self.name = name
+        self.media_type = media_type
+        self.extension = extension
+        self.encode_args = encode_args
+        self.native_format = native_format
+        self.source_format = native_format or source_format
+
+    @property
+    def source_container(self) -> str:
+        """ffmpeg/pydub container name of what the synthesizer returns."""
+        source = self.source_format.lower()
+        if source.startswith("ogg"):
+            return "ogg"
+        if source.startswith("webm"):
+            return "webm"
+        return "mp3"
+
+    def needs_transcode(self, normalize: bool) -> bool:
+        return normalize or self.native_format is None
+
+
+AUDIO_FORMATS = {
+    fmt.name: fmt for fmt in [
+        # Default, what the frontend has always received
+        AudioFormat("mp3-32k", "audio/mpeg", "mp3",
+                    ["-c:a", "libmp3lame", "-b:a", "32k", "-ar", "16000", "-ac", "1", "-f", "mp3"],
+                    native_format="Audio16Khz32KBitRateMonoMp3"),
+        AudioFormat("mp3-96k", "audio/mpeg", "mp3",
+                    ["-c:a", "libmp3lame", "-b:a", "96k", "-ar", "24000", "-ac", "1", "-f", "mp3"],
+                    native_format="Audio24Khz96KBitRateMonoMp3"),
+        AudioFormat("mp3-192k", "audio/mpeg", "mp3",
+                    ["-c:a", "libmp3lame", "-b:a", "192k", "-ar", "48000", "-ac", "1", "-f", "mp3"],
+                    native_format="Audio48Khz192KBitRateMonoMp3"),
+        AudioFormat("opus", "audio/ogg", "ogg",
+                    ["-c:a", "libopus", "-b:a", "32k", "-ar", "48000", "-ac", "1", "-f", "ogg"],
+                    native_format="Ogg24Khz16BitMonoOpus"),
+        AudioFormat("webm-opus-24k", "audio/webm", "webm",
+                    ["-c:a", "libopus", "-b:a", "24k", "-ar", "48000", "-ac", "1", "-f", "webm"],
+                    native_format="Webm24Khz16Bit24KbpsMonoOpus"),
+        # Speech stays intelligible at 16 kbps Opus, about half the default MP3 size
+        AudioFormat("opus-16k", "audio/ogg", "ogg",
+                    ["-c:a", "libopus", "-b:a", "16k", "-application", "voip", "-ar", "48000", "-ac", "1", "-f", "ogg"],
+                    source_format="Audio24Khz48KBitRateMonoMp3"),
+        AudioFormat("aac-64k", "audio/aac", "aac",
+                    ["-c:a", "aac", "-b:a", "64k", "-ar", "24000", "-ac", "1", "-f", "adts"],
+                    source_format="Audio24Khz96KBitRateMonoMp3"),
+    ]
+}
+
+DEFAULT_AUDIO_FORMAT = "mp3-32k"
+
+# Accept media types mapped to the format served for them
+ACCEPT_FORMATS = {
+    "audio/mpeg": "mp3-32k",
+    "audio/mp3": "mp3-32k",
+    "audio/ogg": "opus",
+    "audio/opus": "opus",
+    "audio/webm": "webm-opus-24k",
+    "audio/aac": "aac-64k",
+}
+
+
+def negotiate_format(requested: str | None, accept: str | None) -> AudioFormat:
+    """
+    Picks the output format: an explicit request parameter wins, then the
+    highest q-value audio type in the Accept header, then the default.
+    """
+    if requested:
+        if requested not in AUDIO_FORMATS:
+            raise ValueError(f"Unsupported audio format '{requested}'. Choose from: {', '.join(AUDIO_FORMATS)}")
+        return AUDIO_FORMATS[requested]
+
+    candidates = []
+    for position, part in enumerate((accept or "").split(",")):
+        media_type, *params = [p.strip() for p in part.split(";")]
+        quality = 1.0
+        for param in params:
+            if param.startswith("q="):
+                try:
+                    quality = float(param[2:])
+                except ValueError:
+                    quality = 0.0
+        if media_type.lower() in ACCEPT_FORMATS and quality > 0:
+            candidates.append((-quality, position, ACCEPT_FORMATS[media_type.lower()]))
+    if candidates:
+        return AUDIO_FORMATS[min(candidates)[2]]
+    return AUDIO_FORMATS[DEFAULT_AUDIO_FORMAT]
+
+
+def ffmpeg_available() -> bool:
+    return shutil.which("ffmpeg") is not None
+
+
+def transcode_stream(source: bytes, source_container: str, target: AudioFormat, normalize: bool = False,
+                     chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+    """
+    Pipes encoded audio through ffmpeg (stdin -> stdout) and yields the output in
+    chunks as ffmpeg produces them, so neither decoded PCM nor the whole output
+    file is held in memory.
+    """
+    args = ["ffmpeg", "-hide_banner", "-loglevel", "error", "-f", source_container, "-i", "pipe:0"]
+    if normalize:
+        args += ["-af", LOUDNORM_FILTER]
+    args += target.encode_args + ["pipe:1"]
+
+    process = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+
+    def feed():
+        try:
+            view = memoryview(source)
+            for offset in range(0, len(view), chunk_size):
+                process.stdin.write(view[offset:offset + chunk_size])
+        except BrokenPipeError:
+            pass
+        finally:
+            try:
+                process.stdin.close()
+            except BrokenPipeError:
+                pass
+
+    # Feed from a separate thread so a full stdout pipe cannot deadlock us
+    writer = threading.Thread(target=feed, daemon=True)
+    writer.start()
+    produced = 0
+    completed = False
+    try:
+        with stage("transcode"):
+            while chunk := process.stdout.read(chunk_size):
+                produced += len(chunk)
+                yield chunk
+        completed = True
+    finally:
+        process.stdout.close()
+        if not completed:
+            # Client went away mid-stream
+            process.kill()
+        process.wait()
+        writer.join()
+        record_bytes("transcode", "out", produced)
+        if completed and process.returncode != 0:
+            logger.error("ffmpeg transcode to %s failed: %s", target.name, process.stderr.read().decode(errors="replace"))
+        process.stderr.close()
@@ -1,8 +1,9 @@
 from anthropic import Anthropic
-from dotenv import load_dotenv
 import os
+from typing import Iterator
+from app.core.model_routing import model_call
+from app.core.resilience import upstream, call_timeout, check_cancelled, RequestCancelled
 
-load_dotenv()
 
 class ClaudeService:
     def __init__(self):
@@ -11,7 +12,8 @@ class ClaudeService:
         self.speech_key = os.environ.get("SPEECH_KEY")
         self.speech_region = os.environ.get("SPEECH_REGION")
 
-    def call_claude_api(self, system_prompt: str, data: dict, api_key: str | None = None) -> str:
+    def call_claude_api(self, system_prompt: str, data: dict, api_key: str | None = None, max_tokens: int | None = None,
+                        call_site: str = "modify") -> str:
         """
         Makes an API call to Claude and returns the response.
 
@@ -19,6 +21,8 @@ class ClaudeService:
             system_prompt (str): The instruction/system prompt
             data (dict): Dictionary of variables to format into the user message
             api_key (str | None): Optional custom API key
+            max_tokens (int | None): Cap on the length of the response, the routed tier's by default
+            call_site (str): Call site the model tier is routed for
 
         Returns:
             str: Claude's response text
@@ -29,25 +33,55 @@ class ClaudeService:
         # Use custom client if API key provided, otherwise use default
         client = Anthropic(api_key=api_key) if api_key else self.default_client
 
-        message = client.messages.create(
-            model="claude-3-5-sonnet-latest",
-            max_tokens=4096,
-            temperature=0,
-            system=system_prompt,
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": user_message
-                        }
-                    ]
-                }
-            ]
-        )
+        with model_call(call_site, system_prompt + user_message) as tier, upstream("claude", "messages"):
+            message = client.messages.create(
+                model=tier.model,
+                max_tokens=max_tokens or tier.max_tokens,
+                temperature=0,
+                system=system_prompt,
+                timeout=call_timeout("claude"),
+                messages=[
+                    {
+                        "role": "user",
+                        "content": [
+                            {
+                                "type": "text",
+                                "text": user_message
+                            }
+                        ]
+                    }
+                ]
+            )
         return message.content[0].text  # type: ignore
 
+    def stream_claude_api(self, system_prompt: str, data: dict, api_key: str | None = None,
+                          max_tokens: int | None = None, call_site: str = "modify") -> Iterator[str]:
+        """
+        Same as call_claude_api, but yields the response text as it is generated.
+        Closing the generator early closes the HTTP stream, which stops generation;
+        so does the client of the request disconnecting.
+        """
+        user_message = self._format_user_message(data)
+        client = Anthropic(api_key=api_key) if api_key else self.default_client
+
+        with model_call(call_site, system_prompt + user_message) as tier, upstream("claude", "messages_stream") as call:
+            with client.messages.stream(
+                model=tier.model,
+                max_tokens=max_tokens or tier.max_tokens,
+                temperature=0,
+                system=system_prompt,
+                messages=[{"role": "user", "content": [{"type": "text", "text": user_message}]}],
+                timeout=call_timeout("claude"),
+            ) as stream:
+                try:
+                    for text in stream.text_stream:
+                        check_cancelled("claude_stream")
+                        call.bytes_in += len(text)
+                        yield text
+                except (GeneratorExit, RequestCancelled):
+                    call.status = "closed"
+                    raise
+
     # autopep8: off
     def _format_user_message(self, data: dict[str, str]) -> str:
         """Helper method to format the data into a user message"""
@@ -80,11 +114,13 @@ class ClaudeService:
         Returns:
             int: Number of input tokens
         """
-        response = self.default_client.messages.count_tokens(
-            model="claude-3-5-sonnet-latest",
-            messages=[{
-                "role": "user",
-                "content": prompt
-            }]
-        )
+        with upstream("claude", "count_tokens"):
+            response = self.default_client.messages.count_tokens(
+                model="claude-3-5-sonnet-latest",
+                messages=[{
+                    "role": "user",
+                    "content": prompt
+                }],
+                timeout=call_timeout("claude"),
+            )
         return response.input_tokens
\ No newline at end of file
@@ -0,0 +1,237 @@
+import hashlib
+import logging
+import os
+import posixpath
+import re
+from collections import Counter, defaultdict
+
+from app.core.metrics import CONTENT_CHARS
+from app.services.file_selection import CHARS_PER_TOKEN
+
+logger = logging.getLogger(__name__)
+
+MINIMIZE_CONTENT = os.getenv("MINIMIZE_CONTENT", "true").lower() == "true"
+# Longer lines (minified bundles, embedded data) are cut to this many characters
+MAX_LINE_CHARS = int(os.getenv("MAX_LINE_CHARS", "400"))
+# A directory listing more files than this directly is collapsed to its first few and a summary
+MAX_TREE_SIBLINGS = int(os.getenv("MAX_TREE_SIBLINGS", "25"))
+TREE_SIBLINGS_SHOWN = 8
+# Shorter blocks (headings, one-liners) are too generic to treat as duplicates
+MIN_DUPLICATE_BLOCK_CHARS = 80
+
+# Runs that are almost certainly encoded data rather than words or identifiers
+BASE64_RUN = re.compile(r"[A-Za-z0-9+/]{120,}={0,2}")
+HTML_COMMENT = re.compile(r"<!--.*?-->", re.DOTALL)
+
+HASH_COMMENT_EXTENSIONS = {
+    ".py", ".pyi", ".sh", ".bash", ".zsh", ".fish", ".rb", ".pl", ".r", ".yaml", ".yml", ".toml", ".cfg",
+    ".conf", ".ini", ".mk", ".cmake", ".ps1", ".tf", ".nim", ".jl", ".ex", ".exs", ".cr", ".coffee",
+}
+HASH_COMMENT_NAMES = {"dockerfile", "makefile", "gemfile", "rakefile", "procfile", ".gitignore", ".dockerignore", ".env.example"}
+SLASH_COMMENT_EXTENSIONS = {
+    ".js", ".jsx", ".mjs", ".cjs", ".ts", ".tsx", ".java", ".kt", ".kts", ".scala", ".groovy", ".gradle",
+    ".go", ".c", ".h", ".cc", ".cpp", ".cxx", ".hpp", ".mm", ".cs", ".rs", ".swift", ".dart", ".php",
+    ".css", ".scss", ".less", ".proto", ".zig", ".sol", ".fs",
+}
+DASH_COMMENT_EXTENSIONS = {".sql", ".lua", ".hs", ".elm", ".ada"}
+MARKUP_EXTENSIONS = {".html", ".htm", ".xml", ".vue", ".svelte", ".md", ".mdx"}
+PROSE_EXTENSIONS = {".md", ".mdx", ".rst", ".txt", ".adoc", ""}
+TRIPLE_QUOTES = ('"""', "'''")
+# Doc comments (Rust ///, //!, JSDoc/Javadoc /**) describe the API like docstrings do
+SLASH_DOC_COMMENTS = ("///", "//!")
+
+
+def estimate_tokens(chars: int) -> int:
+    return chars // CHARS_PER_TOKEN
+
+
+def cap_lines(text: str) -> str:
+    """Replaces encoded data runs with a placeholder and cuts lines longer than MAX_LINE_CHARS."""
+    text = BASE64_RUN.sub(lambda match: f"<encoded data, {len(match.group())} chars>", text)
+    lines = []
+    for line in text.splitlines():
+        if len(line) > MAX_LINE_CHARS:
+            line = f"{line[:MAX_LINE_CHARS]} ...[{len(line) - MAX_LINE_CHARS} more chars]"
+        lines.append(line.rstrip())
+    return "\n".join(lines)
+
+
+def _open_triple_quote(line: str, quote: str | None) -> str | None:
+    """The triple quote still open at the end of line, given the one open at its start."""
+    position = 0
+    while True:
+        if quote:
+            end = line.find(quote, position)
+            if end < 0:
+                return quote
+            position, quote = end + 3, None
+        else:
+            starts = [(start, q) for q in TRIPLE_QUOTES if (start := line.find(q, position)) >= 0]
+            if not starts:
+                return None
+            start, quote = min(starts)
+            position = start + 3
+
+
+def _strip_hash_comments(text: str) -> str:
+    lines = []
+    quote = None
+    for line in text.splitlines():
+        # Lines inside a triple-quoted string (docstrings, templates) are kept as they are
+        if not quote and line.lstrip().startswith("#"):
+            continue
+        quote = _open_triple_quote(line, quote)
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def strip_comments(path: str, text: str) -> str:
+    """
+    Drops whole-line comments and comment blocks (which takes license headers with
+    them) in the comment syntax of the file's language. Trailing comments are kept:
+    telling them apart from "#" or "//" inside strings would need a real parser, and
+    the result is only read by the model, so being conservative costs a few tokens
+    at most. Docstrings and doc comments are kept, they usually are the best summary
+    of the code.
+    """
+    name = posixpath.basename(path).lower()
+    extension = posixpath.splitext(name)[1]
+    if extension in MARKUP_EXTENSIONS:
+        text = HTML_COMMENT.sub("", text)
+    if extension in HASH_COMMENT_EXTENSIONS or name in HASH_COMMENT_NAMES:
+        return _strip_hash_comments(text)
+    if extension in DASH_COMMENT_EXTENSIONS:
+        return "\n".join(line for line in text.splitlines() if not line.lstrip().startswith("--"))
+    if extension not in SLASH_COMMENT_EXTENSIONS:
+        return text
+
+    lines = []
+    in_block = in_doc = False
+    for line in text.splitlines():
+        stripped = line.lstrip()
+        if in_doc:
+            lines.append(line)
+            in_doc = "*/" not in line
+            continue
+        if in_block:
+            if "*/" in line:
+                in_block = False
+                rest = line.split("*/", 1)[1]
+                if rest.strip():
+                    lines.append(rest)
+            continue
+        if stripped.startswith(SLASH_DOC_COMMENTS) or (stripped.startswith("/**") and not stripped.startswith("/**/")):
+            lines.append(line)
+            in_doc = stripped.startswith("/**") and "*/" not in stripped[3:]
+            continue
+        if stripped.startswith("//"):
+            continue
+        if stripped.startswith("/*"):
+            if "*/" not in stripped[2:]:
+                in_block = True
+                continue
+            rest = stripped[2:].split("*/", 1)[1]
+            if rest.strip():
+                lines.append(rest)
+            continue
+        lines.append(line)
+    return "\n".join(lines)
+
+
+def compact_tree(file_tree: str) -> str:
+    """
+    Collapses directories with more than MAX_TREE_SIBLINGS files directly in them
+    (icon sets, fixtures, migrations, translations) to their first few files and a
+    line summarising the rest by extension. Subdirectories are listed as before.
+    """
+    paths = [path for path in file_tree.splitlines() if path]
+    siblings: dict[str, list[str]] = defaultdict(list)
+    for path in paths:
+        siblings[posixpath.dirname(path)].append(path)
+
+    lines = []
+    summarised = set()
+    for path in paths:
+        directory = posixpath.dirname(path)
+        files = siblings[directory]
+        if len(files) <= MAX_TREE_SIBLINGS:
+            lines.append(path)
+        elif path in files[:TREE_SIBLINGS_SHOWN]:
+            lines.append(path)
+        elif directory not in summarised:
+            summarised.add(directory)
+            hidden = files[TREE_SIBLINGS_SHOWN:]
+            extensions = Counter(posixpath.splitext(hidden_path)[1] or "no extension" for hidden_path in hidden)
+            summary = ", ".join(f"{count} {extension}" for extension, count in extensions.most_common(5))
+            lines.append(f"{directory or '.'}/... ({len(hidden)} more files: {summary})")
+    return "\n".join(lines)
+
+
+class ContentMinimizer:
+    """
+    Shrinks what a narration prompt is built from: the file tree, the README and the
+    picked files. Blocks of text that were already seen (a docs page repeating the
+    README, the same config in two packages) are only kept the first time. One
+    instance per prompt, since that memory of seen blocks is per prompt.
+
+    Tracks characters before and after per part, report() logs them with the
+    estimated tokens saved.
+    """
+
+    def __init__(self):
+        self._seen: set[str] = set()
+        self.chars_before: Counter[str] = Counter()
+        self.chars_after: Counter[str] = Counter()
+        self.dropped_files: list[str] = []
+
+    def _count(self, part: str, before: str, after: str) -> str:
+        self.chars_before[part] += len(before)
+        self.chars_after[part] += len(after)
+        return after
+
+    def _dedupe(self, text: str, separator: str) -> str:
+        kept = []
+        for block in re.split(r"\n\s*\n", text):
+            if not block.strip():
+                continue
+            if len(block) >= MIN_DUPLICATE_BLOCK_CHARS:
+                key = hashlib.sha1(" ".join(block.split()).lower().encode("utf-8")).hexdigest()
+                if key in self._seen:
+                    continue
+                self._seen.add(key)
+            kept.append(block if separator == "\n\n" else "\n".join(line for line in block.splitlines() if line.strip()))
+        return separator.join(kept)
+
+    def tree(self, file_tree: str) -> str:
+        if not MINIMIZE_CONTENT:
+            return file_tree
+        return self._count("tree", file_tree, compact_tree(file_tree))
+
+    def readme(self, readme: str) -> str:
+        if not MINIMIZE_CONTENT:
+            return readme
+        return self._count("readme", readme, self._dedupe(cap_lines(HTML_COMMENT.sub("", readme)), "\n\n"))
+
+    def file(self, path: str, content: str) -> str:
+        """The minimized content of one file, empty if nothing new is left in it."""
+        if not MINIMIZE_CONTENT:
+            return content
+        prose = posixpath.splitext(path)[1].lower() in PROSE_EXTENSIONS
+        # Code keeps no blank lines at all, prose keeps them between paragraphs
+        minimized = self._dedupe(strip_comments(path, cap_lines(content)), "\n\n" if prose else "\n")
+        if not minimized.strip():
+            self.dropped_files.append(path)
+        return self._count("files", content, minimized)
+
+    def tokens_saved(self) -> int:
+        return estimate_tokens(sum(self.chars_before.values()) - sum(self.chars_after.values()))
+
+    def report(self):
+        if not self.chars_before:
+            return
+        for part in self.chars_before:
+            CONTENT_CHARS.labels(part, "before").inc(self.chars_before[part])
+            CONTENT_CHARS.labels(part, "after").inc(self.chars_after[part])
+        parts = ", ".join(f"{part} {self.chars_before[part]} -> {self.chars_after[part]}" for part in self.chars_before)
+        dropped = f", dropped as duplicates: {', '.join(self.dropped_files)}" if self.dropped_files else ""
+        logger.info("Content minimized (%s chars), about %d tokens saved%s", parts, self.tokens_saved(), dropped)
@@ -0,0 +1,80 @@
+import posixpath
+
+from app.core.model_routing import tier_for
+from app.prompts import PODCAST_SSML_PROMPT, PODCAST_SSML_PROMPT_AFTER_BREAK, PODCAST_SSML_PROMPT_BEFORE_BREAK
+from app.services.content_minimizer import compact_tree, MINIMIZE_CONTENT
+from app.services.file_selection import (
+    CHARS_PER_TOKEN, FILE_FRAMING_CHARS, MAX_FILE_BYTES, content_token_budget, is_binary_path, is_generated_path,
+)
+from app.services.github_service import should_include_file
+
+# Minutes of audio per podcast length and the spoken words per minute postprocess assumes
+NARRATION_MINUTES = {"short": 3, "long": 10}
+WORDS_PER_MINUTE = 135
+# SSML tokens per spoken word, voice and break markup included
+SSML_TOKENS_PER_WORD = 2
+# The file selection call: its fixed system prompt, and a list of up to 10 paths back
+FILE_SELECTION_PROMPT_TOKENS = 80
+FILE_SELECTION_OUTPUT_TOKENS = 200
+PICKED_FILES = 10
+
+
+def readme_size(tree: dict) -> int:
+    """Bytes of the README at the root of the tree, as GitHub's /readme would pick it (0 without one)."""
+    readmes = [item for item in tree["tree"]
+               if item["type"] == "blob" and "/" not in item["path"] and item["path"].lower().startswith("readme")]
+    if not readmes:
+        return 0
+    readmes.sort(key=lambda item: (posixpath.splitext(item["path"])[1].lower() != ".md", item["path"]))
+    return readmes[0].get("size", 0)
+
+
+def likely_file_chars(tree: dict, paths: set[str]) -> int:
+    """
+    Characters of the files the model is likely to pick. Which ones it picks is not
+    known without asking it, so assume the largest files that could be picked:
+    an upper bound that the real selection rarely reaches.
+    """
+    sizes = sorted((item.get("size", 0) for item in tree["tree"]
+                    if item["type"] == "blob" and item["path"] in paths
+                    and not is_binary_path(item["path"]) and not is_generated_path(item["path"])
+                    and item.get("size", 0) <= MAX_FILE_BYTES), reverse=True)
+    return sum(size + FILE_FRAMING_CHARS for size in sizes[:PICKED_FILES])
+
+
+def estimate_generation(tree: dict, audio_length: str, max_content_chars: int) -> dict:
+    """
+    Estimates the input and output tokens and the model cost of generating a podcast
+    for the repository, from its tree alone: file and README sizes stand in for their
+    contents, so nothing else is downloaded and no model is called.
+
+    Returns:
+        dict: {"input_tokens": int, "output_tokens": int, "cost_usd": float}
+    """
+    paths = [item["path"] for item in tree["tree"] if should_include_file(item["path"])]
+    file_tree = "\n".join(paths)
+    prompt_tree_chars = len(compact_tree(file_tree)) if MINIMIZE_CONTENT else len(file_tree)
+    readme_chars = readme_size(tree)
+    file_chars = likely_file_chars(tree, set(paths))
+    output_tokens = NARRATION_MINUTES.get(audio_length, NARRATION_MINUTES["long"]) * WORDS_PER_MINUTE * SSML_TOKENS_PER_WORD
+
+    # (call site, input tokens, output tokens) of every model call the generation makes
+    calls = [("file_selection", FILE_SELECTION_PROMPT_TOKENS + len(file_tree) // CHARS_PER_TOKEN,
+              FILE_SELECTION_OUTPUT_TOKENS)]
+    overview_chars = prompt_tree_chars + readme_chars
+    if audio_length == "short":
+        files_tokens = min(file_chars // CHARS_PER_TOKEN, content_token_budget(max_content_chars, overview_chars))
+        calls.append(("short_podcast", (len(PODCAST_SSML_PROMPT) + min(overview_chars, max_content_chars))
+                      // CHARS_PER_TOKEN + files_tokens, output_tokens))
+    else:
+        files_tokens = min(file_chars // CHARS_PER_TOKEN, content_token_budget(max_content_chars))
+        calls.append(("long_segment", (len(PODCAST_SSML_PROMPT_BEFORE_BREAK) + min(overview_chars, max_content_chars))
+                      // CHARS_PER_TOKEN, output_tokens // 2))
+        calls.append(("long_segment", len(PODCAST_SSML_PROMPT_AFTER_BREAK) // CHARS_PER_TOKEN + files_tokens,
+                      output_tokens - output_tokens // 2))
+
+    return {
+        "input_tokens": sum(input_tokens for _, input_tokens, _ in calls),
+        "output_tokens": sum(output for _, _, output in calls),
+        "cost_usd": sum(tier_for(site, input_tokens).cost(input_tokens, output) for site, input_tokens, output in calls),
+    }
@@ -0,0 +1,66 @@
+import re
+
+# Hunk headers of the edit script the model returns in diff mode, see SYSTEM_MODIFY_DIFF_PROMPT
+HUNK_HEADER = re.compile(r"^@@ (replace|delete) (\d+)(?:-(\d+))?$|^@@ insert after (\d+)$")
+
+
+def number_lines(diagram: str) -> str:
+    """Prefixes every line with its 1-based number, so the model can address lines by number."""
+    return "\n".join(f"{number}| {line}" for number, line in enumerate(diagram.splitlines(), start=1))
+
+
+def parse_patch(patch: str) -> list[tuple[str, int, int, list[str]]]:
+    """
+    Parses an edit script into hunks of (operation, first line, last line, new lines).
+    Inserts are expressed as ("insert", n, n, lines) meaning after line n.
+
+    Raises:
+        ValueError: If the script is not well formed
+    """
+    hunks = []
+    for line in patch.strip("\n").splitlines():
+        if line.startswith("@@"):
+            match = HUNK_HEADER.match(line.strip())
+            if not match:
+                raise ValueError(f"Invalid hunk header: {line}")
+            operation, first, last, after = match.groups()
+            if after is not None:
+                hunks.append(("insert", int(after), int(after), []))
+            else:
+                hunks.append((operation, int(first), int(last or first), []))
+        elif hunks and hunks[-1][0] != "delete":
+            hunks[-1][3].append(line)
+        elif line.strip():
+            raise ValueError(f"Line outside of a hunk: {line}")
+    return hunks
+
+
+def apply_patch(diagram: str, patch: str) -> str:
+    """
+    Applies an edit script whose line numbers refer to the original diagram.
+
+    Raises:
+        ValueError: If the script is malformed, out of range or has overlapping hunks
+    """
+    lines = diagram.splitlines()
+    hunks = parse_patch(patch)
+    inserts = [first for operation, first, _, _ in hunks if operation == "insert"]
+    if len(inserts) != len(set(inserts)):
+        raise ValueError("More than one insert after the same line")
+
+    # Apply bottom-up so earlier line numbers stay valid
+    previous_first = len(lines) + 1
+    for operation, first, last, new_lines in sorted(hunks, key=lambda hunk: (hunk[1], hunk[0] != "insert"),
+                                                     reverse=True):
+        if operation == "insert":
+            if not 0 <= first <= len(lines) or first >= previous_first:
+                raise ValueError(f"Insert after line {first} is out of range or overlaps another hunk")
+            lines[first:first] = new_lines
+            previous_first = first + 1
+            continue
+        if not 1 <= first <= last <= len(lines) or last >= previous_first:
+            raise ValueError(f"Lines {first}-{last} are out of range or overlap another hunk")
+        lines[first - 1:last] = new_lines if operation == "replace" else []
+        previous_first = first
+
+    return "\n".join(lines)
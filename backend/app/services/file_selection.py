@@ -0,0 +1,92 @@
+import logging
+import os
+import posixpath
+
+from app.services.path_index import PathIndex
+
+logger = logging.getLogger(__name__)
+
+# Same rough ratio the cost limiter uses (see core/limiter.py)
+CHARS_PER_TOKEN = 4
+# Share of the budget kept free for the prompt, the framing of each file and estimation error
+BUDGET_HEADROOM = 0.15
+# Larger files are never downloaded, a single one would crowd out everything else
+MAX_FILE_BYTES = int(os.getenv("MAX_PICKED_FILE_BYTES", "100000"))
+# Characters added around each file in the prompt ("FPATH: ... CONTENT:")
+FILE_FRAMING_CHARS = 40
+
+BINARY_EXTENSIONS = {
+    ".png", ".jpg", ".jpeg", ".gif", ".bmp", ".ico", ".webp", ".svg", ".tif", ".tiff", ".psd",
+    ".mp3", ".mp4", ".wav", ".ogg", ".webm", ".mov", ".avi", ".flac",
+    ".zip", ".gz", ".tgz", ".bz2", ".xz", ".7z", ".rar", ".tar", ".jar", ".war", ".whl", ".egg",
+    ".pdf", ".doc", ".docx", ".xls", ".xlsx", ".ppt", ".pptx",
+    ".ttf", ".otf", ".woff", ".woff2", ".eot",
+    ".exe", ".dll", ".so", ".dylib", ".a", ".o", ".obj", ".bin", ".class", ".pyc", ".pyo", ".wasm",
+    ".db", ".sqlite", ".sqlite3", ".pkl", ".pickle", ".npy", ".npz", ".h5", ".onnx", ".pt", ".parquet",
+}
+GENERATED_NAMES = {
+    "package-lock.json", "yarn.lock", "pnpm-lock.yaml", "poetry.lock", "pipfile.lock", "cargo.lock",
+    "composer.lock", "gemfile.lock", "go.sum", "bun.lockb", "uv.lock",
+}
+GENERATED_MARKERS = (".min.", ".map", "_pb2.py", "_pb2_grpc.py", ".pb.go", ".generated.", ".snap")
+GENERATED_DIRECTORIES = {"dist", "build", "node_modules", "vendor", "__snapshots__", "generated", ".next"}
+
+
+def is_binary_path(path: str) -> bool:
+    return posixpath.splitext(path)[1].lower() in BINARY_EXTENSIONS
+
+
+def is_generated_path(path: str) -> bool:
+    lowered = path.lower()
+    name = posixpath.basename(lowered)
+    if name in GENERATED_NAMES or any(marker in name for marker in GENERATED_MARKERS):
+        return True
+    return any(part in GENERATED_DIRECTORIES for part in lowered.split("/")[:-1])
+
+
+def content_token_budget(max_chars: int, used_chars: int = 0) -> int:
+    """Tokens left for file contents in a prompt capped at max_chars, after used_chars and headroom."""
+    return max(0, int((max_chars - used_chars) * (1 - BUDGET_HEADROOM)) // CHARS_PER_TOKEN)
+
+
+def pack_files(ranked_paths: list[str], index: PathIndex, budget_tokens: int) -> list[str]:
+    """
+    Chooses which of the ranked files to download so that their contents fit in
+    budget_tokens. Binaries, generated files and files over MAX_FILE_BYTES are
+    skipped outright. The rest are packed 0/1-knapsack style: the model's ranking
+    gives each file its value (first pick worth most), its blob size the weight.
+    The chosen files are returned in ranking order.
+    """
+    candidates = []
+    for path in ranked_paths:
+        size = index.size(path)
+        if is_binary_path(path) or is_generated_path(path):
+            logger.info("Skipping picked file %s: binary or generated", path)
+        elif size is not None and size > MAX_FILE_BYTES:
+            logger.info("Skipping picked file %s: %d bytes is over the %d byte limit", path, size, MAX_FILE_BYTES)
+        else:
+            # Unknown sizes (truncated trees) are assumed to be as large as allowed
+            nbytes = MAX_FILE_BYTES if size is None else size
+            candidates.append((path, (nbytes + len(path) + FILE_FRAMING_CHARS) // CHARS_PER_TOKEN + 1))
+
+    if sum(tokens for _, tokens in candidates) <= budget_tokens:
+        return [path for path, _ in candidates]
+
+    # Weights in units of 64 tokens keep the table small; rounding up never overfills
+    unit = 64
+    capacity = budget_tokens // unit
+    weights = [-(-tokens // unit) for _, tokens in candidates]
+    values = [len(candidates) - rank for rank in range(len(candidates))]
+
+    # best[c] = (value, chosen indexes) using at most c units
+    best = [(0, ())] * (capacity + 1)
+    for i, weight in enumerate(weights):
+        for c in range(capacity, weight - 1, -1):
+            value = best[c - weight][0] + values[i]
+            if value > best[c][0]:
+                best[c] = (value, best[c - weight][1] + (i,))
+    chosen = set(best[capacity][1])
+    for i, (path, tokens) in enumerate(candidates):
+        if i not in chosen:
+            logger.info("Skipping picked file %s: about %d tokens does not fit the remaining budget", path, tokens)
+    return [path for i, (path, _) in enumerate(candidates) if i in chosen]
@@ -1,9 +1,12 @@
+import logging
 import os
 import time
-from dotenv import load_dotenv
 import google.generativeai as genai
+from app.core.log import log_payload
+from app.core.resilience import upstream, call_timeout
+
+logger = logging.getLogger(__name__)
 
-load_dotenv()
 
 class GeminiService:
     def __init__(self):
@@ -15,8 +18,9 @@ class GeminiService:
         Uploads the given file to Gemini.
         See https://ai.google.dev/gemini-api/docs/prompting_with_media
         """
-        file = genai.upload_file(path, mime_type=mime_type)
-        print(f"Uploaded file '{file.display_name}' as: {file.uri}")
+        with upstream("gemini", "upload_file"):
+            file = genai.upload_file(path, mime_type=mime_type)
+        logger.info("Uploaded file '%s' as: %s", file.display_name, file.uri)
         return file
 
     def wait_for_files_active(self, files):
@@ -28,17 +32,15 @@ class GeminiService:
         This implementation uses a simple blocking polling loop. Production
         code should probably employ a more sophisticated approach.
         """
-        print("Waiting for file processing...")
+        logger.info("Waiting for file processing...")
         for name in (file.name for file in files):
             file = genai.get_file(name)
             while file.state.name == "PROCESSING":
-                print(".", end="", flush=True)
                 time.sleep(10)
                 file = genai.get_file(name)
             if file.state.name != "ACTIVE":
                 raise Exception(f"File {file.name} failed to process")
-        print("...all files ready")
-        print()
+        logger.info("...all files ready")
 
     def call_gemini_flash_for_ssml(self, file_paths, ssml_prompt):
         """
@@ -83,9 +85,11 @@ class GeminiService:
                 },
             ]
         )
-        response = chat_session.send_message("JUST GIVE SSML. Dont put formatting of backticks etc.")
+        with upstream("gemini", "generate"):
+            response = chat_session.send_message("JUST GIVE SSML. Dont put formatting of backticks etc.",
+                                                 request_options={"timeout": call_timeout("gemini")})
 
-        print(response.text)
+        log_payload(logger, "Gemini response", response.text)
         return response.text  # Retrieve the response text, adjust as needed
 
 # Example usage
@@ -2,11 +2,32 @@ import requests
 import jwt
 import time
 from datetime import datetime, timedelta
-from dotenv import load_dotenv
 import os
+import logging
 from base64 import b64decode
+from app.core.resilience import upstream, call_timeout
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+def should_include_file(path):
+    # Patterns to exclude
+    excluded_patterns = [
+        # Dependencies
+        'node_modules/', 'vendor/', 'venv/',
+        # Compiled files
+        '.min.', '.pyc', '.pyo', '.pyd', '.so', '.dll', '.class',
+        # Asset files
+        '.jpg', '.jpeg', '.png', '.gif', '.ico', '.svg', '.ttf', '.woff', '.webp',
+        # Cache and temporary files
+        '__pycache__/', '.cache/', '.tmp/',
+        # Lock files and logs
+        'yarn.lock', 'poetry.lock', '*.log',
+        # Configuration files
+        '.vscode/', '.idea/'
+    ]
+
+    return not any(pattern in path.lower() for pattern in excluded_patterns)
 
 
 class GitHubService:
@@ -21,11 +42,14 @@ class GitHubService:
 
         # If no credentials are provided, warn about rate limits
         if not all([self.client_id, self.private_key, self.installation_id]) and not self.github_token:
-            print("\033[93mWarning: No GitHub credentials provided. Using unauthenticated requests with rate limit of 60 requests/hour.\033[0m")
+            logger.warning("No GitHub credentials provided. Using unauthenticated requests with rate limit of 60 requests/hour.")
 
         self.access_token = None
         self.token_expires_at = None
 
+        # Overridable for GitHub Enterprise or local stand-ins (see benchmarks/)
+        self.api_url = os.getenv("GITHUB_API_URL", "https://api.github.com").rstrip("/")
+
     # autopep8: off
     def _generate_jwt(self):
         now = int(time.time())
@@ -44,12 +68,12 @@ class GitHubService:
 
         jwt_token = self._generate_jwt()
         response = requests.post(
-            f"https://api.github.com/app/installations/{
-                self.installation_id}/access_tokens",
+            f"{self.api_url}/app/installations/{self.installation_id}/access_tokens",
             headers={
                 "Authorization": f"Bearer {jwt_token}",
                 "Accept": "application/vnd.github+json"
-            }
+            },
+            timeout=call_timeout("github"),
         )
         data = response.json()
         self.access_token = data["token"]
@@ -78,78 +102,87 @@ class GitHubService:
             "X-GitHub-Api-Version": "2022-11-28"
         }
 
+    def _get(self, url, operation, headers=None):
+        """GET against GitHub, recording latency, status code and bytes received."""
+        with upstream("github", operation) as call:
+            response = requests.get(url, headers=headers if headers is not None else self._get_headers(),
+                                    timeout=call_timeout("github"))
+            call.status = response.status_code
+            call.bytes_in = len(response.content)
+        return response
+
     def get_default_branch(self, username, repo):
         """Get the default branch of the repository."""
-        api_url = f"https://api.github.com/repos/{username}/{repo}"
-        response = requests.get(api_url, headers=self._get_headers())
+        api_url = f"{self.api_url}/repos/{username}/{repo}"
+        response = self._get(api_url, "repo")
 
         if response.status_code == 200:
             return response.json().get('default_branch')
         return None
 
-    def get_github_file_paths_as_list(self, username, repo):
+    def get_repository_tree(self, username, repo, branch=None):
         """
-        Fetches the file tree of an open-source GitHub repository,
-        excluding static files and generated code.
+        Fetches the recursive git tree of a repository.
 
         Args:
             username (str): The GitHub username or organization name
             repo (str): The repository name
+            branch (str | None): Branch to read, the default branch if not given
 
         Returns:
-            str: A filtered and formatted string of file paths in the repository, one per line.
+            dict: {"branch": str, "sha": tree sha, "tree": list of git tree entries (path, type, sha, size),
+                   "truncated": bool, True if GitHub cut the listing short}
         """
-        def should_include_file(path):
-            # Patterns to exclude
-            excluded_patterns = [
-                # Dependencies
-                'node_modules/', 'vendor/', 'venv/',
-                # Compiled files
-                '.min.', '.pyc', '.pyo', '.pyd', '.so', '.dll', '.class',
-                # Asset files
-                '.jpg', '.jpeg', '.png', '.gif', '.ico', '.svg', '.ttf', '.woff', '.webp',
-                # Cache and temporary files
-                '__pycache__/', '.cache/', '.tmp/',
-                # Lock files and logs
-                'yarn.lock', 'poetry.lock', '*.log',
-                # Configuration files
-                '.vscode/', '.idea/'
-            ]
-
-            return not any(pattern in path.lower() for pattern in excluded_patterns)
-
-        # Try to get the default branch first
-        branch = self.get_default_branch(username, repo)
-        if branch:
-            api_url = f"https://api.github.com/repos/{
-                username}/{repo}/git/trees/{branch}?recursive=1"
-            response = requests.get(api_url, headers=self._get_headers())
-
-            if response.status_code == 200:
-                data = response.json()
-                if "tree" in data:
-                    # Filter the paths and join them with newlines
-                    paths = [item['path'] for item in data['tree']
-                             if should_include_file(item['path'])]
-                    return "\n".join(paths)
+        # Try the given or default branch first, then common branch names
+        branch = branch or self.get_default_branch(username, repo)
+        candidates = [branch] if branch else []
+        candidates += [b for b in ['main', 'master'] if b != branch]
 
-        # If default branch didn't work or wasn't found, try common branch names
-        for branch in ['main', 'master']:
-            api_url = f"https://api.github.com/repos/{
-                username}/{repo}/git/trees/{branch}?recursive=1"
-            response = requests.get(api_url, headers=self._get_headers())
+        for branch in candidates:
+            api_url = f"{self.api_url}/repos/{username}/{repo}/git/trees/{branch}?recursive=1"
+            response = self._get(api_url, "tree")
 
             if response.status_code == 200:
                 data = response.json()
                 if "tree" in data:
-                    # Filter the paths and join them with newlines
-                    paths = [item['path'] for item in data['tree']
-                             if should_include_file(item['path'])]
-                    return "\n".join(paths)
+                    return {"branch": branch, "sha": data.get("sha"), "tree": data["tree"],
+                            "truncated": data.get("truncated", False)}
 
         raise ValueError(
             "Could not fetch repository file tree. Repository might not exist, be empty or private.")
 
+    def get_head_tree(self, username, repo):
+        """
+        Fetches the recursive git tree of the default branch in a single request.
+        The branch name is not part of the answer, so "branch" is None.
+        """
+        response = self._get(f"{self.api_url}/repos/{username}/{repo}/git/trees/HEAD?recursive=1", "tree")
+        if response.status_code == 200:
+            data = response.json()
+            if "tree" in data:
+                return {"branch": None, "sha": data.get("sha"), "tree": data["tree"],
+                        "truncated": data.get("truncated", False)}
+        raise ValueError(
+            "Could not fetch repository file tree. Repository might not exist, be empty or private.")
+
+    def get_github_file_paths_as_list(self, username, repo, tree=None):
+        """
+        Fetches the file tree of an open-source GitHub repository,
+        excluding static files and generated code.
+
+        Args:
+            username (str): The GitHub username or organization name
+            repo (str): The repository name
+            tree (dict | None): A result of get_repository_tree to reuse instead of fetching
+
+        Returns:
+            str: A filtered and formatted string of file paths in the repository, one per line.
+        """
+        tree = tree or self.get_repository_tree(username, repo)
+        # Filter the paths and join them with newlines
+        paths = [item['path'] for item in tree['tree'] if should_include_file(item['path'])]
+        return "\n".join(paths)
+
     def get_github_readme(self, username, repo):
         """
         Fetches the README contents of an open-source GitHub repository.
@@ -161,8 +194,8 @@ class GitHubService:
         Returns:
             str: The contents of the README file.
         """
-        api_url = f"https://api.github.com/repos/{username}/{repo}/readme"
-        response = requests.get(api_url, headers=self._get_headers())
+        api_url = f"{self.api_url}/repos/{username}/{repo}/readme"
+        response = self._get(api_url, "readme")
 
         if response.status_code == 404:
             raise ValueError("Repository not found.")
@@ -171,7 +204,7 @@ class GitHubService:
                             response.status_code}, {response.json()}")
 
         data = response.json()
-        readme_content = requests.get(data['download_url']).text
+        readme_content = self._get(data['download_url'], "readme_download", headers={}).text
         return readme_content
 
     def get_github_file_content(self, username, repo, filepath):
@@ -186,8 +219,8 @@ class GitHubService:
         Returns:
             str: The contents of the specified file.
         """
-        api_url = f"https://api.github.com/repos/{username}/{repo}/contents/{filepath}"
-        response = requests.get(api_url, headers=self._get_headers())
+        api_url = f"{self.api_url}/repos/{username}/{repo}/contents/{filepath}"
+        response = self._get(api_url, "contents")
 
         if response.status_code == 404:
             raise ValueError("File not found in the repository.")
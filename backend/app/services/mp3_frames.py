@@ -0,0 +1,268 @@
+import os
+import struct
+from functools import lru_cache
+
+# Frame-level MP3 (MPEG audio Layer III) assembly: joins independently synthesized
+# segments without decoding them, with silence frames for the pauses in between,
+# behind a freshly written Xing/Info header so players get duration and seeking right.
+
+# Pause between two stitched segments
+SEGMENT_PAUSE_SECONDS = float(os.getenv("SEGMENT_PAUSE_SECONDS", "0.6"))
+
+MPEG1, MPEG2, MPEG25 = 3, 2, 0
+# kbps by bitrate index, Layer III
+BITRATES = {
+    MPEG1: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),
+    MPEG2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),
+}
+BITRATES[MPEG25] = BITRATES[MPEG2]
+SAMPLE_RATES = {MPEG1: (44100, 48000, 32000), MPEG2: (22050, 24000, 16000), MPEG25: (11025, 12000, 8000)}
+MONO = 3
+
+XING_FRAMES, XING_BYTES, XING_TOC = 0x1, 0x2, 0x4
+LAME_TAG_BYTES = 36
+
+
+class FrameHeader:
+    """The fields of a Layer III frame header that matter for walking and writing frames."""
+
+    def __init__(self, version: int, bitrate_index: int, sample_rate_index: int, padding: int, channel_mode: int):
+        self.version = version
+        self.bitrate_index = bitrate_index
+        self.sample_rate_index = sample_rate_index
+        self.padding = padding
+        self.channel_mode = channel_mode
+
+    @property
+    def bitrate(self) -> int:
+        return BITRATES[self.version][self.bitrate_index]
+
+    @property
+    def sample_rate(self) -> int:
+        return SAMPLE_RATES[self.version][self.sample_rate_index]
+
+    @property
+    def samples(self) -> int:
+        return 1152 if self.version == MPEG1 else 576
+
+    @property
+    def length(self) -> int:
+        return (144000 if self.version == MPEG1 else 72000) * self.bitrate // self.sample_rate + self.padding
+
+    @property
+    def side_info_bytes(self) -> int:
+        if self.version == MPEG1:
+            return 17 if self.channel_mode == MONO else 32
+        return 9 if self.channel_mode == MONO else 17
+
+    def stream_key(self) -> tuple[int, int, int]:
+        """Frames can only be joined when these match."""
+        return self.version, self.sample_rate_index, self.channel_mode == MONO
+
+    def to_bytes(self, bitrate_index: int | None = None) -> bytes:
+        # Sync, version, Layer III, no CRC; not private, joint/mode extension off, not copyrighted, original
+        bitrate_index = self.bitrate_index if bitrate_index is None else bitrate_index
+        return bytes([
+            0xFF,
+            0xE0 | (self.version << 3) | (0b01 << 1) | 1,
+            (bitrate_index << 4) | (self.sample_rate_index << 2),
+            (self.channel_mode << 6) | 0x04,
+        ])
+
+
+def parse_header(data, offset: int) -> FrameHeader | None:
+    if offset + 4 > len(data):
+        return None
+    b0, b1, b2, b3 = data[offset], data[offset + 1], data[offset + 2], data[offset + 3]
+    if b0 != 0xFF or (b1 & 0xE0) != 0xE0:
+        return None
+    version = (b1 >> 3) & 0b11
+    layer = (b1 >> 1) & 0b11
+    bitrate_index = b2 >> 4
+    sample_rate_index = (b2 >> 2) & 0b11
+    # Reserved version, not Layer III, free format or invalid bitrate, reserved sample rate
+    if version == 1 or layer != 0b01 or bitrate_index in (0, 15) or sample_rate_index == 3:
+        return None
+    return FrameHeader(version, bitrate_index, sample_rate_index, (b2 >> 1) & 1, b3 >> 6)
+
+
+def _id3v2_length(data) -> int:
+    if len(data) < 10 or bytes(data[:3]) != b"ID3":
+        return 0
+    size = 0
+    for byte in data[6:10]:
+        size = (size << 7) | (byte & 0x7F)
+    footer = 10 if data[5] & 0x10 else 0
+    return 10 + size + footer
+
+
+class Mp3Audio:
+    """
+    The audio frames of one MP3 file, as (offset, length) into its bytes: tags, the
+    Xing/Info/VBRI header frame and anything between frames are left out. The LAME
+    tag's encoder delay and padding are kept, so stitching can carry them over.
+    """
+
+    def __init__(self, data: bytes):
+        self.data = memoryview(data)
+        self.frames: list[tuple[int, int]] = []
+        self.first: FrameHeader | None = None
+        self.bitrates: set[int] = set()
+        self.encoder_delay: int | None = None
+        self.encoder_padding: int | None = None
+        self.lame_tag: bytes | None = None
+
+        end = len(data)
+        if end >= 128 and bytes(self.data[end - 128:end - 125]) == b"TAG":
+            end -= 128
+        offset = _id3v2_length(self.data)
+        while offset < end:
+            header = parse_header(self.data, offset)
+            if header is None or offset + header.length > end:
+                # Junk between frames or a truncated last frame
+                offset += 1
+                continue
+            if self.first is None and self._read_info_frame(offset, header):
+                offset += header.length
+                continue
+            if self.first is None:
+                self.first = header
+            elif header.stream_key() != self.first.stream_key():
+                raise ValueError("MP3 changes sample rate or channels mid-stream")
+            self.frames.append((offset, header.length))
+            self.bitrates.add(header.bitrate_index)
+            offset += header.length
+
+    def _read_info_frame(self, offset: int, header: FrameHeader) -> bool:
+        """Whether the frame at offset is a Xing/Info or VBRI header rather than audio."""
+        tag_offset = offset + 4 + header.side_info_bytes
+        tag = bytes(self.data[tag_offset:tag_offset + 4])
+        if bytes(self.data[offset + 36:offset + 40]) == b"VBRI":
+            return True
+        if tag not in (b"Xing", b"Info"):
+            return False
+        flags = struct.unpack(">I", self.data[tag_offset + 4:tag_offset + 8])[0]
+        lame_offset = tag_offset + 8 + 4 * bool(flags & XING_FRAMES) + 4 * bool(flags & XING_BYTES) \
+            + 100 * bool(flags & XING_TOC) + 4 * bool(flags & 0x8)
+        if lame_offset + LAME_TAG_BYTES <= offset + header.length:
+            lame = bytes(self.data[lame_offset:lame_offset + LAME_TAG_BYTES])
+            if lame[:4] in (b"LAME", b"Lavf", b"Lavc"):
+                self.lame_tag = lame
+                delay_padding = int.from_bytes(lame[21:24], "big")
+                self.encoder_delay, self.encoder_padding = delay_padding >> 12, delay_padding & 0xFFF
+        return True
+
+    @property
+    def audio_bytes(self) -> int:
+        return sum(length for _, length in self.frames)
+
+
+@lru_cache(maxsize=16)
+def silence_frame(version: int, bitrate_index: int, sample_rate_index: int, channel_mode: int) -> bytes:
+    """
+    One frame of digital silence in the given stream format: all-zero side info means
+    no main data and a global gain of zero, which every decoder renders as silence.
+    """
+    header = FrameHeader(version, bitrate_index, sample_rate_index, 0, channel_mode)
+    return header.to_bytes() + bytes(header.length - 4)
+
+
+def silence(like: FrameHeader, seconds: float) -> tuple[bytes, int]:
+    """Silence frames matching like's stream for about seconds, and how many frames that is."""
+    count = round(seconds * like.sample_rate / like.samples)
+    return silence_frame(like.version, like.bitrate_index, like.sample_rate_index, like.channel_mode) * count, count
+
+
+def _crc16(data: bytes) -> int:
+    """CRC-16/ARC (polynomial 0x8005, reflected), as used by the LAME tag."""
+    crc = 0
+    for byte in data:
+        crc ^= byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0xA001 if crc & 1 else crc >> 1
+    return crc
+
+
+def info_frame(like: FrameHeader, frame_offsets: list[int], audio_bytes: int, cbr: bool,
+               lame_tag: bytes | None, delay: int | None, padding: int | None) -> bytes:
+    """
+    A Xing (VBR) or Info (CBR) header frame for audio_bytes of audio in len(frame_offsets)
+    frames, with a seek table. Carries a LAME tag when the source had one, with the
+    encoder delay of the first segment and the padding of the last.
+    """
+    tag_offset = 4 + like.side_info_bytes
+    needed = tag_offset + 8 + 4 + 4 + 100 + (LAME_TAG_BYTES if lame_tag else 0)
+    # The header frame is silent itself, so any bitrate that makes it large enough will do
+    bitrate_index = next(index for index in range(1, 15)
+                         if FrameHeader(like.version, index, like.sample_rate_index, 0, like.channel_mode).length >= needed)
+    header = FrameHeader(like.version, bitrate_index, like.sample_rate_index, 0, like.channel_mode)
+    total_bytes = header.length + audio_bytes
+
+    frames = len(frame_offsets)
+    toc = bytes(min(255, (header.length + frame_offsets[min(frames - 1, i * frames // 100)]) * 256 // total_bytes)
+                for i in range(100)) if frames else bytes(100)
+
+    frame = bytearray(header.length)
+    frame[:4] = header.to_bytes()
+    xing = (b"Info" if cbr else b"Xing") + struct.pack(">III", XING_FRAMES | XING_BYTES | XING_TOC, frames, total_bytes) + toc
+    frame[tag_offset:tag_offset + len(xing)] = xing
+    if lame_tag:
+        lame = bytearray(lame_tag)
+        lame[21:24] = (((delay or 0) & 0xFFF) << 12 | ((padding or 0) & 0xFFF)).to_bytes(3, "big")
+        lame[28:32] = struct.pack(">I", total_bytes)
+        # The music CRC would cost a pass over all the audio in Python; zero marks it as not computed
+        lame[32:34] = b"\0\0"
+        lame_offset = tag_offset + len(xing)
+        frame[lame_offset:lame_offset + LAME_TAG_BYTES - 2] = lame[:-2]
+        frame[lame_offset + LAME_TAG_BYTES - 2:lame_offset + LAME_TAG_BYTES] = struct.pack(
+            ">H", _crc16(bytes(frame[:lame_offset + LAME_TAG_BYTES - 2])))
+    return bytes(frame)
+
+
+def stitch(segments: list[bytes], pause_seconds: float = SEGMENT_PAUSE_SECONDS) -> bytes:
+    """
+    Joins MP3 segments of the same stream format frame by frame, with pause_seconds of
+    silence frames between them, behind a new Xing/Info header. Nothing is decoded or
+    re-encoded, so the cost is one pass over the bytes.
+    """
+    if len(segments) == 1:
+        return segments[0]
+    parsed = [Mp3Audio(segment) for segment in segments]
+    parsed = [audio for audio in parsed if audio.frames]
+    if not parsed:
+        return b""
+    first = parsed[0].first
+    if any(audio.first.stream_key() != first.stream_key() for audio in parsed):
+        raise ValueError("MP3 segments differ in sample rate or channels")
+
+    pause, pause_frames = silence(first, pause_seconds)
+    parts: list = []
+    frame_offsets: list[int] = []
+    position = 0
+    for i, audio in enumerate(parsed):
+        if i and pause_frames:
+            parts.append(pause)
+            frame_offsets.extend(position + n * len(pause) // pause_frames for n in range(pause_frames))
+            position += len(pause)
+        for offset, length in audio.frames:
+            frame_offsets.append(position)
+            position += length
+        # Runs of frames are contiguous in their segment, so one slice usually covers them all
+        start, run_end = audio.frames[0][0], audio.frames[0][0]
+        for offset, length in audio.frames:
+            if offset != run_end:
+                parts.append(audio.data[start:run_end])
+                start = offset
+            run_end = offset + length
+        parts.append(audio.data[start:run_end])
+
+    bitrates = set().union(*(audio.bitrates for audio in parsed)) | ({first.bitrate_index} if pause_frames else set())
+    header = info_frame(first, frame_offsets, position, len(bitrates) == 1,
+                        parsed[0].lame_tag, parsed[0].encoder_delay, parsed[-1].encoder_padding)
+    return b"".join([header, *parts])
+
+
+def duration(data: bytes) -> float:
+    """Seconds of audio in an MP3, from its frames alone."""
+    audio = Mp3Audio(data)
+    return len(audio.frames) * audio.first.samples / audio.first.sample_rate if audio.frames else 0.0
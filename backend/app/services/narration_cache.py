@@ -0,0 +1,126 @@
+import hashlib
+import json
+import os
+import shutil
+import time
+
+from app.core.files import atomic_write
+
+
+def fingerprint(*parts: str) -> str:
+    digest = hashlib.sha256()
+    for part in parts:
+        digest.update(part.encode("utf-8"))
+        digest.update(b"\0")
+    return digest.hexdigest()
+
+
+class NarrationSnapshot:
+    """
+    What was narrated for a repository the last time: the tree it was built from,
+    the files picked for the deep-dive segment and, per segment, the fingerprint
+    of its inputs together with the SSML produced for them.
+    """
+
+    def __init__(self, tree_sha: str, file_list: list[str], blob_shas: dict[str, str], segments: dict[str, dict],
+                 checked_at: float | None = None):
+        self.tree_sha = tree_sha
+        self.file_list = file_list
+        self.blob_shas = blob_shas
+        # {segment name: {"fingerprint": str, "ssml": str}}
+        self.segments = segments
+        # When tree_sha was last confirmed to still be the head of the default branch
+        self.checked_at = time.time() if checked_at is None else checked_at
+
+    def to_dict(self) -> dict:
+        return {
+            "tree_sha": self.tree_sha,
+            "file_list": self.file_list,
+            "blob_shas": self.blob_shas,
+            "segments": self.segments,
+            "checked_at": self.checked_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "NarrationSnapshot":
+        return cls(data["tree_sha"], data["file_list"], data["blob_shas"], data["segments"], data.get("checked_at", 0.0))
+
+
+class NarrationCache:
+    """
+    On-disk store of the last narrated snapshot per (repo, audio_length), plus the
+    synthesized audio of each segment, so unchanged segments can be reused when a
+    repository is regenerated. Shared by all workers through the filesystem.
+    Repositories not generated or loaded for ttl_seconds are pruned as a whole.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int, prune_every: int = 100):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._writes = 0
+
+    def _dir(self, username: str, repo: str, audio_length: str) -> str:
+        # Hashed so user supplied names never become path components
+        key = fingerprint(username.lower(), repo.lower(), audio_length)[:32]
+        return os.path.join(self.directory, key)
+
+    def _write(self, path: str, data: bytes):
+        atomic_write(path, data)
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def load(self, username: str, repo: str, audio_length: str) -> NarrationSnapshot | None:
+        path = os.path.join(self._dir(username, repo, audio_length), "manifest.json")
+        try:
+            with open(path) as f:
+                snapshot = NarrationSnapshot.from_dict(json.load(f))
+            # Still in use, keeps prune() away from it
+            os.utime(path)
+            return snapshot
+        except (FileNotFoundError, json.JSONDecodeError, KeyError):
+            return None
+
+    def save(self, username: str, repo: str, audio_length: str, snapshot: NarrationSnapshot):
+        directory = self._dir(username, repo, audio_length)
+        os.makedirs(directory, exist_ok=True)
+        self._write(os.path.join(directory, "manifest.json"), json.dumps(snapshot.to_dict()).encode("utf-8"))
+
+        # Drop audio of segment versions that are no longer current
+        current = {segment["fingerprint"][:32] for segment in snapshot.segments.values()}
+        for entry in os.scandir(directory):
+            if entry.name.endswith(".audio") and entry.name.split("-")[1] not in current:
+                os.remove(entry.path)
+
+    def _audio_path(self, username, repo, audio_length, segment, segment_fingerprint, output_format) -> str:
+        return os.path.join(self._dir(username, repo, audio_length),
+                            f"{segment}-{segment_fingerprint[:32]}-{output_format}.audio")
+
+    def load_audio(self, username, repo, audio_length, segment, segment_fingerprint, output_format) -> bytes | None:
+        try:
+            with open(self._audio_path(username, repo, audio_length, segment, segment_fingerprint, output_format), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def save_audio(self, username, repo, audio_length, segment, segment_fingerprint, output_format, audio: bytes):
+        os.makedirs(self._dir(username, repo, audio_length), exist_ok=True)
+        self._write(self._audio_path(username, repo, audio_length, segment, segment_fingerprint, output_format), audio)
+
+    def prune(self):
+        """Removes the repositories whose newest file is older than the TTL."""
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.directory) if os.path.isdir(self.directory) else []:
+            try:
+                if entry.is_dir() and max([entry.stat().st_mtime] + [
+                        child.stat().st_mtime for child in os.scandir(entry.path)]) < cutoff:
+                    shutil.rmtree(entry.path, ignore_errors=True)
+            except FileNotFoundError:
+                pass
+
+
+narration_cache = NarrationCache(
+    os.getenv("NARRATION_CACHE_DIR", "/tmp/gitpodcast_narrations"),
+    ttl_seconds=int(os.getenv("NARRATION_CACHE_TTL_HOURS", "168")) * 3600,
+)
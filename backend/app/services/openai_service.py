@@ -1,28 +1,138 @@
+import asyncio
+import concurrent.futures
+import logging
 import os
+import threading
+import httpx
 import openai
-from dotenv import load_dotenv
 from pydantic import BaseModel
 from typing import List
-load_dotenv()
+from app.core.log import log_payload
+from app.core.model_routing import model_call
+from app.core.resilience import upstream, call_timeout, check_cancelled, on_cancel, time_left, UPSTREAM_TIMEOUTS
+
+logger = logging.getLogger(__name__)
+
+# Connections to Azure OpenAI per worker, and how many of them are kept open between completions
+OPENAI_MAX_CONNECTIONS = int(os.getenv("OPENAI_MAX_CONNECTIONS", "32"))
+OPENAI_KEEPALIVE_CONNECTIONS = int(os.getenv("OPENAI_KEEPALIVE_CONNECTIONS", "16"))
+# Below the idle timeout of Azure's load balancers (4 minutes), so kept connections are still open when reused
+OPENAI_KEEPALIVE_SECONDS = float(os.getenv("OPENAI_KEEPALIVE_SECONDS", "120"))
+OPENAI_CONNECT_TIMEOUT_SECONDS = float(os.getenv("OPENAI_CONNECT_TIMEOUT_SECONDS", "5"))
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "2"))
+# Streamed completions can be stopped as soon as the client of the request disconnects
+OPENAI_STREAM = os.getenv("OPENAI_STREAM", "true").lower() == "true"
+
+FILE_SELECTION_PROMPT = "Can you give the list of upto 10 most important file paths in this file tree to understand code architechture and high level decisions and overall what the repository is about to include in the podcast i am creating, as a list, do not write any unknown file paths not listed below"
+
+
 class FileListFormat(BaseModel):
     file_list: List[str]
 
+
 class OpenAIService:
+    """
+    Azure OpenAI through one long-lived AsyncAzureOpenAI client per worker, with
+    its own pool of kept-alive connections, so completions skip the TCP and TLS
+    setup and any number of them overlap on one event loop.
+
+    The client runs on the service's own event loop thread. The coroutines
+    (complete, select_files) can be awaited there; the synchronous methods, called
+    from the stage executor threads, hand their coroutine to that loop and wait
+    for it. The caller's context (trace, deadline, cancellation) goes along, and
+    a client disconnect cancels the completion. Safe to share between requests.
+    """
+
     def __init__(self):
-        # Retrieve necessary Azure OpenAI API setup from environment variables
-        openai.api_type = "azure"  # azure / openai
-        openai.api_base = os.environ["AZURE_OPENAI_ENDPOINT"]  # remove this for openai api
-        openai.api_version = "2024-10-21"
-        openai.api_key = os.environ["AZURE_OPENAI_API_KEY"]  # use openai key for openai api
-        # Model name should match your Azure configuration
-        self.model_name = os.environ.get("AZURE_OPENAI_MODEL_NAME", "gpt-4o")
-
-    def call_openai_for_response(self, files_path, ssml_prompt_text):
+        self.client = openai.AsyncAzureOpenAI(
+            azure_endpoint=os.environ["AZURE_OPENAI_ENDPOINT"],
+            api_key=os.environ["AZURE_OPENAI_API_KEY"],
+            api_version=os.getenv("AZURE_OPENAI_API_VERSION", "2024-10-21"),
+            max_retries=OPENAI_MAX_RETRIES,
+            http_client=openai.DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=OPENAI_MAX_CONNECTIONS,
+                                    max_keepalive_connections=OPENAI_KEEPALIVE_CONNECTIONS,
+                                    keepalive_expiry=OPENAI_KEEPALIVE_SECONDS),
+                timeout=httpx.Timeout(UPSTREAM_TIMEOUTS["openai"], connect=OPENAI_CONNECT_TIMEOUT_SECONDS),
+            ),
+        )
+        # Model names (Azure deployments) come from the tiers in app/core/model_routing.py
+        self.loop = asyncio.new_event_loop()
+        threading.Thread(target=self.loop.run_forever, name="openai-client", daemon=True).start()
+
+    def _run(self, coroutine):
+        # run_coroutine_threadsafe schedules from this thread, so the task starts in a copy of this context
+        future = asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+        try:
+            with on_cancel(future.cancel):
+                return future.result()
+        except concurrent.futures.CancelledError:
+            check_cancelled("openai")
+            raise
+
+    def _call_options(self) -> dict:
+        """Per-call timeout, and retries only while the request's deadline leaves room for them."""
+        timeout = call_timeout("openai")
+        left = time_left()
+        retries = OPENAI_MAX_RETRIES if left is None or left > timeout * (OPENAI_MAX_RETRIES + 1) else 0
+        return {"timeout": timeout, "max_retries": retries}
+
+    async def complete(self, system_prompt: str, user_content: str, call_site: str = "short_podcast") -> str:
+        """The model's reply to user_content, on the tier routed for call_site."""
+        with model_call(call_site, system_prompt + user_content) as tier, upstream("openai", "ssml") as call:
+            options = self._call_options()
+            client = self.client.with_options(**options)
+            messages = [
+                {"role": "system", "content": system_prompt},  # Initial system prompt
+                {"role": "user", "content": user_content}  # User prompt
+            ]
+            if not OPENAI_STREAM:
+                response = await client.chat.completions.create(model=tier.model, messages=messages,
+                                                                max_tokens=tier.max_tokens)
+                return response.choices[0].message.content.strip()
+
+            parts = []
+            # The HTTP timeout bounds each read; this bounds the whole streamed completion
+            async with asyncio.timeout(options["timeout"]):
+                stream = await client.chat.completions.create(model=tier.model, messages=messages,
+                                                              max_tokens=tier.max_tokens, stream=True)
+                async with stream:
+                    async for chunk in stream:
+                        check_cancelled("openai_stream")
+                        # Azure sends content filter results in chunks without choices
+                        if chunk.choices and chunk.choices[0].delta.content:
+                            parts.append(chunk.choices[0].delta.content)
+                            call.bytes_in += len(chunk.choices[0].delta.content)
+            return "".join(parts).strip()
+
+    async def select_files(self, file_tree: str) -> list[str]:
+        """Up to 10 paths of the tree the model considers most important."""
+        with model_call("file_selection", file_tree) as tier, upstream("openai", "important_files"):
+            response = await self.client.with_options(**self._call_options()).chat.completions.parse(
+                model=tier.model,
+                messages=[
+                    {"role": "system", "content": FILE_SELECTION_PROMPT},  # Initial system prompt
+                    {"role": "user", "content": file_tree}
+                ],
+                response_format=FileListFormat,
+                max_tokens=tier.max_tokens,
+            )
+        try:
+            response = response.choices[0].message.parsed
+            logger.debug("Picked files: %s", response.file_list)
+            return response.file_list
+        except Exception as e:
+            logger.warning("Error processing file tree: %s", e)
+            return []
+
+    def call_openai_for_response(self, files_path, ssml_prompt_text, call_site="short_podcast"):
         """
         Calls Azure OpenAI API to generate a response based on the given text prompt.
 
         Args:
-            prompt_text (str): The input text prompt for the model.
+            files_path (list): Path of the file holding the content, first entry only.
+            ssml_prompt_text (str): The system prompt.
+            call_site (str): Call site the model tier is routed for.
 
         Returns:
             str: The generated response from the model.
@@ -30,37 +140,12 @@ class OpenAIService:
         # Read the content of the file specified by files_path
         with open(files_path[0], 'r') as file:
             file_content = file.read()  # this has everything readme + tree + other files
-        # Send the prompt to Azure OpenAI for processing
-        response = openai.chat.completions.create(
-            model=self.model_name,
-            messages=[
-                {"role": "system", "content": ssml_prompt_text},  # Initial system prompt
-                {"role": "user", "content": file_content}  # User prompt
-            ]
-        )
-        print(response)
-        # Get and return the content of the assistant's reply
-        assistant_response = response.choices[0].message.content.strip()
+        assistant_response = self._run(self.complete(ssml_prompt_text, file_content, call_site))
+        log_payload(logger, "OpenAI response", assistant_response)
         return assistant_response
 
     def get_important_files(self, file_tree):
-        # file_tree = "api/backend/main.py  api.py"
-        # Send the prompt to Azure OpenAI for processing
-        response = openai.beta.chat.completions.parse(
-            model=self.model_name,
-            messages=[
-                {"role": "system", "content": "Can you give the list of upto 10 most important file paths in this file tree to understand code architechture and high level decisions and overall what the repository is about to include in the podcast i am creating, as a list, do not write any unknown file paths not listed below"},  # Initial system prompt
-                {"role": "user", "content": file_tree}
-            ],
-            response_format=FileListFormat,
-        )
-        try:
-            response = response.choices[0].message.parsed
-            print(type(response), " resp ")
-            return response.file_list
-        except Exception as e:
-            print("Error processing file tree:", e)
-            return []
+        return self._run(self.select_files(file_tree))
 
 
 # Example usage
@@ -0,0 +1,150 @@
+import difflib
+import logging
+import posixpath
+import threading
+from collections import OrderedDict, defaultdict
+
+from app.core.metrics import PICKED_PATHS
+
+logger = logging.getLogger(__name__)
+
+# Fuzzy matching over the whole tree is linear in its size; above this only siblings are searched
+MAX_FUZZY_CANDIDATES = 20000
+
+
+def normalize_path(path: str) -> str:
+    """Strips what models and users tend to wrap paths in: quotes, ./ or / prefixes, trailing slashes."""
+    path = path.strip().strip("\"'`").strip()
+    while path.startswith("./"):
+        path = path[2:]
+    while "//" in path:
+        path = path.replace("//", "/")
+    return path.strip("/")
+
+
+class PathIndex:
+    """
+    Every path of one git tree snapshot with its type ("blob" or "tree") and size,
+    built from the recursive git/trees response. Answers existence and file/directory
+    questions without a network call and maps near-miss paths onto real ones.
+    """
+
+    def __init__(self, entries: dict[str, tuple[str, int]], truncated: bool = False):
+        self._entries = entries
+        # GitHub cuts very large trees short, then a missing path may still exist
+        self.truncated = truncated
+        self._lower: dict[str, str] = {}
+        self._by_name: dict[str, list[str]] = defaultdict(list)
+        self._children: dict[str, list[str]] = defaultdict(list)
+        for path in entries:
+            self._lower.setdefault(path.lower(), path)
+            self._by_name[posixpath.basename(path).lower()].append(path)
+            self._children[posixpath.dirname(path)].append(path)
+
+    @classmethod
+    def from_tree(cls, tree: dict) -> "PathIndex":
+        """Builds the index from a get_repository_tree result."""
+        entries: dict[str, tuple[str, int]] = {}
+        for item in tree["tree"]:
+            entries[item["path"]] = (item["type"], item.get("size", 0))
+            # Parents are listed by the recursive API, but a truncated tree can miss some
+            parent = posixpath.dirname(item["path"])
+            while parent and parent not in entries:
+                entries[parent] = ("tree", 0)
+                parent = posixpath.dirname(parent)
+        return cls(entries, tree.get("truncated", False))
+
+    def __contains__(self, path: str) -> bool:
+        return path in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def type(self, path: str) -> str | None:
+        entry = self._entries.get(path)
+        return entry[0] if entry else None
+
+    def size(self, path: str) -> int | None:
+        entry = self._entries.get(path)
+        return entry[1] if entry else None
+
+    def is_file(self, path: str) -> bool:
+        return self.type(path) == "blob"
+
+    def is_dir(self, path: str) -> bool:
+        return self.type(path) == "tree"
+
+    def resolve(self, path: str, cutoff: float = 0.85) -> str | None:
+        """
+        Maps a possibly inexact path onto a path of the tree: exact match, then a
+        case-insensitive one, then the same file name elsewhere in the tree, then the
+        closest spelling among its siblings. Returns None if nothing is close enough.
+        """
+        path = normalize_path(path)
+        if path in self._entries:
+            return path
+        if path.lower() in self._lower:
+            return self._lower[path.lower()]
+
+        # Right file name, wrong or missing directories (e.g. "main.py" for "src/app/main.py")
+        same_name = self._by_name.get(posixpath.basename(path).lower(), [])
+        if len(same_name) == 1:
+            return same_name[0]
+        if same_name:
+            best = max(same_name, key=lambda candidate: difflib.SequenceMatcher(None, path, candidate).ratio())
+            if difflib.SequenceMatcher(None, path, best).ratio() >= 0.6:
+                return best
+
+        # Misspelt name: search the siblings if the directory exists, otherwise the whole tree if small
+        parent = posixpath.dirname(path)
+        if parent in self._children:
+            candidates = self._children[parent]
+        elif len(self._entries) <= MAX_FUZZY_CANDIDATES:
+            candidates = list(self._entries)
+        else:
+            return None
+        matches = difflib.get_close_matches(path, candidates, n=1, cutoff=cutoff)
+        return matches[0] if matches else None
+
+    def resolve_files(self, paths: list[str]) -> list[str]:
+        """
+        Resolves model-picked file paths, dropping directories, duplicates and paths
+        that match nothing, so no download is attempted for a path that does not exist.
+        """
+        resolved = []
+        for path in paths:
+            match = self.resolve(path)
+            if match is None and self.truncated:
+                # Cannot prove it does not exist, let the download decide
+                match = normalize_path(path)
+            if match is None or self.is_dir(match):
+                PICKED_PATHS.labels("rejected").inc()
+                logger.info("Dropping picked path %r: not a file in the repository", path)
+                continue
+            PICKED_PATHS.labels("exact" if match == path else "corrected").inc()
+            if match != path:
+                logger.info("Corrected picked path %r to %r", path, match)
+            if match not in resolved:
+                resolved.append(match)
+        return resolved
+
+
+_indexes: OrderedDict[str, PathIndex] = OrderedDict()
+_indexes_lock = threading.Lock()
+MAX_CACHED_INDEXES = 32
+
+
+def index_tree(tree: dict) -> PathIndex:
+    """The PathIndex of a get_repository_tree result, built once per tree SHA."""
+    sha = tree.get("sha")
+    with _indexes_lock:
+        if sha in _indexes:
+            _indexes.move_to_end(sha)
+            return _indexes[sha]
+    index = PathIndex.from_tree(tree)
+    if sha:
+        with _indexes_lock:
+            _indexes[sha] = index
+            while len(_indexes) > MAX_CACHED_INDEXES:
+                _indexes.popitem(last=False)
+    return index
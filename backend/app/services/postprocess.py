@@ -0,0 +1,167 @@
+import io
+import logging
+import re
+import textwrap
+import xml.etree.ElementTree as ET
+
+# CPU-bound post-processing of narrations, run in the worker processes of core/cpu_pool.py.
+# Only the standard library is imported at the top, so those processes start quickly.
+
+logger = logging.getLogger(__name__)
+
+
+def calculate_duration(text_line, wpm=135):
+    words = len(text_line.split())
+    minutes = words / wpm
+    seconds = minutes * 60
+    return seconds
+
+
+def no_of_words(text_lines):
+    if isinstance(text_lines, str):  # If it's a single string
+        return len([word for word in text_lines.split() if word])
+    elif isinstance(text_lines, list):  # If it's a list of strings
+        return sum(len([word for word in line.split() if word]) for line in text_lines)
+    else:
+        return 0
+
+
+def ssml_to_webvtt(ssml_content, duration_in_seconds, max_line_length=45, max_words_per_cue=30):
+    # Helper function to insert line breaks at appropriate places
+    def add_line_breaks(text, max_length):
+        words = text.split()
+        lines, current_line = [], ""
+        for word in words:
+            # Check if adding the next word exceeds the length limit
+            if len(current_line) + len(word) + 1 > max_length:
+                lines.append(current_line)
+                current_line = word
+            else:
+                current_line += (" " if current_line else "") + word
+        if current_line:  # Add the remainder of the text if any
+            lines.append(current_line)
+        return "\n".join(lines)
+
+    # Step 1: Extract text from SSML, remove specific tags, and empty lines
+    text_content = re.sub(r'<speak[^>]*>|</speak>|<break[^>]*>', '', ssml_content)
+    text_content = re.sub(r'<voice[^>]*>', '\n\n', text_content)
+    text_content = re.sub(r'</voice>', '', text_content)
+    text_content = re.sub(r'<emphasis[^>]*>|</emphasis>', '', text_content)
+    text_lines = list(filter(None, [line.strip() for line in text_content.splitlines()]))
+
+    # Step 2: Generate WebVTT content with sequential timestamps
+    vtt_content = textwrap.dedent("""\
+        WEBVTT
+
+        """)
+    cumulative_time = 0.0
+    cue_index = 0
+    wpm = int(no_of_words(text_lines) / duration_in_seconds * 60)
+    logger.debug("%d words per minute", wpm)
+    for i, line in enumerate(text_lines):
+
+        # Break the line if it's too long into sub-lines based on word count
+        words = line.split()
+        sub_lines = []
+        for j in range(0, len(words), max_words_per_cue):
+            sub_line = ' '.join(words[j:j + max_words_per_cue])
+            sub_lines.append(sub_line)
+
+        # Generate VTT for each sub-line
+        for sub_line in sub_lines:
+            duration = calculate_duration(sub_line, wpm=wpm)
+            start_time = cumulative_time
+            end_time = start_time + duration
+            cumulative_time = end_time  # Update cumulative time for next line
+
+            # Convert seconds to VTT timestamp format (HH:MM:SS.mmm)
+            def seconds_to_timestamp(seconds):
+                hours = int(seconds // 3600)
+                minutes = int((seconds % 3600) // 60)
+                seconds = seconds % 60
+                return f"{hours:02}:{minutes:02}:{seconds:06.3f}"
+
+            formatted_sub_line = add_line_breaks(sub_line, max_line_length)
+            cue_index += 1
+            vtt_content += f"{cue_index}\n"
+            vtt_content += f"{seconds_to_timestamp(start_time)} --> {seconds_to_timestamp(end_time)} line:5% align:center\n"
+            vtt_content += f"{formatted_sub_line}\n\n"
+
+    return vtt_content
+
+
+# Function to remove the first occurrence of the <speak> tag using regex
+def remove_first_speak_tag(content):
+    # Regex pattern to match the <speak> tag with version and xmlns attributes
+    speak_pattern = r'<speak[^>]*>'
+
+    # Replace the first occurrence of the <speak> tag
+    content_no_speak = re.sub(speak_pattern, '', content, count=1)
+
+    # Similarly, remove the first occurrence of the closing </speak> tag
+    content_no_speak = re.sub(r'</speak>', '', content_no_speak, count=1)
+
+    return content_no_speak
+
+
+# Function to validate SSML
+def is_valid_ssml(ssml: str) -> bool:
+    try:
+        # Attempt to parse the SSML as XML
+        ET.fromstring(ssml)
+        return True
+    except ET.ParseError:
+        return False
+
+
+# Function to sanitize SSML by removing invalid break and code tags
+def sanitize_ssml(ssml: str) -> str:
+    try:
+        # Parse the input SSML
+        root = ET.fromstring(ssml)
+
+        # The namespace URI if any (extracted from the root tag)
+        default_ns_uri = root.tag.split('}')[0].strip('{')
+
+        # Remove non-<voice> children while preserving the element itself
+        for child in list(root):
+            # Extract the local name by splitting the namespace
+            tag_name = child.tag
+            tag_without_ns = tag_name.split('}')[1] if '}' in tag_name else tag_name
+
+            if tag_without_ns != 'voice':
+                root.remove(child)
+
+        # Declare default namespaces
+        ET.register_namespace('', default_ns_uri)
+
+        # Return the modified XML as a string
+        return ET.tostring(root, encoding='unicode')
+    except ET.ParseError:
+        # In case of parsing errors, simply return the original SSML
+        return ssml
+
+
+def sanitize_and_validate(ssml: str) -> tuple[str, bool]:
+    """sanitize_ssml and is_valid_ssml in one pool job."""
+    sanitized = sanitize_ssml(ssml)
+    return sanitized, is_valid_ssml(sanitized)
+
+
+def combine_ssml(ssml_documents: list[str]) -> str:
+    """Merges several <speak> documents into one, in order."""
+    if len(ssml_documents) == 1:
+        return ssml_documents[0]
+    # Apply the function to remove the first occurrence of the <speak> tags from responses
+    combined_ssml_content = "\n".join(remove_first_speak_tag(ssml) for ssml in ssml_documents)
+
+    # Wrap the combined content in a single <speak> tag
+    return f'<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="en-US">{combined_ssml_content}</speak>'
+
+
+def audio_duration(audio_bytes: bytes, container: str = "mp3") -> float:
+    """Seconds of audio, from decoding it with pydub."""
+    from pydub import AudioSegment  # deferred, only needed once a podcast has audio
+
+    audio = AudioSegment.from_file(io.BytesIO(audio_bytes), format=container)
+    return len(audio) / 1000.0
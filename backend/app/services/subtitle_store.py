@@ -0,0 +1,67 @@
+import gzip
+import hashlib
+import os
+import re
+import time
+
+from app.core.files import atomic_write
+
+SUBTITLE_ID_PATTERN = re.compile(r"^[0-9a-f]{32}$")
+
+
+class SubtitleStore:
+    """
+    Content-addressed WebVTT store on local disk, shared by all uvicorn workers.
+
+    Subtitles are kept gzip-compressed, so the common case (a client sending
+    Accept-Encoding: gzip) is served without any work. The id is a hash of the
+    content, which doubles as a strong ETag and lets responses be cached as immutable.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: int, prune_every: int = 100):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.prune_every = prune_every
+        self._writes = 0
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, subtitle_id: str) -> str:
+        return os.path.join(self.directory, f"{subtitle_id}.vtt.gz")
+
+    def put(self, vtt_content: str) -> str:
+        data = vtt_content.encode("utf-8")
+        subtitle_id = hashlib.sha256(data).hexdigest()[:32]
+        path = self._path(subtitle_id)
+        if os.path.exists(path):
+            os.utime(path)
+        else:
+            atomic_write(path, gzip.compress(data, compresslevel=9))
+
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+        return subtitle_id
+
+    def get_compressed(self, subtitle_id: str) -> bytes | None:
+        if not SUBTITLE_ID_PATTERN.match(subtitle_id):
+            return None
+        try:
+            with open(self._path(subtitle_id), "rb") as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def prune(self):
+        cutoff = time.time() - self.ttl_seconds
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.stat().st_mtime < cutoff:
+                    os.remove(entry.path)
+            except FileNotFoundError:
+                pass
+
+
+subtitle_store = SubtitleStore(
+    os.getenv("SUBTITLE_CACHE_DIR", "/tmp/gitpodcast_subtitles"),
+    ttl_seconds=int(os.getenv("SUBTITLE_TTL_HOURS", "168")) * 3600,
+)
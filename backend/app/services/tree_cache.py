@@ -0,0 +1,73 @@
+import gzip
+import json
+import os
+import time
+
+from app.core.files import atomic_write
+from app.services.narration_cache import fingerprint
+
+
+class TreeSnapshotCache:
+    """
+    Recently fetched repository trees on local disk, shared by all workers, so a
+    cost preview and the generation that usually follows it (or two workers
+    serving the same repo) only list the repository once. Snapshots older than
+    ttl_seconds are ignored and deleted by prune(), which also keeps at most
+    max_entries of them: unauthenticated cost previews of any repo create them.
+    """
+
+    def __init__(self, directory: str, ttl_seconds: float, max_entries: int, prune_every: int = 100):
+        self.directory = directory
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.prune_every = prune_every
+        self._writes = 0
+
+    def _path(self, username: str, repo: str) -> str:
+        # Hashed so user supplied names never become path components
+        return os.path.join(self.directory, f"{fingerprint(username.lower(), repo.lower())[:32]}.json.gz")
+
+    def load(self, username: str, repo: str) -> dict | None:
+        """The tree as get_repository_tree returns it, if one was stored less than ttl_seconds ago."""
+        path = self._path(username, repo)
+        try:
+            if time.time() - os.stat(path).st_mtime > self.ttl_seconds:
+                return None
+            with gzip.open(path, "rt", encoding="utf-8") as f:
+                return json.load(f)
+        except (FileNotFoundError, OSError, json.JSONDecodeError):
+            return None
+
+    def save(self, username: str, repo: str, tree: dict):
+        os.makedirs(self.directory, exist_ok=True)
+        path = self._path(username, repo)
+        atomic_write(path, gzip.compress(json.dumps(tree).encode("utf-8"), compresslevel=1))
+        self._writes += 1
+        if self._writes % self.prune_every == 0:
+            self.prune()
+
+    def prune(self):
+        """Deletes the expired snapshots, then the oldest ones beyond max_entries."""
+        cutoff = time.time() - self.ttl_seconds
+        snapshots = []
+        for entry in os.scandir(self.directory):
+            try:
+                mtime = entry.stat().st_mtime
+                if mtime < cutoff:
+                    os.remove(entry.path)
+                elif entry.name.endswith(".json.gz"):
+                    snapshots.append((mtime, entry.path))
+            except FileNotFoundError:
+                pass
+        for _, path in sorted(snapshots, reverse=True)[self.max_entries:]:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+tree_snapshots = TreeSnapshotCache(
+    os.getenv("TREE_SNAPSHOT_DIR", "/tmp/gitpodcast_trees"),
+    ttl_seconds=float(os.getenv("TREE_SNAPSHOT_TTL_SECONDS", "300")),
+    max_entries=int(os.getenv("TREE_SNAPSHOT_MAX_ENTRIES", "1000")),
+)
@@ -0,0 +1,345 @@
+"""
+Local stand-ins for GitHub, Azure OpenAI, Anthropic and Azure Speech.
+
+GitHub, OpenAI and Anthropic are served over real HTTP by FakeUpstreamServer so the
+services' own client code is exercised; point the app at it with the environment from
+`FakeUpstreamServer.env()`. Azure Speech talks a proprietary websocket protocol, so it
+is replaced in-process by `install_fake_tts`, which returns valid (silent) MP3 frames.
+
+Can also be run on its own to back a real uvicorn instance:
+    python -m benchmarks.fake_upstreams --port 9100 --github-latency 0.05 --llm-latency 2
+"""
+import argparse
+import base64
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from dataclasses import asdict, dataclass, field
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+
+@dataclass
+class RepoSize:
+    files: int
+    file_bytes: int
+    readme_bytes: int
+
+
+REPO_SIZES = {
+    "small": RepoSize(files=50, file_bytes=2_000, readme_bytes=4_000),
+    "medium": RepoSize(files=500, file_bytes=8_000, readme_bytes=10_000),
+    "large": RepoSize(files=5_000, file_bytes=20_000, readme_bytes=30_000),
+}
+
+
+@dataclass
+class UpstreamProfile:
+    # Seconds added to every response of the given upstream
+    github_latency: float = 0.05
+    llm_latency: float = 1.0
+    token_count_latency: float = 0.1
+    tts_latency: float = 0.5
+    # Seconds of TTS rendering per second of produced audio (Azure is roughly 0.02-0.1)
+    tts_realtime_factor: float = 0.02
+    # Size of the narration returned by each SSML completion
+    ssml_words: int = 600
+    repo_size: RepoSize = field(default_factory=lambda: REPO_SIZES["small"])
+    # Latencies (seconds) recorded by a traffic capture, by upstream call ("openai.ssml", "github.contents",
+    # ...); each response draws one of them instead of the fixed latency above
+    recorded: dict[str, list[float]] = field(default_factory=dict)
+    # Sizes of individual repos, by repo name; the others have repo_size
+    repo_sizes: dict[str, RepoSize] = field(default_factory=dict)
+
+    def latency(self, call: str, default: float) -> float:
+        samples = self.recorded.get(call)
+        return random.choice(samples) if samples else default
+
+    def size_of(self, repo: str) -> RepoSize:
+        return self.repo_sizes.get(repo, self.repo_size)
+
+    def to_dict(self) -> dict:
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data: dict) -> "UpstreamProfile":
+        data = dict(data)
+        data["repo_size"] = RepoSize(**data["repo_size"])
+        data["repo_sizes"] = {repo: RepoSize(**size) for repo, size in data.get("repo_sizes", {}).items()}
+        return cls(**data)
+
+
+# MPEG-2 Layer III, 32 kbps, 16 kHz, mono: the same format text_to_mp3 requests from Azure.
+# Each frame is 144 bytes and holds 576 samples (36 ms). A zeroed side-info/main-data
+# section decodes as digital silence, so the frames are valid without an encoder.
+MP3_FRAME_HEADER = bytes([0xFF, 0xF3, 0x48, 0xC0])
+MP3_FRAME_BYTES = 144
+MP3_FRAME_SECONDS = 576 / 16000
+
+
+def silent_mp3(seconds: float) -> bytes:
+    frame = MP3_FRAME_HEADER + bytes(MP3_FRAME_BYTES - len(MP3_FRAME_HEADER))
+    return frame * max(1, round(seconds / MP3_FRAME_SECONDS))
+
+
+def _filler(nbytes: int, seed: str) -> str:
+    """Deterministic, vaguely code-shaped text of roughly nbytes."""
+    line = f"def handler_{hashlib.md5(seed.encode()).hexdigest()[:8]}(request):  # process the request\n"
+    return (line * (nbytes // len(line) + 1))[:nbytes]
+
+
+def _tree(size: RepoSize) -> list[dict]:
+    tree = [{"path": "README.md", "type": "blob", "size": size.readme_bytes, "sha": "0" * 40}]
+    for i in range(size.files):
+        package = f"src/pkg_{i // 25}"
+        if i % 25 == 0:
+            tree.append({"path": package, "type": "tree", "sha": "1" * 40})
+        path = f"{package}/module_{i}.py"
+        tree.append({"path": path, "type": "blob", "size": size.file_bytes,
+                     "sha": hashlib.sha1(path.encode()).hexdigest()})
+    return tree
+
+
+def fake_ssml(words: int) -> str:
+    sentence = "This module wires the request handlers into the application and keeps the pipeline simple."
+    per_sentence = len(sentence.split())
+    lines = [sentence] * max(1, words // per_sentence)
+    half = len(lines) // 2 or 1
+    return (
+        '<speak version="1.0" xmlns="http://www.w3.org/2001/10/synthesis" xml:lang="en-US">\n'
+        '<voice name="en-US-AvaMultilingualNeural">\n' + "\n".join(lines[:half]) + "\n</voice>\n"
+        '<voice name="en-US-BrianMultilingualNeural">\n' + "\n".join(lines[half:]) + "\n</voice>\n"
+        "</speak>"
+    )
+
+
+# GitHub routes by the upstream call the app records for them (see GitHubService._get)
+GITHUB_CALLS = [
+    (r"/repos/[^/]+/[^/]+", "github.repo"),
+    (r"/repos/[^/]+/[^/]+/git/trees/[^/]+", "github.tree"),
+    (r"/repos/[^/]+/[^/]+/readme", "github.readme"),
+    (r"/raw/[^/]+/[^/]+/README\.md", "github.readme_download"),
+    (r"/repos/[^/]+/[^/]+/contents/.+", "github.contents"),
+]
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: "FakeUpstreamServer"
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_message_stream(self, body, text, chunk_chars=8):
+        """Anthropic Messages streaming (SSE), a few characters per delta like real token output."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def event(name, payload):
+            self.wfile.write(f"event: {name}\ndata: {json.dumps({'type': name, **payload})}\n\n".encode())
+            self.wfile.flush()
+
+        event("message_start", {"message": {
+            "id": "msg_bench", "type": "message", "role": "assistant", "model": body.get("model"), "content": [],
+            "stop_reason": None, "stop_sequence": None, "usage": {"input_tokens": 0, "output_tokens": 0}}})
+        event("content_block_start", {"index": 0, "content_block": {"type": "text", "text": ""}})
+        for offset in range(0, len(text), chunk_chars):
+            event("content_block_delta", {"index": 0, "delta": {"type": "text_delta",
+                                                                 "text": text[offset:offset + chunk_chars]}})
+        event("content_block_stop", {"index": 0})
+        event("message_delta", {"delta": {"stop_reason": "end_turn", "stop_sequence": None},
+                                "usage": {"output_tokens": len(text) // 4}})
+        event("message_stop", {})
+        self.close_connection = True
+
+    def _send_completion_stream(self, body, text, chunk_chars=8):
+        """OpenAI chat completion streaming (SSE), ending in [DONE]."""
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+
+        def chunk(delta, finish_reason=None):
+            payload = {"id": "chatcmpl-bench", "object": "chat.completion.chunk", "created": int(time.time()),
+                       "model": body.get("model", "gpt-4o"),
+                       "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]}
+            self.wfile.write(f"data: {json.dumps(payload)}\n\n".encode())
+            self.wfile.flush()
+
+        chunk({"role": "assistant", "content": ""})
+        for offset in range(0, len(text), chunk_chars):
+            chunk({"content": text[offset:offset + chunk_chars]})
+        chunk({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.close_connection = True
+
+    def _read_json(self):
+        length = int(self.headers.get("Content-Length", 0))
+        return json.loads(self.rfile.read(length) or b"{}")
+
+    def do_GET(self):
+        profile = self.server.profile
+        path = urlparse(self.path).path
+        call = next((name for pattern, name in GITHUB_CALLS if re.fullmatch(pattern, path)), None)
+        time.sleep(profile.latency(call, profile.github_latency))
+        self.server.count("github")
+        size = profile.size_of(path.split("/")[3]) if path.count("/") >= 3 else profile.repo_size
+
+        if m := re.fullmatch(r"/repos/([^/]+)/([^/]+)", path):
+            return self._send_json({"name": m.group(2), "default_branch": "main"})
+        if re.fullmatch(r"/repos/[^/]+/[^/]+/git/trees/[^/]+", path):
+            return self._send_json({"sha": "f" * 40, "tree": _tree(size), "truncated": False})
+        if m := re.fullmatch(r"/repos/([^/]+)/([^/]+)/readme", path):
+            return self._send_json({"name": "README.md", "path": "README.md",
+                                    "download_url": f"{self.server.base_url}/raw/{m.group(1)}/{m.group(2)}/README.md"})
+        if re.fullmatch(r"/raw/[^/]+/[^/]+/README\.md", path):
+            body = ("# Benchmark repository\n\n" + _filler(size.readme_bytes, path)).encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+            return
+        if m := re.fullmatch(r"/repos/[^/]+/[^/]+/contents/(.+)", path):
+            content = _filler(size.file_bytes, m.group(1)).encode()
+            return self._send_json({"path": m.group(1), "encoding": "base64", "size": len(content),
+                                    "content": base64.b64encode(content).decode()})
+        self._send_json({"message": "Not Found"}, status=404)
+
+    def do_POST(self):
+        profile = self.server.profile
+        path = urlparse(self.path).path
+        body = self._read_json()
+
+        if path.endswith("/chat/completions"):
+            call = "openai.important_files" if body.get("response_format") else "openai.ssml"
+            time.sleep(profile.latency(call, profile.llm_latency))
+            self.server.count("openai")
+            if body.get("response_format"):
+                # get_important_files: pick paths out of the tree that was sent
+                tree = body["messages"][-1]["content"]
+                paths = [p for p in tree.splitlines() if p.endswith(".py")][:10]
+                content = json.dumps({"file_list": paths})
+            else:
+                content = fake_ssml(profile.ssml_words)
+            if body.get("stream"):
+                return self._send_completion_stream(body, content)
+            return self._send_json({
+                "id": "chatcmpl-bench", "object": "chat.completion", "created": int(time.time()),
+                "model": body.get("model", "gpt-4o"),
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(content) // 4, "total_tokens": len(content) // 4},
+            })
+        if path == "/v1/messages/count_tokens":
+            time.sleep(profile.latency("claude.count_tokens", profile.token_count_latency))
+            self.server.count("anthropic")
+            return self._send_json({"input_tokens": len(json.dumps(body["messages"])) // 4})
+        if path == "/v1/messages":
+            call = "claude.messages_stream" if body.get("stream") else "claude.messages"
+            time.sleep(profile.latency(call, profile.llm_latency))
+            self.server.count("anthropic")
+            if "@@ replace" in str(body.get("system")):
+                # /modify in diff mode: an edit script against the numbered diagram
+                text = "@@ replace 2\n    A[Benchmark] --> C[Patched]"
+            else:
+                text = "flowchart TB\n    A[Benchmark] --> B[Diagram]"
+            if body.get("stream"):
+                return self._send_message_stream(body, text)
+            return self._send_json({
+                "id": "msg_bench", "type": "message", "role": "assistant", "model": body.get("model"),
+                "content": [{"type": "text", "text": text}], "stop_reason": "end_turn", "stop_sequence": None,
+                "usage": {"input_tokens": 0, "output_tokens": len(text) // 4},
+            })
+        self._send_json({"error": "unknown route"}, status=404)
+
+
+class FakeUpstreamServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, profile: UpstreamProfile | None = None, host="127.0.0.1", port=0):
+        super().__init__((host, port), _Handler)
+        self.profile = profile or UpstreamProfile()
+        self.calls: dict[str, int] = {}
+        self._lock = threading.Lock()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def count(self, upstream: str):
+        with self._lock:
+            self.calls[upstream] = self.calls.get(upstream, 0) + 1
+
+    def env(self) -> dict[str, str]:
+        """Environment that points the app's clients at this server."""
+        return {
+            "GITHUB_API_URL": self.base_url,
+            "GITHUB_PAT": "bench",
+            "AZURE_OPENAI_ENDPOINT": self.base_url,
+            "AZURE_OPENAI_API_KEY": "bench",
+            "ANTHROPIC_BASE_URL": self.base_url,
+            "ANTHROPIC_API_KEY": "bench",
+            "SPEECH_KEY": "bench",
+            "SPEECH_REGION": "bench",
+        }
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def install_fake_tts(profile: UpstreamProfile):
+    """
+    Replaces Azure synthesis with a stub that sleeps like the real service and returns
+    silent MP3 frames matching the length the narration would have (135 wpm).
+    """
+    from app.services.speech_service import SpeechService
+
+    def text_to_mp3(self, ssml_string: str, *args, **kwargs) -> bytes | None:
+        words = len(re.sub(r"<[^>]+>", " ", ssml_string).split())
+        seconds = words / 135 * 60
+        time.sleep(profile.latency("speech.synthesize", profile.tts_latency + seconds * profile.tts_realtime_factor))
+        return silent_mp3(seconds)
+
+    SpeechService.text_to_mp3 = text_to_mp3
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Serve fake GitHub/OpenAI/Anthropic endpoints")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--repo-size", choices=REPO_SIZES, default="small")
+    parser.add_argument("--github-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--ssml-words", type=int, default=600)
+    args = parser.parse_args()
+
+    server = FakeUpstreamServer(UpstreamProfile(
+        github_latency=args.github_latency,
+        llm_latency=args.llm_latency,
+        ssml_words=args.ssml_words,
+        repo_size=REPO_SIZES[args.repo_size],
+    ), port=args.port)
+    for key, value in server.env().items():
+        print(f"export {key}={value}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        server.server_close()
@@ -0,0 +1,316 @@
+"""
+Replays captured /generate traffic (see app/core/capture.py) against the app under
+uvicorn with local upstream stand-ins, to find where a deployment saturates.
+
+Each captured request is re-issued at its recorded offset divided by the speed-up,
+open loop (arrivals don't wait for responses), so a speed-up of 4 is four times the
+captured load. The stand-ins answer with latencies drawn from the recorded ones and
+serve repos sized like the captured ones. For every worker count the driver starts
+uvicorn, sweeps the speed-ups and reports throughput and p99 against offered load,
+the admission queue depth and the RSS of all worker processes.
+
+    # on the server
+    TRAFFIC_CAPTURE_PATH=/tmp/gitpodcast_capture.jsonl uvicorn app.main:app --workers 2
+    # locally
+    cd backend
+    python -m benchmarks.replay capture.jsonl --workers 1,2,4 --speedups 1,2,4,8 --save curves.json
+    python -m benchmarks.replay capture.jsonl --workers 2 --env GENERATE_MAX_ACTIVE=8 --env STAGE_WORKERS_LLM=8
+
+Audio replays need ffmpeg on PATH, as in the Docker image. RSS is read from /proc (Linux).
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from collections import defaultdict
+
+import httpx
+from prometheus_client.parser import text_string_to_metric_families
+
+from benchmarks.fake_upstreams import REPO_SIZES, FakeUpstreamServer, RepoSize, UpstreamProfile, _tree
+from benchmarks.run import percentile
+
+PAGE_BYTES = resource.getpagesize()
+
+
+def load_capture(path: str, limit: int | None = None) -> list[dict]:
+    with open(path) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    records.sort(key=lambda record: record["ts"])
+    return records[:limit] if limit else records
+
+
+def recorded_latencies(records: list[dict]) -> dict[str, list[float]]:
+    """Every recorded upstream latency, in seconds, by upstream call."""
+    latencies: dict[str, list[float]] = defaultdict(list)
+    for record in records:
+        for call, durations_ms in record.get("upstreams", {}).items():
+            latencies[call].extend(ms / 1000 for ms in durations_ms)
+    return dict(latencies)
+
+
+def prompt_chars_per_file() -> float:
+    """Characters a fake repo's tree takes in the prompt per file, after minimization."""
+    from app.services.content_minimizer import ContentMinimizer
+    size = REPO_SIZES["medium"]
+    listing = "\n".join(item["path"] for item in _tree(size) if item["type"] == "blob")
+    return len(ContentMinimizer().tree(listing)) / size.files
+
+
+def repo_size(record: dict, chars_per_file: float, default: RepoSize) -> RepoSize:
+    """A fake repo whose prompt content is about as large as the captured one's."""
+    if "tree_chars" not in record:
+        return default
+    files = max(record.get("files", 0), round(record["tree_chars"] / chars_per_file), 1)
+    return RepoSize(files=files, file_bytes=record["file_chars"] // max(record.get("files", 0), 1),
+                    readme_bytes=record["readme_chars"])
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def process_tree_rss_mb(root: int) -> float:
+    """Resident memory of a process and all its descendants."""
+    parents = {}
+    for entry in os.listdir("/proc"):
+        if not entry.isdigit():
+            continue
+        try:
+            with open(f"/proc/{entry}/stat") as f:
+                # The command name may contain spaces, the fields after it don't
+                parents[int(entry)] = int(f.read().rsplit(")", 1)[1].split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    pids, frontier = {root}, [root]
+    while frontier:
+        parent = frontier.pop()
+        children = [pid for pid, ppid in parents.items() if ppid == parent and pid not in pids]
+        pids.update(children)
+        frontier.extend(children)
+    pages = 0
+    for pid in pids:
+        try:
+            with open(f"/proc/{pid}/statm") as f:
+                pages += int(f.read().split()[1])
+        except (OSError, IndexError, ValueError):
+            continue
+    return pages * PAGE_BYTES / (1024 * 1024)
+
+
+def gauge_sum(metrics_text: str, name: str) -> float:
+    return sum(sample.value for family in text_string_to_metric_families(metrics_text)
+               if family.name == name for sample in family.samples)
+
+
+class AppServer:
+    """The app under uvicorn with workers processes, pointed at the stand-ins."""
+
+    def __init__(self, workers: int, env: dict[str, str]):
+        self.workers = workers
+        self.port = free_port()
+        self.url = f"http://127.0.0.1:{self.port}"
+        self.env = env
+        self.process: subprocess.Popen | None = None
+
+    async def start(self, timeout: float = 120):
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmarks.replay_app:app", "--host", "127.0.0.1",
+             "--port", str(self.port), "--workers", str(self.workers), "--timeout-keep-alive", "300",
+             "--log-level", "warning"],
+            env=self.env, cwd=os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        )
+        deadline = time.monotonic() + timeout
+        async with httpx.AsyncClient(base_url=self.url) as client:
+            while time.monotonic() < deadline:
+                if self.process.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with {self.process.returncode}")
+                try:
+                    if (await client.get("/metrics")).status_code == 200:
+                        return self
+                except httpx.TransportError:
+                    pass
+                await asyncio.sleep(0.5)
+        self.stop()
+        raise RuntimeError(f"uvicorn did not come up within {timeout:.0f}s")
+
+    def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                self.process.wait(30)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+
+
+async def replay_point(app: AppServer, records: list[dict], speedup: float, point_id: str, audio: bool,
+                       request_timeout: float, sample_interval: float) -> dict:
+    """Replays records at speedup and samples the server while they run."""
+    latencies: list[float] = []
+    statuses: dict[str, int] = defaultdict(int)
+    outstanding = 0
+    samples: list[tuple[float, float, int, float]] = []  # (queue depth, in flight, outstanding, RSS MB)
+    first_ts = records[0]["ts"]
+
+    async def one(client: httpx.AsyncClient, record: dict, start: float):
+        nonlocal outstanding
+        await asyncio.sleep(max(0.0, start + (record["ts"] - first_ts) / speedup - time.perf_counter()))
+        outstanding += 1
+        sent = time.perf_counter()
+        try:
+            response = await client.post(record.get("path", "/generate"), json={
+                "username": "replay",
+                # Per point, so repeats of a repo hit the caches as they did in the capture, but only within the point
+                "repo": f"{record.get('repo', 'unknown')}-{point_id}",
+                "instructions": "",
+                "audio": audio and record.get("audio", False),
+                "audio_length": record.get("audio_length", "long"),
+                "audio_format": record.get("audio_format"),
+                "incremental": record.get("incremental", False),
+            })
+            failed = response.status_code == 200 and response.headers.get("content-type", "").startswith(
+                "application/json") and "error" in response.json()
+            statuses["error" if failed else str(response.status_code)] += 1
+        except httpx.TimeoutException:
+            statuses["timeout"] += 1
+        except httpx.TransportError:
+            statuses["error"] += 1
+        latencies.append(time.perf_counter() - sent)
+        outstanding -= 1
+
+    async def sample(client: httpx.AsyncClient):
+        while True:
+            try:
+                metrics = (await client.get("/metrics")).text
+                rss = await asyncio.to_thread(process_tree_rss_mb, app.process.pid)
+                samples.append((gauge_sum(metrics, "gitpodcast_admission_queue_depth"),
+                                gauge_sum(metrics, "gitpodcast_requests_in_flight"), outstanding, rss))
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(sample_interval)
+
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+    async with httpx.AsyncClient(base_url=app.url, timeout=request_timeout, limits=limits) as client, \
+            httpx.AsyncClient(base_url=app.url, timeout=10) as metrics_client:
+        sampler = asyncio.create_task(sample(metrics_client))
+        start = time.perf_counter()
+        await asyncio.gather(*(one(client, record, start) for record in records))
+        wall = time.perf_counter() - start
+        sampler.cancel()
+
+    span = (records[-1]["ts"] - first_ts) / speedup
+    ok = statuses.get("200", 0)
+    queue_depths = [queue for queue, _, _, _ in samples] or [0.0]
+    return {
+        "workers": app.workers,
+        "speedup": speedup,
+        "requests": len(records),
+        "offered_rps": len(records) / span if span else 0.0,
+        "throughput_rps": ok / wall if wall else 0.0,
+        "p50_s": percentile(latencies, 50),
+        "p99_s": percentile(latencies, 99),
+        "statuses": dict(statuses),
+        "queue_depth_max": max(queue_depths),
+        "queue_depth_mean": sum(queue_depths) / len(queue_depths),
+        "in_flight_max": max((in_flight for _, in_flight, _, _ in samples), default=0.0),
+        "outstanding_max": max((waiting for _, _, waiting, _ in samples), default=0),
+        "peak_rss_mb": max((rss for _, _, _, rss in samples), default=0.0),
+    }
+
+
+def print_curve(workers: int, points: list[dict]):
+    print(f"\n== workers={workers}")
+    print(f"   {'speedup':>7} {'offered':>9} {'throughput':>10} {'p50':>8} {'p99':>8} "
+          f"{'queue max/mean':>15} {'rss':>8}  statuses")
+    for point in points:
+        print(f"   {point['speedup']:>6g}x {point['offered_rps']:>7.2f}/s {point['throughput_rps']:>8.2f}/s "
+              f"{point['p50_s']:>7.2f}s {point['p99_s']:>7.2f}s "
+              f"{point['queue_depth_max']:>7.0f}/{point['queue_depth_mean']:<7.1f} {point['peak_rss_mb']:>6.0f}MB  "
+              f"{json.dumps(point['statuses'], sort_keys=True)}")
+
+
+async def main(args) -> int:
+    records = load_capture(args.capture, args.limit)
+    if len(records) < 2:
+        print(f"{args.capture} has {len(records)} captured requests, need at least 2")
+        return 1
+
+    profile = UpstreamProfile(recorded=recorded_latencies(records), repo_size=REPO_SIZES[args.repo_size],
+                              ssml_words=args.ssml_words)
+    server = FakeUpstreamServer(profile).start()
+    workdir = tempfile.mkdtemp(prefix="gitpodcast_replay_")
+    profile_path = os.path.join(workdir, "profile.json")
+    with open(profile_path, "w") as f:
+        json.dump(profile.to_dict(), f)
+
+    env = {**os.environ, **server.env(),
+           "BENCH_UPSTREAM_PROFILE": profile_path,
+           "TRAFFIC_CAPTURE_PATH": "",
+           "LOG_LEVEL": "WARNING",
+           "TREE_SNAPSHOT_DIR": os.path.join(workdir, "trees"),
+           "RATE_LIMIT_SQLITE_PATH": os.path.join(workdir, "ratelimit.sqlite")}
+    # The replay comes from one client address; keep the cost limiter out of the measurement
+    for bucket in ("CLIENT", "GLOBAL"):
+        env[f"RATE_LIMIT_{bucket}_CAPACITY"] = env[f"RATE_LIMIT_{bucket}_REFILL_PER_HOUR"] = "1e9"
+    env.update(entry.split("=", 1) for entry in args.env)
+
+    chars_per_file = prompt_chars_per_file()
+    run_id = str(int(time.time()))
+    curves: dict[int, list[dict]] = {}
+    try:
+        for workers in (int(w) for w in args.workers.split(",")):
+            # A fresh directory per run, or livesum gauges would include the previous run's workers
+            multiproc_dir = tempfile.mkdtemp(dir=workdir)
+            app = await AppServer(workers, {**env, "PROMETHEUS_MULTIPROC_DIR": multiproc_dir}).start()
+            curves[workers] = []
+            try:
+                for speedup in (float(s) for s in args.speedups.split(",")):
+                    point_id = f"{run_id}-{workers}-{speedup:g}"
+                    profile.repo_sizes = {f"{record['repo']}-{point_id}": repo_size(record, chars_per_file, profile.repo_size)
+                                          for record in records if "repo" in record}
+                    point = await replay_point(app, records, speedup, point_id, not args.no_audio,
+                                               args.request_timeout, args.sample_interval)
+                    curves[workers].append(point)
+            finally:
+                app.stop()
+            print_curve(workers, curves[workers])
+    finally:
+        server.stop()
+
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump({"capture": args.capture, "requests": len(records), "env": args.env,
+                       "upstream_calls": server.calls, "curves": curves}, f, indent=2)
+        print(f"\nSaved curves to {args.save}")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Replay captured traffic and chart saturation per worker count")
+    parser.add_argument("capture", help="JSON lines written with TRAFFIC_CAPTURE_PATH")
+    parser.add_argument("--workers", default="1,2,4", help="comma separated uvicorn worker counts")
+    parser.add_argument("--speedups", default="1,2,4,8", help="comma separated replay speed-ups")
+    parser.add_argument("--limit", type=int, help="replay only the first N captured requests")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE",
+                        help="app setting for the run, e.g. GENERATE_MAX_ACTIVE=8; repeatable")
+    parser.add_argument("--no-audio", action="store_true", help="replay audio requests as SSML only")
+    parser.add_argument("--repo-size", choices=REPO_SIZES, default="small",
+                        help="fake repo size for requests captured without content sizes")
+    parser.add_argument("--ssml-words", type=int, default=600)
+    # nginx in front of the app gives up after 300s (nginx/api.conf)
+    parser.add_argument("--request-timeout", type=float, default=300)
+    parser.add_argument("--sample-interval", type=float, default=0.5, help="seconds between server samples")
+    parser.add_argument("--save", help="write the curves as JSON")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(build_parser().parse_args())))
@@ -0,0 +1,15 @@
+"""
+The app as benchmarks.replay runs it under uvicorn: Azure Speech replaced in each
+worker by the in-process stand-in, with the profile the driver wrote to
+BENCH_UPSTREAM_PROFILE.
+
+    uvicorn benchmarks.replay_app:app --workers 2
+"""
+import json
+import os
+
+from app.main import app  # noqa: F401
+from benchmarks.fake_upstreams import UpstreamProfile, install_fake_tts
+
+with open(os.environ["BENCH_UPSTREAM_PROFILE"]) as f:
+    install_fake_tts(UpstreamProfile.from_dict(json.load(f)))
@@ -0,0 +1,212 @@
+"""
+End-to-end benchmark of the generate API against local upstream stand-ins.
+
+Drives the real FastAPI app in-process (one worker's worth of event loop) with
+requests traced through Server-Timing, and reports latency percentiles, throughput,
+peak RSS and per-stage wall/CPU time for each repo-size x concurrency point.
+
+    cd backend
+    python -m benchmarks.run --repo-sizes small,large --concurrency 1,4,16 --requests 32
+    python -m benchmarks.run --save baseline.json
+    python -m benchmarks.run --compare baseline.json --tolerance 0.15   # exit 1 on regression
+
+Audio runs (the default) need ffmpeg on PATH for the pydub decode, as in the Docker image.
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import sys
+import time
+from collections import defaultdict
+
+from benchmarks.fake_upstreams import REPO_SIZES, FakeUpstreamServer, UpstreamProfile, install_fake_tts
+
+
+def percentile(values: list[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def parse_server_timing(header: str) -> dict[str, tuple[float, float]]:
+    """Returns {stage: (wall_ms, cpu_ms)} from our Server-Timing header (repeated stages summed)."""
+    stages: dict[str, list[float]] = {}
+    for entry in filter(None, (e.strip() for e in header.split(","))):
+        params = dict(p.split("=", 1) for p in entry.split(";")[1:] if "=" in p)
+        name = params.get("desc", entry.split(";")[0]).strip('"')
+        totals = stages.setdefault(name, [0.0, 0.0])
+        totals[0] += float(params.get("dur", 0))
+        totals[1] += float(params.get("cpu", 0))
+    return {name: (wall, cpu) for name, (wall, cpu) in stages.items()}
+
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in KiB on Linux, bytes on macOS
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return rss / (1024 * 1024) if sys.platform == "darwin" else rss / 1024
+
+
+async def run_point(client, size_name: str, concurrency: int, total: int, audio: bool, audio_length: str, run_id: str):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies: list[float] = []
+    errors = 0
+    stage_samples: dict[str, list[tuple[float, float]]] = defaultdict(list)
+
+    async def one(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            response = await client.post(
+                "/generate",
+                json={
+                    "username": "bench",
+                    # Unique repo per request so every run pays the cold ingestion path
+                    "repo": f"{size_name}-{run_id}-{concurrency}-{i}",
+                    "instructions": "",
+                    "audio": audio,
+                    "audio_length": audio_length,
+                },
+                headers={"X-Trace": "1"},
+            )
+            latencies.append(time.perf_counter() - start)
+            failed = response.status_code != 200
+            if not failed and response.headers.get("content-type", "").startswith("application/json"):
+                failed = "error" in response.json()
+            if failed:
+                errors += 1
+            for name, sample in parse_server_timing(response.headers.get("server-timing", "")).items():
+                stage_samples[name].append(sample)
+
+    cpu_start = time.process_time()
+    wall_start = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(total)))
+    wall = time.perf_counter() - wall_start
+
+    return {
+        "repo_size": size_name,
+        "concurrency": concurrency,
+        "requests": total,
+        "errors": errors,
+        "p50_s": percentile(latencies, 50),
+        "p95_s": percentile(latencies, 95),
+        "p99_s": percentile(latencies, 99),
+        "throughput_rps": total / wall if wall else 0.0,
+        "process_cpu_s": time.process_time() - cpu_start,
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": {
+            name: {
+                "p50_ms": percentile([wall for wall, _ in samples], 50),
+                "p95_ms": percentile([wall for wall, _ in samples], 95),
+                "cpu_ms_mean": sum(cpu for _, cpu in samples) / len(samples),
+            }
+            for name, samples in sorted(stage_samples.items())
+        },
+    }
+
+
+def print_point(point: dict):
+    print(f"\n== repo={point['repo_size']} concurrency={point['concurrency']} "
+          f"requests={point['requests']} errors={point['errors']}")
+    print(f"   latency p50={point['p50_s']:.3f}s p95={point['p95_s']:.3f}s p99={point['p99_s']:.3f}s  "
+          f"throughput={point['throughput_rps']:.2f} req/s  cpu={point['process_cpu_s']:.2f}s  "
+          f"peak_rss={point['peak_rss_mb']:.0f}MB")
+    for name, stats in point["stages"].items():
+        print(f"   {name:<32} p50={stats['p50_ms']:>9.1f}ms p95={stats['p95_ms']:>9.1f}ms "
+              f"cpu={stats['cpu_ms_mean']:>8.1f}ms")
+
+
+def compare(results: list[dict], baseline_path: str, tolerance: float) -> list[str]:
+    with open(baseline_path) as f:
+        baseline = {(p["repo_size"], p["concurrency"]): p for p in json.load(f)["results"]}
+    regressions = []
+    for point in results:
+        base = baseline.get((point["repo_size"], point["concurrency"]))
+        if not base:
+            continue
+        key = f"repo={point['repo_size']} concurrency={point['concurrency']}"
+        if point["p95_s"] > base["p95_s"] * (1 + tolerance):
+            regressions.append(f"{key}: p95 {base['p95_s']:.3f}s -> {point['p95_s']:.3f}s")
+        if point["throughput_rps"] < base["throughput_rps"] * (1 - tolerance):
+            regressions.append(f"{key}: throughput {base['throughput_rps']:.2f} -> {point['throughput_rps']:.2f} req/s")
+        if point["errors"] > base["errors"]:
+            regressions.append(f"{key}: errors {base['errors']} -> {point['errors']}")
+    return regressions
+
+
+async def main(args) -> int:
+    profile = UpstreamProfile(
+        github_latency=args.github_latency,
+        llm_latency=args.llm_latency,
+        token_count_latency=args.token_count_latency,
+        tts_latency=args.tts_latency,
+        tts_realtime_factor=args.tts_realtime_factor,
+        ssml_words=args.ssml_words,
+    )
+    server = FakeUpstreamServer(profile).start()
+    # Must be in place before the app (and the SDKs it imports) read their configuration
+    os.environ.update(server.env())
+    # The whole sweep comes from one client address; keep the cost limiter out of the measurement
+    for bucket in ("CLIENT", "GLOBAL"):
+        os.environ.setdefault(f"RATE_LIMIT_{bucket}_CAPACITY", "1e9")
+        os.environ.setdefault(f"RATE_LIMIT_{bucket}_REFILL_PER_HOUR", "1e9")
+
+    import httpx
+    from app.main import app
+
+    install_fake_tts(profile)
+
+    results = []
+    run_id = str(int(time.time()))
+    transport = httpx.ASGITransport(app=app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+        for size_name in args.repo_sizes.split(","):
+            profile.repo_size = REPO_SIZES[size_name]
+            for concurrency in (int(c) for c in args.concurrency.split(",")):
+                point = await run_point(client, size_name, concurrency, args.requests,
+                                        not args.no_audio, args.audio_length, run_id)
+                print_point(point)
+                results.append(point)
+    server.stop()
+
+    report = {"profile": vars(args), "upstream_calls": server.calls, "results": results}
+    if args.save:
+        with open(args.save, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"\nSaved results to {args.save}")
+
+    if args.compare:
+        regressions = compare(results, args.compare, args.tolerance)
+        if regressions:
+            print("\nREGRESSIONS:")
+            for line in regressions:
+                print(f"   {line}")
+            return 1
+        print(f"\nNo regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark /generate against local upstream stand-ins")
+    parser.add_argument("--repo-sizes", default="small,medium", help=f"comma separated, from {list(REPO_SIZES)}")
+    parser.add_argument("--concurrency", default="1,4", help="comma separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=8, help="requests per sweep point")
+    parser.add_argument("--audio-length", choices=["short", "long"], default="long")
+    parser.add_argument("--no-audio", action="store_true", help="stop after SSML generation")
+    parser.add_argument("--github-latency", type=float, default=0.05)
+    parser.add_argument("--llm-latency", type=float, default=1.0)
+    parser.add_argument("--token-count-latency", type=float, default=0.1)
+    parser.add_argument("--tts-latency", type=float, default=0.5)
+    parser.add_argument("--tts-realtime-factor", type=float, default=0.02)
+    parser.add_argument("--ssml-words", type=int, default=600)
+    parser.add_argument("--save", help="write results as JSON")
+    parser.add_argument("--compare", help="baseline JSON from --save; exit 1 on regression")
+    parser.add_argument("--tolerance", type=float, default=0.1, help="allowed relative regression")
+    return parser
+
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(build_parser().parse_args())))
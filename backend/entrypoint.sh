@@ -7,6 +7,9 @@ if [ "$ENVIRONMENT" = "development" ]; then
     exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --reload
 elif [ "$ENVIRONMENT" = "production" ]; then
     echo "Starting in production mode with multiple workers..."
+    # Workers write metrics here so /metrics aggregates across processes
+    export PROMETHEUS_MULTIPROC_DIR=${PROMETHEUS_MULTIPROC_DIR:-/tmp/prometheus_multiproc}
+    rm -rf "$PROMETHEUS_MULTIPROC_DIR" && mkdir -p "$PROMETHEUS_MULTIPROC_DIR"
     exec uvicorn app.main:app --host 0.0.0.0 --port 8000 --timeout-keep-alive 300 --workers 2
 else
     echo "ENVIRONMENT must be set to either 'development' or 'production'"
@@ -0,0 +1,126 @@
+import asyncio
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.core import resilience
+from app.core.admission import AdmissionController, AdmissionRejected, stream_in_stage
+from app.core.limiter import Bucket, CostLimiter, SQLiteTokenBuckets
+from app.core.resilience import CancellationToken, RequestCancelled
+from app.routers import generate
+
+
+async def queued(controller: AdmissionController) -> asyncio.Task:
+    """Starts an acquire() that has to queue, and lets it get into the queue."""
+    task = asyncio.ensure_future(controller.acquire())
+    await asyncio.sleep(0)
+    assert not task.done()
+    return task
+
+
+def test_release_hands_the_slot_to_the_first_waiter():
+    async def scenario():
+        controller = AdmissionController("test", max_active=2, max_queue=2)
+        await controller.acquire()
+        await controller.acquire()
+        first, second = await queued(controller), await queued(controller)
+        controller.release()
+        await asyncio.sleep(0)
+        assert first.done() and not second.done()
+        assert controller._active == 2
+        controller.release()
+        await second
+        controller.release()
+        controller.release()
+        assert controller._active == 0 and not controller._waiters
+
+    asyncio.run(scenario())
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    async def scenario():
+        controller = AdmissionController("test", max_active=1, max_queue=2)
+        await controller.acquire()
+        waiter = await queued(controller)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert not controller._waiters
+        controller.release()
+        assert controller._active == 0
+
+    asyncio.run(scenario())
+
+
+def test_waiter_cancelled_after_being_handed_a_slot_passes_it_on():
+    async def scenario():
+        controller = AdmissionController("test", max_active=1, max_queue=2)
+        await controller.acquire()
+        first, second = await queued(controller), await queued(controller)
+        controller.release()  # resolves first's future
+        first.cancel()  # before first got to run
+        with pytest.raises(asyncio.CancelledError):
+            await first
+        await second
+        assert controller._active == 1
+
+    asyncio.run(scenario())
+
+
+def test_full_queue_is_shed_with_retry_after():
+    async def scenario():
+        controller = AdmissionController("test", max_active=2, max_queue=1, initial_job_seconds=30)
+        await controller.acquire()
+        await controller.acquire()
+        await queued(controller)
+        with pytest.raises(AdmissionRejected) as raised:
+            await controller.acquire()
+        assert raised.value.status_code == 429
+        # Two jobs ahead (the queued one and this one) over two slots of 30 s each
+        assert raised.value.headers["Retry-After"] == "30"
+
+    asyncio.run(scenario())
+
+
+def test_stream_in_stage_yields_items_and_ends():
+    def produce():
+        yield from range(3)
+
+    async def scenario():
+        return [item async for item in stream_in_stage("encode", produce)]
+
+    assert asyncio.run(scenario()) == [0, 1, 2]
+
+
+def test_stream_in_stage_raises_when_the_job_never_starts():
+    def produce():
+        yield "never"
+
+    async def scenario():
+        token = CancellationToken()
+        token.cancel()
+        resilience._cancellation.set(token)
+        # check_cancelled() fails the job before the generator runs; the consumer must not hang
+        return await asyncio.wait_for(anext(stream_in_stage("encode", produce)), timeout=2)
+
+    with pytest.raises(RequestCancelled):
+        asyncio.run(scenario())
+
+
+def test_shed_generation_is_refunded(tmp_path, monkeypatch):
+    store = SQLiteTokenBuckets(str(tmp_path / "buckets.sqlite"))
+    monkeypatch.setattr(generate, "cost_limiter", CostLimiter(store, Bucket("client", 40, 40), Bucket("global", 600, 0)))
+    full = AdmissionController("generate", max_active=1, max_queue=0)
+    full._active = 1
+    monkeypatch.setattr(generate.generate_admission, "acquire", full.acquire)
+
+    app = FastAPI()
+    app.include_router(generate.router)
+    with TestClient(app) as client:
+        response = client.post("/generate", json={"username": "user", "repo": "repo", "instructions": "",
+                                                  "audio": True})
+    assert response.status_code == 429
+    with store._connect() as conn:
+        balances = dict(conn.execute("SELECT key, tokens FROM buckets"))
+    assert balances == {"client:testclient": 40, "global": 600}
@@ -0,0 +1,54 @@
+import os
+import time
+
+import pytest
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+
+from app.routers import batch
+
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_DIR", str(tmp_path))
+    monkeypatch.setattr(batch, "BATCH_API_KEY", "secret")
+    app = FastAPI()
+    app.include_router(batch.router)
+    return TestClient(app)
+
+
+def make_batch(directory: str, age_seconds: float) -> str:
+    batch_id = os.urandom(16).hex()
+    os.makedirs(os.path.join(directory, batch_id))
+    status = os.path.join(directory, batch_id, "status.json")
+    with open(status, "w") as f:
+        f.write('{"status": "done", "items": []}')
+    past = time.time() - age_seconds
+    os.utime(status, (past, past))
+    return batch_id
+
+
+@pytest.mark.parametrize("key, status_code", [(None, 401), ("wrong", 401), ("secret", 404)])
+def test_api_key(client, key, status_code):
+    headers = {"x-api-key": key} if key else {}
+    assert client.get(f"/batch/{'0' * 32}", headers=headers).status_code == status_code
+
+
+def test_expired_batches_are_pruned(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(batch, "BATCH_TTL_SECONDS", 3600)
+    old, recent = make_batch(str(tmp_path), 7200), make_batch(str(tmp_path), 60)
+    batch.prune_batches()
+    headers = {"x-api-key": "secret"}
+    assert client.get(f"/batch/{old}", headers=headers).status_code == 404
+    assert client.get(f"/batch/{recent}", headers=headers).json()["status"] == "done"
+
+
+def test_ssml_is_served_apart_from_the_audio(client, tmp_path):
+    batch_id = make_batch(str(tmp_path), 0)
+    with open(os.path.join(tmp_path, batch_id, "0.ssml"), "w") as f:
+        f.write("<speak/>")
+    headers = {"x-api-key": "secret"}
+    response = client.get(f"/batch/{batch_id}/items/0/ssml", headers=headers)
+    assert response.text == "<speak/>"
+    assert response.headers["content-type"].startswith("application/ssml+xml")
+    assert client.get(f"/batch/{batch_id}/items/0/audio", headers=headers).status_code == 404
@@ -0,0 +1,89 @@
+from app.services import content_minimizer
+from app.services.content_minimizer import ContentMinimizer, cap_lines, compact_tree, strip_comments
+
+PARAGRAPH = "This project turns any GitHub repository into a podcast that walks through its architecture."
+
+
+def test_cap_lines(monkeypatch):
+    monkeypatch.setattr(content_minimizer, "MAX_LINE_CHARS", 10)
+    assert cap_lines("short   \n" + "x" * 25) == "short\nxxxxxxxxxx ...[15 more chars]"
+
+
+def test_cap_lines_replaces_encoded_data():
+    assert cap_lines("logo = '" + "QUJD" * 50 + "'") == "logo = '<encoded data, 200 chars>'"
+
+
+def test_strip_hash_comments():
+    source = "# License header\nimport os\n    # indented comment\nx = 1  # trailing comments stay\n"
+    assert strip_comments("app/main.py", source) == "import os\nx = 1  # trailing comments stay"
+
+
+def test_strip_slash_comments():
+    source = "/*\n * License header\n */\nconst a = 1;\n// note\n/* inline */ const b = 2;\nconst url = 'http://x';"
+    assert strip_comments("src/index.ts", source) == "const a = 1;\n const b = 2;\nconst url = 'http://x';"
+
+
+def test_strip_markup_comments():
+    assert strip_comments("README.md", "Intro<!-- hidden\nnote -->\n# Heading") == "Intro\n# Heading"
+
+
+def test_unknown_languages_are_left_alone():
+    source = "# not a comment in this format\n// nor this"
+    assert strip_comments("data.csv", source) == source
+
+
+def test_compact_tree_collapses_crowded_directories(monkeypatch):
+    monkeypatch.setattr(content_minimizer, "MAX_TREE_SIBLINGS", 3)
+    monkeypatch.setattr(content_minimizer, "TREE_SIBLINGS_SHOWN", 2)
+    icons = [f"icons/{i}.svg" for i in range(4)] + ["icons/index.ts"]
+    tree = "\n".join(["README.md", *icons, "icons/sub/a.svg", "src/main.py"])
+    assert compact_tree(tree) == "\n".join([
+        "README.md", "icons/0.svg", "icons/1.svg", "icons/... (3 more files: 2 .svg, 1 .ts)",
+        "icons/sub/a.svg", "src/main.py",
+    ])
+
+
+def test_blocks_already_seen_are_dropped_across_parts():
+    minimizer = ContentMinimizer()
+    readme = minimizer.readme(f"# Title\n\n{PARAGRAPH}\n\n## Usage")
+    assert readme == f"# Title\n\n{PARAGRAPH}\n\n## Usage"
+    # Same paragraph, differently wrapped, in a docs page: only its new part is kept
+    docs = minimizer.file("docs/intro.md", f"{PARAGRAPH.replace(' a podcast', chr(10) + 'a podcast')}\n\nMore text.")
+    assert docs == "More text."
+
+
+def test_files_with_nothing_new_are_reported_as_dropped():
+    minimizer = ContentMinimizer()
+    minimizer.readme(PARAGRAPH)
+    assert minimizer.file("docs/copy.md", PARAGRAPH) == ""
+    assert minimizer.dropped_files == ["docs/copy.md"]
+
+
+def test_code_loses_blank_lines_and_counts_savings():
+    minimizer = ContentMinimizer()
+    source = "# comment\nimport os\n\n\ndef main():\n    pass\n"
+    assert minimizer.file("main.py", source) == "import os\ndef main():\n    pass"
+    assert minimizer.chars_before["files"] == len(source)
+    assert minimizer.chars_after["files"] == len("import os\ndef main():\n    pass")
+    assert minimizer.tokens_saved() == (len(source) - 29) // 4
+
+
+def test_disabled(monkeypatch):
+    monkeypatch.setattr(content_minimizer, "MINIMIZE_CONTENT", False)
+    minimizer = ContentMinimizer()
+    assert minimizer.file("main.py", "# comment\n\nx = 1") == "# comment\n\nx = 1"
+    assert minimizer.tokens_saved() == 0
+
+
+def test_hash_lines_inside_triple_quoted_strings_are_kept():
+    source = '# comment\ndef usage():\n    """\n    # Example\n    run()\n    """\n# dropped\nSQL = \'\'\'\n# kept\n\'\'\'\nx = """one line"""\n# dropped too'
+    assert strip_comments("cli.py", source) == (
+        'def usage():\n    """\n    # Example\n    run()\n    """\nSQL = \'\'\'\n# kept\n\'\'\'\nx = """one line"""'
+    )
+
+
+def test_doc_comments_are_kept():
+    source = "/**\n * Adds two numbers.\n */\nfunction add(a, b) {}\n/**/\n// note"
+    assert strip_comments("math.js", source) == "/**\n * Adds two numbers.\n */\nfunction add(a, b) {}"
+    source = "//! Crate docs\n// note\n/// Adds two numbers.\nfn add() {}\n/** Inline doc */\nfn sub() {}"
+    assert strip_comments("lib.rs", source) == "//! Crate docs\n/// Adds two numbers.\nfn add() {}\n/** Inline doc */\nfn sub() {}"
@@ -0,0 +1,56 @@
+import pytest
+
+from app.services.diagram_patch import apply_patch, number_lines, parse_patch
+
+DIAGRAM = "flowchart TB\n    A --> B\n    B --> C\n    C --> D"
+
+
+def test_number_lines():
+    assert number_lines("a\nb") == "1| a\n2| b"
+
+
+def test_parse_patch():
+    patch = "@@ replace 2-3\n    A --> X\n@@ delete 4\n@@ insert after 0\n%% title"
+    assert parse_patch(patch) == [
+        ("replace", 2, 3, ["    A --> X"]),
+        ("delete", 4, 4, []),
+        ("insert", 0, 0, ["%% title"]),
+    ]
+
+
+def test_replace_delete_and_insert_refer_to_the_original_lines():
+    patch = "@@ insert after 1\n    Z --> A\n@@ replace 2\n    A --> X\n@@ delete 4"
+    assert apply_patch(DIAGRAM, patch) == "flowchart TB\n    Z --> A\n    A --> X\n    B --> C"
+
+
+def test_replace_with_more_lines_than_it_removes():
+    assert apply_patch(DIAGRAM, "@@ replace 4\n    C --> D\n    D --> E") == DIAGRAM + "\n    D --> E"
+
+
+def test_insert_after_line_zero_prepends():
+    assert apply_patch(DIAGRAM, "@@ insert after 0\n%% generated").startswith("%% generated\nflowchart TB")
+
+
+def test_insert_at_the_edge_of_a_replaced_range():
+    patch = "@@ replace 2-3\n    A --> C\n@@ insert after 3\n    C --> E"
+    assert apply_patch(DIAGRAM, patch) == "flowchart TB\n    A --> C\n    C --> E\n    C --> D"
+
+
+def test_empty_patch_leaves_the_diagram_unchanged():
+    assert apply_patch(DIAGRAM, "") == DIAGRAM
+
+
+@pytest.mark.parametrize("patch", [
+    "@@ change 2\n    A --> X",  # unknown operation
+    "    A --> X",  # content before the first hunk
+    "@@ delete 3\n    B --> X",  # content under a delete
+    "@@ replace 5\n    E --> F",  # past the end
+    "@@ replace 3-2\n    B --> X",  # reversed range
+    "@@ delete 0",  # lines are 1-based
+    "@@ replace 2-3\n    A --> X\n@@ delete 3",  # overlapping hunks
+    "@@ insert after 2\n    X\n@@ insert after 2\n    Y",  # ambiguous order
+    "@@ replace 2-3\n    A --> X\n@@ insert after 2\n    Y",  # insert inside a replaced range
+])
+def test_invalid_patches_are_rejected(patch):
+    with pytest.raises(ValueError):
+        apply_patch(DIAGRAM, patch)
@@ -0,0 +1,77 @@
+import pytest
+
+from app.services import file_selection
+from app.services.file_selection import content_token_budget, is_binary_path, is_generated_path, pack_files
+from app.services.path_index import PathIndex
+
+
+def make_index(sizes: dict[str, int]) -> PathIndex:
+    return PathIndex({path: ("blob", size) for path, size in sizes.items()})
+
+
+def tokens(path: str, size: int) -> int:
+    return (size + len(path) + file_selection.FILE_FRAMING_CHARS) // file_selection.CHARS_PER_TOKEN + 1
+
+
+def packed_tokens(path: str, size: int) -> int:
+    """What a file takes of the budget inside pack_files, which weighs in whole units of 64 tokens."""
+    return -(-tokens(path, size) // 64) * 64
+
+
+@pytest.mark.parametrize("path, binary, generated", [
+    ("src/main.py", False, False),
+    ("assets/logo.PNG", True, False),
+    ("package-lock.json", False, True),
+    ("static/app.min.js", False, True),
+    ("api/service_pb2.py", False, True),
+    ("web/dist/index.js", False, True),
+    ("dist.py", False, False),
+])
+def test_path_filters(path, binary, generated):
+    assert is_binary_path(path) == binary
+    assert is_generated_path(path) == generated
+
+
+def test_content_token_budget():
+    assert content_token_budget(1000) == 212  # 85% of 1000 chars at 4 chars per token
+    assert content_token_budget(1000, 600) == 85
+    assert content_token_budget(1000, 2000) == 0
+
+
+def test_everything_is_kept_when_it_fits():
+    index = make_index({"a.py": 400, "b.py": 400})
+    assert pack_files(["b.py", "a.py"], index, 10_000) == ["b.py", "a.py"]
+
+
+def test_skipped_files(monkeypatch):
+    monkeypatch.setattr(file_selection, "MAX_FILE_BYTES", 1000)
+    index = make_index({"a.py": 100, "logo.png": 100, "yarn.lock": 100, "huge.py": 5000})
+    assert pack_files(["logo.png", "yarn.lock", "huge.py", "a.py"], index, 10_000) == ["a.py"]
+
+
+def test_unknown_sizes_count_as_the_largest_allowed(monkeypatch):
+    monkeypatch.setattr(file_selection, "MAX_FILE_BYTES", 4000)
+    index = make_index({"a.py": 100})
+    assert pack_files(["a.py", "not/in/tree.py"], index, 500) == ["a.py"]
+
+
+def test_higher_ranked_files_win_when_the_budget_is_short():
+    index = make_index({"first.py": 2000, "second.py": 2000, "third.py": 2000})
+    budget = packed_tokens("first.py", 2000) + packed_tokens("second.py", 2000) + 63
+    assert pack_files(["first.py", "second.py", "third.py"], index, budget) == ["first.py", "second.py"]
+
+
+def test_small_files_fill_the_room_a_large_one_would_take():
+    index = make_index({"big.py": 8000, "small1.py": 1000, "small2.py": 1000, "small3.py": 1000})
+    ranked = ["small1.py", "big.py", "small2.py", "small3.py"]
+    # big.py does not fit; the lower ranked files after it still get the room
+    budget = sum(packed_tokens(path, 1000) for path in ("small1.py", "small2.py", "small3.py"))
+    assert pack_files(ranked, index, budget) == ["small1.py", "small2.py", "small3.py"]
+
+
+def test_packed_files_never_exceed_the_budget():
+    sizes = {f"f{i}.py": 300 + 137 * i for i in range(30)}
+    index = make_index(sizes)
+    for budget in (0, 100, 1000, 3000, 7000):
+        chosen = pack_files(list(sizes), index, budget)
+        assert sum(tokens(path, sizes[path]) for path in chosen) <= budget
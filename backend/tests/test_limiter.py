@@ -0,0 +1,114 @@
+import asyncio
+import sqlite3
+
+import pytest
+from fastapi import HTTPException, Request
+
+from app.core import limiter
+from app.core.limiter import Bucket, CostLimiter, NO_REFILL_RETRY_AFTER, SQLiteTokenBuckets, client_address
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(limiter.time, "time", lambda: now[0])
+    return now
+
+
+@pytest.fixture
+def store(tmp_path):
+    return SQLiteTokenBuckets(str(tmp_path / "buckets.sqlite"))
+
+
+def balance(store: SQLiteTokenBuckets, key: str) -> float:
+    with store._connect() as conn:
+        return conn.execute("SELECT tokens FROM buckets WHERE key = ?", (key,)).fetchone()[0]
+
+
+def test_new_bucket_starts_full(store, clock):
+    bucket = Bucket("client", capacity=10, refill_per_hour=3600)
+    assert store.take([("a", bucket, 4)]) == 0
+    assert balance(store, "a") == 6
+
+
+def test_short_bucket_reports_time_until_the_charge_fits(store, clock):
+    bucket = Bucket("client", capacity=10, refill_per_hour=3600)  # one token per second
+    store.take([("a", bucket, 8)])
+    assert store.take([("a", bucket, 5)]) == pytest.approx(3)
+    assert balance(store, "a") == 2
+
+
+def test_refill_is_capped_at_capacity(store, clock):
+    bucket = Bucket("client", capacity=10, refill_per_hour=3600)
+    store.take([("a", bucket, 8)])
+    clock[0] += 5
+    store.take([("a", bucket, 0)])
+    assert balance(store, "a") == 7
+    clock[0] += 3600
+    store.take([("a", bucket, 0)])
+    assert balance(store, "a") == 10
+
+
+def test_charges_are_all_or_nothing(store, clock):
+    roomy = Bucket("client", capacity=10, refill_per_hour=3600)
+    tight = Bucket("global", capacity=2, refill_per_hour=3600)
+    assert store.take([("a", roomy, 3), ("global", tight, 3)]) > 0
+    store.take([("a", roomy, 0), ("global", tight, 0)])
+    assert balance(store, "a") == 10
+    assert balance(store, "global") == 2
+
+
+def test_debt_and_refund(store, clock):
+    bucket = Bucket("client", capacity=10, refill_per_hour=3600)
+    assert store.take([("a", bucket, 15)], allow_debt=True) == 0
+    assert balance(store, "a") == -5
+    store.take([("a", bucket, -20)], allow_debt=True)
+    assert balance(store, "a") == 10
+
+
+def test_bucket_without_refill(store, clock):
+    bucket = Bucket("client", capacity=1, refill_per_hour=0)
+    assert store.take([("a", bucket, 2)]) == NO_REFILL_RETRY_AFTER
+
+
+def test_rejected_charge_raises_429_with_retry_after(store, clock):
+    cost_limiter = CostLimiter(store, Bucket("client", 10, 3600), Bucket("global", 100, 3600))
+    asyncio.run(cost_limiter.charge("1.2.3.4", 9))
+    with pytest.raises(HTTPException) as raised:
+        asyncio.run(cost_limiter.charge("1.2.3.4", 2.5))
+    assert raised.value.status_code == 429
+    assert raised.value.headers["Retry-After"] == "2"
+
+
+def test_locked_store_fails_open(store, clock, monkeypatch):
+    def locked(*args):
+        raise sqlite3.OperationalError("database is locked")
+
+    monkeypatch.setattr(store, "take", locked)
+    cost_limiter = CostLimiter(store, Bucket("client", 1, 3600), Bucket("global", 1, 3600))
+    asyncio.run(cost_limiter.charge("1.2.3.4", 100))
+
+
+def request_from(peer: str, **headers: str) -> Request:
+    return Request({"type": "http", "method": "POST", "path": "/generate", "query_string": b"", "client": (peer, 50000),
+                    "headers": [(name.replace("_", "-").encode(), value.encode()) for name, value in headers.items()]})
+
+
+@pytest.mark.parametrize("peer, headers, address", [
+    ("172.17.0.1", {"x_real_ip": "203.0.113.7"}, "203.0.113.7"),  # nginx through docker's port mapping
+    ("127.0.0.1", {"x_forwarded_for": "10.0.0.1, 203.0.113.7"}, "203.0.113.7"),
+    ("198.51.100.2", {"x_real_ip": "203.0.113.7"}, "198.51.100.2"),  # direct client, header not believed
+    ("172.17.0.1", {}, "172.17.0.1"),
+])
+def test_client_address(peer, headers, address):
+    assert client_address(request_from(peer, **headers)) == address
+
+
+def test_clients_behind_the_proxy_get_separate_buckets(store, clock):
+    cost_limiter = CostLimiter(store, Bucket("client", 40, 40), Bucket("global", 600, 1200))
+    first = client_address(request_from("172.17.0.1", x_real_ip="203.0.113.7"))
+    second = client_address(request_from("172.17.0.1", x_real_ip="203.0.113.8"))
+    asyncio.run(cost_limiter.charge(first, 40))
+    asyncio.run(cost_limiter.charge(second, 40))
+    with pytest.raises(HTTPException):
+        asyncio.run(cost_limiter.charge(first, 1))
@@ -0,0 +1,20 @@
+import pytest
+from fastapi import Request
+
+from app.main import app, route_label
+
+
+def request(method: str, path: str) -> Request:
+    return Request({"type": "http", "method": method, "path": path, "root_path": "", "query_string": b"",
+                    "headers": [], "app": app})
+
+
+@pytest.mark.parametrize("method, path, label", [
+    ("POST", "/generate", "/generate"),
+    ("GET", "/generate/subtitles/0123456789abcdef0123456789abcdef", "/generate/subtitles/{subtitle_id}"),
+    ("GET", "/batch/0123456789abcdef0123456789abcdef/items/3/audio", "/batch/{batch_id}/items/{index}/audio"),
+    ("GET", "/generate", "/generate"),  # wrong method, still a known route
+    ("GET", "/wp-login.php", "unmatched"),
+])
+def test_route_label_is_the_route_template(method, path, label):
+    assert route_label(request(method, path)) == label
@@ -0,0 +1,120 @@
+import struct
+
+import pytest
+
+from app.services.mp3_frames import (
+    MONO, MPEG1, MPEG2, FrameHeader, Mp3Audio, _crc16, duration, info_frame, parse_header, silence_frame, stitch,
+)
+
+# The service's default output, Audio16Khz32KBitRateMonoMp3: MPEG-2, 16 kHz, 32 kbps, mono
+VERSION, SAMPLE_RATE_INDEX, BITRATE_INDEX = MPEG2, 2, 4
+SAMPLES_PER_SECOND = 16000 / 576
+
+
+def frames(count: int, bitrate_index: int = BITRATE_INDEX, sample_rate_index: int = SAMPLE_RATE_INDEX) -> bytes:
+    return silence_frame(VERSION, bitrate_index, sample_rate_index, MONO) * count
+
+
+def encoded(count: int, delay: int, padding: int) -> bytes:
+    """Frames behind an Info header with a LAME tag, like the synthesizer's output."""
+    audio = frames(count)
+    frame_length = len(frames(1))
+    like = FrameHeader(VERSION, BITRATE_INDEX, SAMPLE_RATE_INDEX, 0, MONO)
+    lame_tag = b"LAME3.100" + bytes(27)
+    header = info_frame(like, [i * frame_length for i in range(count)], len(audio), True, lame_tag, delay, padding)
+    return header + audio
+
+
+def xing_fields(data: bytes) -> tuple[bytes, int, int, bytes]:
+    header = parse_header(data, 0)
+    tag_offset = 4 + header.side_info_bytes
+    tag = data[tag_offset:tag_offset + 4]
+    _, frame_count, total_bytes = struct.unpack(">III", data[tag_offset + 4:tag_offset + 16])
+    return tag, frame_count, total_bytes, data[tag_offset + 16:tag_offset + 116]
+
+
+def test_frame_header_round_trip():
+    header = FrameHeader(MPEG1, 9, 0, 0, MONO)
+    parsed = parse_header(header.to_bytes(), 0)
+    assert (parsed.version, parsed.bitrate, parsed.sample_rate, parsed.channel_mode) == (MPEG1, 128, 44100, MONO)
+    assert parsed.length == 417
+
+
+def test_parse_header_rejects_non_frames():
+    assert parse_header(b"ID3\x04", 0) is None
+    assert parse_header(b"\xff\xfb", 0) is None
+    # Free format bitrate
+    assert parse_header(bytes([0xFF, 0xF3, 0x08, 0xC4]), 0) is None
+
+
+def test_duration_counts_frames():
+    assert duration(frames(100)) == pytest.approx(100 / SAMPLES_PER_SECOND)
+    assert duration(b"") == 0.0
+
+
+def test_tags_and_info_frame_are_not_audio():
+    id3v2 = b"ID3\x04\x00\x00" + bytes([0, 0, 0, 20]) + bytes(20)
+    id3v1 = b"TAG" + bytes(125)
+    audio = Mp3Audio(id3v2 + encoded(10, delay=576, padding=300) + id3v1)
+    assert len(audio.frames) == 10
+    assert (audio.encoder_delay, audio.encoder_padding) == (576, 300)
+
+
+def test_single_segment_is_returned_as_is():
+    segment = encoded(5, delay=576, padding=0)
+    assert stitch([segment]) is segment
+
+
+def test_stitched_duration_includes_the_pauses():
+    stitched = stitch([frames(50), frames(30), frames(20)], pause_seconds=0.6)
+    pause_frames = round(0.6 * SAMPLES_PER_SECOND)
+    assert len(Mp3Audio(stitched).frames) == 100 + 2 * pause_frames
+    assert duration(stitched) == pytest.approx((100 + 2 * pause_frames) / SAMPLES_PER_SECOND)
+
+
+def test_stitched_header_describes_the_whole_file():
+    stitched = stitch([encoded(40, delay=576, padding=100), encoded(60, delay=576, padding=900)], pause_seconds=0)
+    tag, frame_count, total_bytes, toc = xing_fields(stitched)
+    assert tag == b"Info"
+    assert frame_count == 100
+    assert total_bytes == len(stitched)
+    assert list(toc) == sorted(toc)
+
+    audio = Mp3Audio(stitched)
+    # Decoders trim the encoder delay of the first segment and the padding of the last
+    assert (audio.encoder_delay, audio.encoder_padding) == (576, 900)
+    lame_end = 4 + parse_header(stitched, 0).side_info_bytes + 116 + 36
+    assert struct.unpack(">H", stitched[lame_end - 2:lame_end])[0] == _crc16(stitched[:lame_end - 2])
+
+
+def test_mixed_bitrates_get_a_xing_header():
+    stitched = stitch([frames(10), frames(10, bitrate_index=BITRATE_INDEX + 1)], pause_seconds=0)
+    assert xing_fields(stitched)[0] == b"Xing"
+
+
+def test_segments_without_audio_are_skipped():
+    stitched = stitch([b"", frames(10), b"not an mp3"], pause_seconds=0.6)
+    assert len(Mp3Audio(stitched).frames) == 10
+    assert stitch([b"", b""]) == b""
+
+
+def test_segments_must_share_sample_rate():
+    with pytest.raises(ValueError):
+        stitch([frames(10), frames(10, sample_rate_index=1)])
+
+
+def test_webvtt_duration_comes_from_the_frames(monkeypatch):
+    from app.routers import generate
+
+    cpu_jobs = {}
+
+    def run_cpu(name, fn, *args):
+        cpu_jobs[name] = args
+        return "WEBVTT"
+
+    monkeypatch.setattr(generate, "run_cpu", run_cpu)
+    monkeypatch.setattr(generate.subtitle_store, "put", lambda vtt: "id")
+    assert generate.build_webvtt("<speak>Hi</speak>", frames(100), "mp3") == "id"
+    # Nothing decoded; the subtitles are timed by the frame count
+    assert list(cpu_jobs) == ["ssml_to_webvtt"]
+    assert cpu_jobs["ssml_to_webvtt"][1] == pytest.approx(100 / SAMPLES_PER_SECOND)
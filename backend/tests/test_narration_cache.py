@@ -0,0 +1,48 @@
+import os
+import time
+
+from app.services.narration_cache import NarrationCache, NarrationSnapshot
+
+
+def snapshot() -> NarrationSnapshot:
+    return NarrationSnapshot("tree", ["a.py"], {"a.py": "blob"}, {"intro": {"fingerprint": "f" * 64, "ssml": "<speak/>"}})
+
+
+def age(directory: str, seconds: float):
+    past = time.time() - seconds
+    for entry in os.scandir(directory):
+        os.utime(entry.path, (past, past))
+    os.utime(directory, (past, past))
+
+
+def test_round_trip(tmp_path):
+    cache = NarrationCache(str(tmp_path), ttl_seconds=3600)
+    cache.save("User", "Repo", "long", snapshot())
+    cache.save_audio("user", "repo", "long", "intro", "f" * 64, "mp3", b"audio")
+    assert cache.load("user", "repo", "long").to_dict()["segments"] == snapshot().segments
+    assert cache.load_audio("user", "repo", "long", "intro", "f" * 64, "mp3") == b"audio"
+    assert cache.load("user", "repo", "short") is None
+
+
+def test_prune_removes_repositories_unused_for_the_ttl(tmp_path):
+    cache = NarrationCache(str(tmp_path), ttl_seconds=3600)
+    cache.save("user", "old", "long", snapshot())
+    cache.save("user", "recent", "long", snapshot())
+    cache.save("user", "read", "long", snapshot())
+    for repo in ("old", "recent", "read"):
+        age(cache._dir("user", repo, "long"), 7200 if repo != "recent" else 60)
+    # Loading counts as use
+    assert cache.load("user", "read", "long") is not None
+
+    cache.prune()
+    assert cache.load("user", "old", "long") is None
+    assert cache.load("user", "recent", "long") is not None
+    assert cache.load("user", "read", "long") is not None
+
+
+def test_writes_trigger_pruning(tmp_path):
+    cache = NarrationCache(str(tmp_path), ttl_seconds=3600, prune_every=2)
+    cache.save("user", "old", "long", snapshot())
+    age(cache._dir("user", "old", "long"), 7200)
+    cache.save("user", "new", "long", snapshot())
+    assert sorted(os.listdir(tmp_path)) == [os.path.basename(cache._dir("user", "new", "long"))]
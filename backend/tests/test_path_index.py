@@ -0,0 +1,64 @@
+import pytest
+
+from app.services.path_index import PathIndex, index_tree, normalize_path
+
+
+def make_tree(*paths: str, truncated: bool = False, sha: str | None = None) -> dict:
+    return {
+        "sha": sha,
+        "truncated": truncated,
+        "tree": [{"path": path, "type": "blob", "size": 10 * len(path)} for path in paths],
+    }
+
+
+@pytest.fixture
+def index():
+    return PathIndex.from_tree(make_tree(
+        "README.md", "src/app/main.py", "src/app/models.py", "src/app/Config.py", "docs/main.md",
+        "tests/test_main.py",
+    ))
+
+
+@pytest.mark.parametrize("raw, expected", [
+    ("src/app/main.py", "src/app/main.py"),
+    ("./src//app/main.py/", "src/app/main.py"),
+    ("  `src/app/main.py`  ", "src/app/main.py"),
+    ("'/src/app/main.py'", "src/app/main.py"),
+])
+def test_normalize_path(raw, expected):
+    assert normalize_path(raw) == expected
+
+
+def test_parent_directories_are_indexed(index):
+    assert index.is_dir("src") and index.is_dir("src/app")
+    assert index.is_file("src/app/main.py")
+    assert index.size("README.md") == 90
+    assert "src/app/missing.py" not in index
+
+
+@pytest.mark.parametrize("path, expected", [
+    ("src/app/main.py", "src/app/main.py"),
+    ("SRC/APP/MAIN.PY", "src/app/main.py"),  # case
+    ("app/models.py", "src/app/models.py"),  # missing directories
+    ("src/app/config.py", "src/app/Config.py"),
+    ("src/app/model.py", "src/app/models.py"),  # misspelt sibling
+    ("src/app/unrelated.py", None),
+])
+def test_resolve(index, path, expected):
+    assert index.resolve(path) == expected
+
+
+def test_resolve_files_drops_directories_duplicates_and_unknown_paths(index):
+    picked = ["src/app/main.py", "src/app", "./src/app/main.py", "nothing/here.py", "README.md"]
+    assert index.resolve_files(picked) == ["src/app/main.py", "README.md"]
+
+
+def test_truncated_tree_keeps_paths_it_cannot_rule_out():
+    index = PathIndex.from_tree(make_tree("src/app/main.py", truncated=True))
+    assert index.resolve_files(["lib/other.py"]) == ["lib/other.py"]
+
+
+def test_index_is_built_once_per_tree_sha():
+    tree = make_tree("a.py", sha="abc123")
+    assert index_tree(tree) is index_tree(make_tree("a.py", sha="abc123"))
+    assert index_tree(make_tree("a.py")) is not index_tree(make_tree("a.py"))
@@ -0,0 +1,131 @@
+import contextvars
+
+import pytest
+
+from app.core import resilience
+from app.core.resilience import (
+    CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError, DeadlineExceeded, call_timeout, start_deadline,
+    stage_deadline,
+)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(resilience.time, "monotonic", lambda: now[0])
+    return now
+
+
+def record(breaker: CircuitBreaker, outcomes: str):
+    """Feeds one call per character: f(ailed), s(low), o(k)."""
+    for outcome in outcomes:
+        probe = breaker.before_call()
+        breaker.after_call(probe, 100 if outcome == "s" else 1, outcome == "f")
+
+
+def opened(clock) -> CircuitBreaker:
+    breaker = CircuitBreaker("test", slow_call_seconds=10)
+    record(breaker, "fffff")
+    assert breaker.state == OPEN
+    clock[0] += resilience.BREAKER_OPEN_SECONDS
+    return breaker
+
+
+def test_failures_open_the_breaker(clock):
+    breaker = CircuitBreaker("test", slow_call_seconds=10)
+    record(breaker, "ffoo")
+    assert breaker.state == CLOSED  # too few calls to judge
+    record(breaker, "f")
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.before_call()
+    assert raised.value.retry_after == resilience.BREAKER_OPEN_SECONDS
+
+
+def test_old_calls_leave_the_window(clock):
+    breaker = CircuitBreaker("test", slow_call_seconds=10)
+    record(breaker, "ff")
+    clock[0] += resilience.BREAKER_WINDOW_SECONDS + 1
+    record(breaker, "ooof")
+    assert breaker.state == CLOSED
+
+
+def test_slow_calls_open_the_breaker(clock):
+    breaker = CircuitBreaker("test", slow_call_seconds=10)
+    record(breaker, "ssso")
+    record(breaker, "o")
+    assert breaker.state == CLOSED  # 60% slow
+    breaker = CircuitBreaker("test", slow_call_seconds=10)
+    record(breaker, "sssso")
+    assert breaker.state == OPEN  # 80% slow
+
+
+def test_calls_we_interrupted_are_not_counted(clock):
+    breaker = CircuitBreaker("test", slow_call_seconds=10)
+    for _ in range(10):
+        breaker.after_call(breaker.before_call(), 100, None)
+    assert breaker.state == CLOSED and not breaker._calls
+
+
+def test_half_open_lets_a_single_probe_through(clock):
+    breaker = opened(clock)
+    assert breaker.before_call() is True
+    assert breaker.state == HALF_OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+    breaker.after_call(True, 1, False)
+    assert breaker.state == CLOSED
+    assert breaker.before_call() is False
+
+
+@pytest.mark.parametrize("seconds, failed", [(1, True), (100, False)])
+def test_failed_or_slow_probe_opens_again(clock, seconds, failed):
+    breaker = opened(clock)
+    breaker.after_call(breaker.before_call(), seconds, failed)
+    assert breaker.state == OPEN
+    with pytest.raises(CircuitOpenError):
+        breaker.before_call()
+
+
+def test_probe_we_interrupted_frees_the_probe_slot(clock):
+    breaker = opened(clock)
+    breaker.after_call(breaker.before_call(), 1, None)
+    assert breaker.state == HALF_OPEN
+    assert breaker.before_call() is True
+
+
+def in_request(fn):
+    """Runs fn in a fresh context, like a request, so deadlines don't leak between tests."""
+    return contextvars.Context().run(fn)
+
+
+def test_call_timeout_without_deadline():
+    assert in_request(lambda: call_timeout("github")) == resilience.UPSTREAM_TIMEOUTS["github"]
+
+
+def test_call_timeout_is_clamped_to_the_deadline(clock):
+    def scenario():
+        start_deadline(100)
+        assert call_timeout("github") == resilience.UPSTREAM_TIMEOUTS["github"]
+        assert call_timeout("openai") == 100
+        clock[0] += 90
+        assert call_timeout("openai") == 10
+        clock[0] += 10
+        with pytest.raises(DeadlineExceeded):
+            call_timeout("openai")
+
+    in_request(scenario)
+
+
+def test_stage_deadline_narrows_to_its_share(clock):
+    def scenario():
+        start_deadline(100)
+        with stage_deadline("fetch"):
+            assert call_timeout("openai") == 100 * resilience.STAGE_DEADLINE_SHARES["fetch"]
+        assert call_timeout("openai") == 100
+        clock[0] += 90
+        # A stage never extends the request's own deadline
+        with stage_deadline("llm"):
+            assert call_timeout("openai") == 10
+
+    in_request(scenario)
@@ -0,0 +1,36 @@
+import os
+import time
+
+from app.services.tree_cache import TreeSnapshotCache
+
+TREE = {"tree": [{"path": "a.py", "type": "blob", "size": 10}]}
+
+
+def age(cache: TreeSnapshotCache, repo: str, seconds: float):
+    past = time.time() - seconds
+    os.utime(cache._path("user", repo), (past, past))
+
+
+def test_round_trip_and_expiry(tmp_path):
+    cache = TreeSnapshotCache(str(tmp_path), ttl_seconds=300, max_entries=10)
+    cache.save("User", "Repo", TREE)
+    assert cache.load("user", "repo") == TREE
+    age(cache, "repo", 600)
+    assert cache.load("user", "repo") is None
+
+
+def test_prune_deletes_expired_then_oldest(tmp_path):
+    cache = TreeSnapshotCache(str(tmp_path), ttl_seconds=300, max_entries=2)
+    for repo, seconds in [("expired", 600), ("old", 30), ("newer", 20), ("newest", 10)]:
+        cache.save("user", repo, TREE)
+        age(cache, repo, seconds)
+    cache.prune()
+    assert sorted(os.listdir(tmp_path)) == sorted(os.path.basename(cache._path("user", repo))
+                                                  for repo in ("newer", "newest"))
+
+
+def test_writes_trigger_pruning(tmp_path):
+    cache = TreeSnapshotCache(str(tmp_path), ttl_seconds=300, max_entries=1, prune_every=3)
+    for repo in ("a", "b", "c"):
+        cache.save("user", repo, TREE)
+    assert len(os.listdir(tmp_path)) == 1
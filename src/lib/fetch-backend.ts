@@ -159,7 +159,16 @@ interface GenerateAudioResponse {
 
       const audioBlob = await response.blob();
       const audioBuffer = await blobToBuffer(audioBlob);
-      const vttContent = response.headers.get("x-vtt-content");
+
+      // Subtitles are served as their own (gzip, cacheable) resource
+      let vttContent = "";
+      const vttUrl = response.headers.get("x-vtt-url");
+      if (vttUrl) {
+        const vttResponse = await fetch(new URL(vttUrl, baseUrl));
+        if (vttResponse.ok) {
+          vttContent = b64encode(Buffer.from(await vttResponse.text(), "utf-8"));
+        }
+      }
 
       // Call the server action to cache the diagram
      await cacheAudioAndWebVtt(
@@ -204,6 +213,8 @@ export async function modifyAndCacheDiagram(
         instructions: instructions,
         current_diagram: currentDiagram,
         explanation: explanation,
+        // Only changed lines come back from the model and are applied server side
+        mode: "diff",
       }),
     });
 